@@ -80,11 +80,35 @@ def gui():
     # process data
     processing_frame = tk.Frame(root)
     processing_frame.pack(padx=10, pady=10)
+    fused_time_series = tk.BooleanVar()
+    summary_only_time_series = tk.BooleanVar()
+    lazy_profiles = tk.BooleanVar()
+    concurrent_stages = tk.BooleanVar()
     processing_button = tk.Button(processing_frame,
                                   text="Process files",
                                   command=lambda: process.process(dl_dir_text,
-                                                                  data_dir_text))
+                                                                  data_dir_text,
+                                                                  fused_time_series.get(),
+                                                                  summary_only_time_series.get(),
+                                                                  lazy_profiles.get(),
+                                                                  concurrent=concurrent_stages.get()))
     processing_button.pack(side=tk.LEFT)
+    fused_check = tk.Checkbutton(processing_frame,
+                                 text="Fused per-trial time series processing",
+                                 variable=fused_time_series)
+    fused_check.pack(side=tk.LEFT, padx=10)
+    summary_only_check = tk.Checkbutton(processing_frame,
+                                        text="Trial summaries only (no time series written)",
+                                        variable=summary_only_time_series)
+    summary_only_check.pack(side=tk.LEFT, padx=10)
+    lazy_profiles_check = tk.Checkbutton(processing_frame,
+                                         text="Attach profiles when reading (no profiled copies written)",
+                                         variable=lazy_profiles)
+    lazy_profiles_check.pack(side=tk.LEFT, padx=10)
+    concurrent_check = tk.Checkbutton(processing_frame,
+                                      text="Run independent stages concurrently",
+                                      variable=concurrent_stages)
+    concurrent_check.pack(side=tk.LEFT, padx=10)
     
 
     # exit button
@@ -1,10 +1,18 @@
 ''' subpackage contains modules for processing data unique to the ASIST study 4 dataset '''
 from . import download
+from . import archive
 from . import extract
 from . import dedup
 from . import etl
 from . import metadata
+from . import collate
+from . import workspace
 from . import survey
+from . import assembly
 from . import team
+from . import timebase
+from . import features
 from . import timeseries
-from . import analysis
\ No newline at end of file
+from . import dataset
+from . import analysis
+from . import benchmark
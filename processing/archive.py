@@ -0,0 +1,159 @@
+''' functions for cataloging the trial zip archives and reading their members by offset '''
+
+import os
+import io
+import struct
+import zipfile
+import zlib
+import pandas as pd
+from tqdm import tqdm
+
+ARCHIVE_CATALOG_FILE = 'archive_catalog.csv'
+ARCHIVE_CATALOG_COLUMNS = ['zip_file', 'zip_size', 'zip_mtime', 'error', 'member', 'file_size', 'compress_size',
+                           'compress_type', 'crc', 'header_offset']
+
+# fixed part of a zip local file header: signature, versions, flags, method, times, crc, sizes,
+# name length and extra field length
+LOCAL_HEADER = struct.Struct('<4s2B4HL2L2H')
+LOCAL_HEADER_SIGNATURE = b'PK\x03\x04'
+CHUNK_SIZE = 1024 ** 2
+
+
+###############################
+# functions for archive catalog
+###############################
+
+def catalog_archive(zip_path):
+    """Catalog rows of one archive: a row per member with its sizes, compression, CRC and local
+    header offset, or a single row without member if the archive is empty or unreadable."""
+    archive = {'zip_file': os.path.basename(zip_path),
+               'zip_size': os.path.getsize(zip_path),
+               'zip_mtime': os.path.getmtime(zip_path),
+               'error': ''}
+    try:
+        with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+            infos = [info for info in zip_ref.infolist() if not info.is_dir()]
+    except zipfile.BadZipFile as e:
+        return [{**archive, 'error': str(e), 'member': ''}]
+    if not infos:
+        return [{**archive, 'member': ''}]
+    return [{**archive,
+             'member': info.filename,
+             'file_size': info.file_size,
+             'compress_size': info.compress_size,
+             'compress_type': info.compress_type,
+             'crc': info.CRC,
+             'header_offset': info.header_offset} for info in infos]
+
+
+def load_archive_catalog(zip_dir_path, catalog_file_path=None):
+    """Catalog of the zip archives of a directory, read from its csv and refreshed for the archives
+    added, removed or changed (size or mtime) since it was written. Returns a dict of archive file
+    name to {'path', 'error', 'members'}, members being a dict of member name to catalog entry."""
+    catalog_file_path = catalog_file_path or os.path.join(zip_dir_path, ARCHIVE_CATALOG_FILE)
+    zip_files = sorted(file for file in os.listdir(zip_dir_path) if file.endswith('.zip'))
+
+    cached = {}
+    if os.path.exists(catalog_file_path):
+        catalog_df = pd.read_csv(catalog_file_path, dtype={'zip_file': str, 'error': str, 'member': str},
+                                 keep_default_na=False, na_values={'file_size': [''], 'compress_size': [''],
+                                                                   'compress_type': [''], 'crc': [''],
+                                                                   'header_offset': ['']},
+                                 float_precision='round_trip')
+        for zip_file, rows in catalog_df.groupby('zip_file', sort=False):
+            cached[zip_file] = rows.to_dict('records')
+
+    rows, changed = [], len(cached) != len(zip_files)
+    for zip_file in tqdm(zip_files):
+        zip_path = os.path.join(zip_dir_path, zip_file)
+        archive_rows = cached.get(zip_file)
+        if (archive_rows is None or archive_rows[0]['zip_size'] != os.path.getsize(zip_path)
+                or archive_rows[0]['zip_mtime'] != os.path.getmtime(zip_path)):
+            archive_rows = catalog_archive(zip_path)
+            changed = True
+        rows.extend(archive_rows)
+    if changed:
+        os.makedirs(os.path.dirname(os.path.abspath(catalog_file_path)), exist_ok=True)
+        pd.DataFrame(rows, columns=ARCHIVE_CATALOG_COLUMNS).to_csv(catalog_file_path, index=False)
+
+    catalog = {}
+    for row in rows:
+        archive = catalog.setdefault(row['zip_file'], {'path': os.path.join(zip_dir_path, row['zip_file']),
+                                                      'error': row['error'],
+                                                      'members': {}})
+        if row['member']:
+            archive['members'][row['member']] = {**row, 'zip_path': archive['path']}
+    return catalog
+
+
+def member_entries(catalog, match):
+    """Catalog entries of the members, across all archives, whose name satisfies match."""
+    return [entry for archive in catalog.values() for name, entry in archive['members'].items() if match(name)]
+
+
+#######################################
+# functions for reading archive members
+#######################################
+
+def iter_member_chunks(entry):
+    """Decompressed chunks of an archive member, read from its local header offset without parsing
+    the archive's central directory. The CRC is checked at the end."""
+    compress_type = int(entry['compress_type'])
+    if compress_type not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+        with zipfile.ZipFile(entry['zip_path'], 'r') as zip_ref, zip_ref.open(entry['member']) as member_file:
+            while chunk := member_file.read(CHUNK_SIZE):
+                yield chunk
+        return
+
+    decompressor = zlib.decompressobj(-15) if compress_type == zipfile.ZIP_DEFLATED else None
+    crc = 0
+    with open(entry['zip_path'], 'rb') as zip_file:
+        zip_file.seek(int(entry['header_offset']))
+        header = LOCAL_HEADER.unpack(zip_file.read(LOCAL_HEADER.size))
+        if header[0] != LOCAL_HEADER_SIGNATURE:
+            raise zipfile.BadZipFile(f"Bad local header for {entry['member']} in {entry['zip_path']}")
+        zip_file.seek(header[-2] + header[-1], os.SEEK_CUR)
+        remaining = int(entry['compress_size'])
+        while remaining > 0:
+            chunk = zip_file.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                raise zipfile.BadZipFile(f"Truncated {entry['member']} in {entry['zip_path']}")
+            remaining -= len(chunk)
+            if decompressor is not None:
+                chunk = decompressor.decompress(chunk)
+            crc = zlib.crc32(chunk, crc)
+            yield chunk
+        if decompressor is not None:
+            chunk = decompressor.flush()
+            crc = zlib.crc32(chunk, crc)
+            yield chunk
+    if crc != int(entry['crc']):
+        raise zipfile.BadZipFile(f"Bad CRC for {entry['member']} in {entry['zip_path']}")
+
+
+def read_member(entry):
+    """Contents of an archive member."""
+    return b''.join(iter_member_chunks(entry))
+
+
+def open_member(entry):
+    """Archive member as a binary file object."""
+    return io.BytesIO(read_member(entry))
+
+
+def iter_member_lines(entry):
+    """Lines of an archive member as bytes without their line breaks, streamed chunk by chunk."""
+    pending = b''
+    for chunk in iter_member_chunks(entry):
+        lines = (pending + chunk).split(b'\n')
+        pending = lines.pop()
+        yield from lines
+    if pending:
+        yield pending
+
+
+def copy_member(entry, file_path):
+    """Write an archive member to a file, streaming it chunk by chunk."""
+    with open(file_path, 'wb') as target:
+        for chunk in iter_member_chunks(entry):
+            target.write(chunk)
@@ -0,0 +1,178 @@
+''' functions for searching hypothetical teams drawn from the profiled player pool '''
+
+import os
+import itertools
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+from processing import survey
+
+ASSEMBLY_ATTRIBUTE_COLUMNS = list(survey.PROFILE_PERCENT_COLUMNS)
+ASSEMBLY_MEMORY_CAP_BYTES = 256 * 1024 ** 2
+
+
+###########################
+# functions for player pool
+###########################
+
+def player_pool(df, attribute_columns=ASSEMBLY_ATTRIBUTE_COLUMNS, id_column='PLAYER_ID'):
+    """Player ids and attribute values of the profiled players: the first row of each player with
+    finite values for all attributes."""
+    df = df[df[id_column].notna()].replace([np.inf, -np.inf], np.nan).dropna(subset=attribute_columns)
+    df = df.drop_duplicates(id_column)
+    return df[id_column].to_numpy(), df[attribute_columns].to_numpy(dtype='float64')
+
+
+def read_player_pool(individual_player_profiles_trial_measures_combined_file_path,
+                     attribute_columns=ASSEMBLY_ATTRIBUTE_COLUMNS, id_column='PLAYER_ID'):
+    """Player pool of the combined individual player profiles, with the profile percentages."""
+    df = survey.preprocess_df(pd.read_csv(individual_player_profiles_trial_measures_combined_file_path))
+    return player_pool(df, attribute_columns, id_column)
+
+
+###############################
+# functions for candidate teams
+###############################
+
+def chunk_size_for(team_size, n_attributes, memory_cap_bytes=ASSEMBLY_MEMORY_CAP_BYTES):
+    """Number of candidate teams per chunk keeping the scoring arrays of a chunk under the cap."""
+    # pairwise differences dominate: teams x players x players x attributes, plus a few copies
+    bytes_per_team = 8 * (3 * team_size * team_size * n_attributes + 4 * team_size * n_attributes + 16)
+    return max(1, int(memory_cap_bytes // bytes_per_team))
+
+
+def compatible_pairs(values, max_pair_distance):
+    """Players whose attribute distance is at most max_pair_distance, as a boolean matrix."""
+    distances = np.sqrt(((values[:, None, :] - values[None, :, :]) ** 2).sum(axis=2))
+    return distances <= max_pair_distance
+
+
+def combination_chunk(candidates, size, chunk_size):
+    """Next chunk of size-combinations from an itertools.combinations iterator, as an int array."""
+    flat = np.fromiter(itertools.chain.from_iterable(itertools.islice(candidates, chunk_size)),
+                       dtype=np.int64, count=-1)
+    return flat.reshape(-1, size)
+
+
+def candidate_teams(n_players, team_size, chunk_size, required_player=None, compatible=None):
+    """Chunks of candidate teams of the pool, as arrays of player indexes of shape (teams,
+    team_size). With required_player every team includes that player. With a compatible matrix,
+    teams holding an incompatible pair are pruned; the later players are drawn only among those
+    compatible with the first one, so pruned branches are never enumerated."""
+    first_players = range(n_players) if required_player is None else [required_player]
+    pair_columns = list(itertools.combinations(range(team_size), 2))
+    pending, pending_count = [], 0
+    for first in first_players:
+        others = np.arange(first + 1, n_players) if required_player is None \
+            else np.delete(np.arange(n_players), required_player)
+        if compatible is not None:
+            others = others[compatible[first, others]]
+        combinations = itertools.combinations(others.tolist(), team_size - 1)
+        while True:
+            rest = combination_chunk(combinations, team_size - 1, chunk_size)
+            if not len(rest):
+                break
+            teams = np.column_stack([np.full(len(rest), first), rest])
+            if compatible is not None:
+                keep = np.ones(len(teams), dtype=bool)
+                for a, b in pair_columns[team_size - 1:]:
+                    keep &= compatible[teams[:, a], teams[:, b]]
+                teams = teams[keep]
+            pending.append(teams)
+            pending_count += len(teams)
+            if pending_count >= chunk_size:
+                chunk = np.concatenate(pending)
+                yield chunk[:chunk_size]
+                pending, pending_count = [chunk[chunk_size:]], len(chunk) - chunk_size
+    if pending_count:
+        yield np.concatenate(pending)
+
+
+###########################
+# functions for team search
+###########################
+
+def keep_within(measures, thresholds):
+    """Mask of the scored teams whose measures lie within the (low, high) thresholds of each
+    measure, either end None for open."""
+    keep = np.ones(len(next(iter(measures.values()))), dtype=bool)
+    for measure, (low, high) in (thresholds or {}).items():
+        if low is not None:
+            keep &= measures[measure] >= low
+        if high is not None:
+            keep &= measures[measure] <= high
+    return keep
+
+
+def merge_top_k(best, teams, measures, rank_by, ascending, top_k):
+    """Merge a chunk of scored teams into the running top-K, kept as arrays of teams and measures."""
+    if best is not None:
+        teams = np.concatenate([best[0], teams])
+        measures = {measure: np.concatenate([best[1][measure], values]) for measure, values in measures.items()}
+    keys = measures[rank_by] if ascending else -measures[rank_by]
+    keys = np.where(np.isnan(keys), np.inf, keys)
+    if len(keys) > top_k:
+        selected = np.argpartition(keys, top_k - 1)[:top_k]
+        teams, measures = teams[selected], {measure: values[selected] for measure, values in measures.items()}
+    return teams, measures
+
+
+def team_frame(pool_ids, teams, measures):
+    """Candidate teams as a table of player ids and alignment measures."""
+    df = pd.DataFrame({f'player_{i + 1}': pool_ids[teams[:, i]] for i in range(teams.shape[1])})
+    for measure, values in measures.items():
+        df[measure] = values
+    return df
+
+
+def search_teams(pool_ids, pool_values, team_size, rank_by='geometric_alignment', ascending=True, top_k=100,
+                 required_player=None, max_pair_distance=None, thresholds=None, candidates_file_path=None,
+                 memory_cap_bytes=ASSEMBLY_MEMORY_CAP_BYTES):
+    """Score every team of team_size players drawn from the pool with the alignment measures of
+    survey.batch_alignments, in chunks sized to memory_cap_bytes, and return the top_k teams ranked
+    by rank_by. required_player (a player id) restricts the search to teams including that player,
+    max_pair_distance prunes teams holding a pair of players further apart, and thresholds, a dict
+    of measure to (low, high), drops scored teams outside the bounds. Every kept team is streamed
+    to candidates_file_path if given."""
+    chunk_size = chunk_size_for(team_size, pool_values.shape[1], memory_cap_bytes)
+    required_index = None
+    if required_player is not None:
+        matches = np.flatnonzero(pool_ids == required_player)
+        if not len(matches):
+            raise KeyError(f"Player {required_player} is not in the player pool")
+        required_index = int(matches[0])
+    compatible = compatible_pairs(pool_values, max_pair_distance) if max_pair_distance is not None else None
+
+    if candidates_file_path and os.path.exists(candidates_file_path):
+        os.remove(candidates_file_path)
+    best, scored, kept = None, 0, 0
+    for teams in tqdm(candidate_teams(len(pool_ids), team_size, chunk_size, required_index, compatible)):
+        measures = survey.batch_alignments(pool_values[teams])
+        scored += len(teams)
+        keep = keep_within(measures, thresholds)
+        if not keep.all():
+            teams, measures = teams[keep], {measure: values[keep] for measure, values in measures.items()}
+        kept += len(teams)
+        if candidates_file_path:
+            team_frame(pool_ids, teams, measures).to_csv(candidates_file_path, mode='a', index=False,
+                                                        header=not os.path.exists(candidates_file_path))
+        if top_k:
+            best = merge_top_k(best, teams, measures, rank_by, ascending, top_k)
+    print(f"Scored {scored} candidate teams, kept {kept}")
+
+    if best is None:
+        return team_frame(pool_ids, np.empty((0, team_size), dtype=np.int64),
+                          {measure: np.array([]) for measure in survey.ALIGNMENT_MEASURES})
+    top_df = team_frame(pool_ids, *best)
+    return top_df.sort_values(rank_by, ascending=ascending, kind='stable', na_position='last').reset_index(drop=True)
+
+
+def write_team_assembly_search(individual_player_profiles_trial_measures_combined_file_path, output_file_path,
+                               team_size=3, top_k=100, **search_options):
+    """Write the top_k hypothetical teams of the profiled player pool, see search_teams for the
+    search options."""
+    print("Searching hypothetical team assemblies...")
+    pool_ids, pool_values = read_player_pool(individual_player_profiles_trial_measures_combined_file_path)
+    top_df = search_teams(pool_ids, pool_values, team_size, top_k=top_k, **search_options)
+    top_df.to_csv(output_file_path, index=False)
+    return top_df
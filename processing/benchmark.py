@@ -0,0 +1,727 @@
+''' functions for benchmarking processing stages '''
+
+import os
+import glob
+import json
+import time
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+from processing import timeseries, survey, team, incremental
+
+
+def directory_size(dir_path):
+    """Total size in bytes of all files below a directory."""
+    total = 0
+    for root, _, files in os.walk(dir_path):
+        for file in files:
+            total += os.path.getsize(os.path.join(root, file))
+    return total
+
+
+def timed(function, *args):
+    """Result of function(*args) and its wall-clock seconds."""
+    start_time = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start_time
+
+
+def synthetic_ids(prefix, count, width=6):
+    """Ids of a synthetic dataset, the prefix followed by the zero-padded number."""
+    return np.array([f'{prefix}{number:0{width}d}' for number in range(count)])
+
+
+def synthetic_scores(rng, rows, low, high, missing=0.0, decimals=0):
+    """Random scores uniform in [low, high], rounded to decimals unless None, the given share of them missing."""
+    values = rng.uniform(low, high, rows)
+    if decimals is not None:
+        values = np.round(values, decimals)
+    values[rng.random(rows) < missing] = np.nan
+    return values
+
+
+def split_dir_paths(base_dir_path):
+    """Output directories of split_time_series below a base directory, in argument order."""
+    return [os.path.join(base_dir_path, name) for name in ["player_states_items_objects",
+                                                            "player_states_flocking",
+                                                            "flocking",
+                                                            "team_behaviors_asi_flocking",
+                                                            "team_behaviors_flocking",
+                                                            "team_behaviors_asi"]]
+
+
+def benchmark_fused_time_series(metadata_unique_dir_path,
+                                individual_player_profiles_trial_measures_combined_file_path,
+                                team_player_profiles_trial_measures_combined_file_path,
+                                work_dir_path,
+                                max_workers=None):
+    """Run the staged and the fused time series pipelines into separate work directories and
+    report the wall-clock and bytes-written reduction of the fused mode."""
+    staged_dir_path = os.path.join(work_dir_path, "staged")
+    fused_dir_path = os.path.join(work_dir_path, "fused")
+
+    start_time = time.perf_counter()
+    cleaned_dir_path = os.path.join(staged_dir_path, "processed_time_series_cleaned")
+    profiled_dir_path = os.path.join(staged_dir_path, "processed_time_series_cleaned_profiles")
+    staged_split_dir_paths = split_dir_paths(os.path.join(staged_dir_path, "processed_time_series_split"))
+    timeseries.extract_and_write_time_series(metadata_unique_dir_path, cleaned_dir_path)
+    timeseries.add_profiles_to_time_series(cleaned_dir_path,
+                                           individual_player_profiles_trial_measures_combined_file_path,
+                                           team_player_profiles_trial_measures_combined_file_path,
+                                           profiled_dir_path)
+    timeseries.summarize_events(profiled_dir_path, os.path.join(staged_dir_path, "processed_trial_summary"))
+    timeseries.split_time_series(profiled_dir_path, *staged_split_dir_paths)
+    staged_seconds = time.perf_counter() - start_time
+    staged_bytes = directory_size(staged_dir_path)
+
+    fused = timeseries.run_fused_time_series(metadata_unique_dir_path,
+                                             individual_player_profiles_trial_measures_combined_file_path,
+                                             team_player_profiles_trial_measures_combined_file_path,
+                                             os.path.join(fused_dir_path, "processed_trial_summary"),
+                                             *split_dir_paths(os.path.join(fused_dir_path, "processed_time_series_split")),
+                                             max_workers=max_workers)
+
+    print(f"Staged: {staged_seconds:.1f}s, {staged_bytes / 1e6:.1f} MB written")
+    print(f"Fused:  {fused['seconds']:.1f}s, {fused['bytes_written'] / 1e6:.1f} MB written")
+    print(f"Reduction: {staged_seconds / max(fused['seconds'], 1e-9):.2f}x wall-clock, "
+          f"{(1 - fused['bytes_written'] / max(staged_bytes, 1)) * 100:.0f}% fewer bytes written")
+    return {'staged_seconds': staged_seconds, 'staged_bytes_written': staged_bytes,
+            'fused_seconds': fused['seconds'], 'fused_bytes_written': fused['bytes_written']}
+
+
+def summarize_frame_with_helpers(df):
+    """One-row trial summary built by calling each per-metric summary helper of timeseries on the
+    whole DataFrame, the way summaries were made before the declarative engine."""
+    # Call the function and store its return value
+    mission_state_change_outcome = timeseries.record_state_change_outcome_with_prefix(df)
+
+    summary = {
+        **timeseries.count_tool_usage(df),
+        'Max_Store_Visits_flocking': timeseries.max_flocking_visits(df),
+        **timeseries.count_playerstate_ppe(df),
+        'Trial_Info_Experiment_Mission': timeseries.record_trial_info_experiment_mission(df),
+        'Communication_Messages_Count': timeseries.count_communication_messages(df),
+        'Intervention_Responses_Count': timeseries.count_intervention_responses(df),
+        'Trial_Info_Condition': timeseries.record_trial_info_condition(df),
+        **timeseries.record_trial_info_subjects(df),  # Ensure this isn't duplicating with the line below
+        'Trial_Info_Subjects': timeseries.record_trial_info_subjects(df)['trial_info_subjects'],  # Adjust based on actual function return
+        'PlayerState_Is_Frozen_Count': timeseries.count_playerstate_is_frozen(df),
+        'Mission_State_Change_Outcome': mission_state_change_outcome,  # Directly use the returned value
+        'Trial_Info_Map_Name': timeseries.record_trial_info_map_name(df),
+        'trial_ID': timeseries.record_trial_info_trial_id(df),  # Ensure key consistency (Trial_ID vs trial_id)
+        **timeseries.count_toolused_target_block_type(df),
+        **timeseries.count_uiclick_element_id(df),
+        **timeseries.count_communicationchat_source(df),
+        **timeseries.count_sprinting_start(df),
+        **timeseries.count_interventionchat_b_id(df),
+        **timeseries.record_team_budget_lowest(df),
+        **timeseries.count_objectstatechange_outcome_by_type(df),
+        **timeseries.count_chat_sender(df),
+        **timeseries.count_uiclick_meta_action(df),
+        **timeseries.count_communicationchat_message(df),
+        **timeseries.record_max_flocking_time_in_store(df),
+        **timeseries.count_playerstatechanged_health(df),
+        **timeseries.find_highest_score_per_participant(df),
+        **timeseries.count_interventionchat_b_source(df),
+        **timeseries.retain_one_entry_for_columns(df, [
+            'team_teamwork_potential_score', 'team_teamwork_potential_category',
+            'team_taskwork_potential_score_liberal', 'team_taskwork_potential_category_liberal',
+            'team_taskwork_potential_score_conservative', 'team_taskwork_potential_category_conservative',
+            'geometric_alignment_allattributes', 'physical_alignment_allattributes',
+            'algebraic_alignment_allattributes', 'centroid_physical_alignment_allattributes',
+            'geometric_alignment_teamworkattributes', 'physical_alignment_teamworkattributes',
+            'algebraic_alignment_teamworkattributes',
+            'centroid_physical_alignment_teamworkattributes',
+            'geometric_alignment_taskworkattributes', 'physical_alignment_taskworkattributes',
+            'algebraic_alignment_taskworkattributes',
+            'centroid_physical_alignment_taskworkattributes'
+        ])
+    }
+
+    summary_for_csv = {key: value if not isinstance(value, dict) else json.dumps(value) for key, value in summary.items()}
+    summary_df = pd.DataFrame([summary_for_csv])
+    return summary_df
+
+
+def benchmark_summary_engine(processed_time_series_cleaned_profiled_dir_path):
+    """Time the declarative summary engine against the per-helper summary on each profiled trial,
+    checking both produce the same summary row."""
+    print("Benchmarking trial summaries...")
+    files = sorted(glob.glob(os.path.join(processed_time_series_cleaned_profiled_dir_path, '*.csv')))
+    helpers_total, engine_total = 0.0, 0.0
+    for filepath in files:
+        df = pd.read_csv(filepath, low_memory=False)
+        expected, helpers_seconds = timed(summarize_frame_with_helpers, df)
+        summary, engine_seconds = timed(timeseries.summarize_frame, df)
+        pd.testing.assert_frame_equal(summary, expected)
+        helpers_total += helpers_seconds
+        engine_total += engine_seconds
+        print(f"{os.path.basename(filepath)}: {len(df)} rows, helpers {helpers_seconds * 1000:.1f} ms, "
+              f"engine {engine_seconds * 1000:.1f} ms")
+    print(f"Total: helpers {helpers_total:.2f}s, engine {engine_total:.2f}s "
+          f"({helpers_total / max(engine_total, 1e-9):.2f}x)")
+    return {'helpers_seconds': helpers_total, 'engine_seconds': engine_total, 'trials': len(files)}
+
+
+def synthetic_individual_measures_combined(players=10000, max_trials=4, team_size=3, seed=0):
+    """Synthetic combined individual measures: each player plays 1 to max_trials trials in teams of
+    team_size, with a row per player and trial and the survey item columns of the real data."""
+    rng = np.random.default_rng(seed)
+    slots = rng.permutation(np.repeat(np.arange(players), rng.integers(1, max_trials + 1, players)))
+    df = pd.DataFrame({'trial_id': synthetic_ids('T', len(slots))[np.arange(len(slots)) // team_size],
+                       'PLAYER_ID': synthetic_ids('P', players)[slots]})
+    for column in survey.INDIVIDUAL_MEASURES_UNIQUE_COLUMNS_TO_DELETE + ['SCORE', 'AGE']:
+        df[column] = synthetic_scores(rng, len(df), 1, 7)
+    return df
+
+
+def individual_measures_unique_frame_per_player(data):
+    """Unique individual measures compiled one player at a time, scanning the data for the trials and
+    the teammates of each player."""
+    # Initialize a list to hold the data for the new DataFrame
+    compiled_data = []
+
+    # Iterate over each unique PLAYER_ID to compile its information
+    for player_id in tqdm(data['PLAYER_ID'].unique()):
+        player_data = data[data['PLAYER_ID'] == player_id]
+
+        # Get all trial_ids for this PLAYER_ID
+        unique_trial_ids = player_data['trial_id'].unique()
+
+        # Initialize the info dictionary with necessary information from the first row
+        info = player_data.iloc[0].to_dict()
+
+        # Initialize Number_of_Trials
+        info['Number_of_Trials'] = len(unique_trial_ids)
+
+        # Iterate over each unique trial_id and teamed_with_ids to create dynamic columns
+        for i, trial_id in enumerate(unique_trial_ids, start=1):
+            # Get all unique PLAYER_IDs associated with this trial_id, excluding the current PLAYER_ID
+            teamed_with_ids = data[(data['trial_id'] == trial_id) & (data['PLAYER_ID'] != player_id)]['PLAYER_ID'].unique()
+
+            # Dynamic column names for trial_id and associated PLAYER_IDs
+            trial_column_name = f'associated_trial_id_{i}'
+            teamed_column_name = f'Teamed_With_{i}'
+
+            # Populate info dictionary with trial_id and teamed_with_ids
+            info[trial_column_name] = trial_id
+            info[teamed_column_name] = ', '.join(map(str, teamed_with_ids))
+
+        # Append this compiled info to our list
+        compiled_data.append(info)
+
+    # Convert compiled_data to a DataFrame
+    return pd.DataFrame(compiled_data)
+
+
+def benchmark_individual_measures_unique(players=10000):
+    """Time the grouped unique individual measures against the per-player loop on a synthetic
+    dataset, checking both produce the same frame."""
+    print("Benchmarking unique individual measures...")
+    data = synthetic_individual_measures_combined(players)
+    expected, per_player_seconds = timed(individual_measures_unique_frame_per_player, data)
+    compiled_df, grouped_seconds = timed(survey.individual_measures_unique_frame, data)
+    pd.testing.assert_frame_equal(compiled_df, expected, check_dtype=False)
+    print(f"{players} players, {len(data)} rows: per player {per_player_seconds:.2f}s, grouped {grouped_seconds:.2f}s "
+          f"({per_player_seconds / max(grouped_seconds, 1e-9):.1f}x)")
+    return {'per_player_seconds': per_player_seconds, 'grouped_seconds': grouped_seconds, 'rows': len(data)}
+
+
+def synthetic_individual_measures_unique(participants=10000, missing=0.05, seed=0):
+    """Synthetic unique individual measures holding 1 to 7 answers to every item of INSTRUMENTS,
+    each answer missing with the given probability."""
+    rng = np.random.default_rng(seed)
+    items = dict.fromkeys(item for instrument in survey.INSTRUMENTS.values() for item in instrument['items'])
+    return pd.DataFrame({item: synthetic_scores(rng, participants, 1, 7, missing) for item in items})
+
+
+def calculate_averages_by_row(df):
+    """PsychCollect and SociableDom averages of the complete responses, one row at a time."""
+    # Calculate 'PsychCollect_avg' for complete responses
+    psych_collect_cols = [f'PSY_COL-{i}' for i in range(1, 16)]
+    df['PsychCollect_avg'] = df[psych_collect_cols].apply(lambda row: row.mean() if row.notnull().all() else None,
+                                                          axis=1)
+
+    # Calculate 'SociableDom_avg' for complete responses
+    sociable_dom_cols = [f'SOC_DOM-{i}' for i in range(1, 16)]
+    df['SociableDom_avg'] = df[sociable_dom_cols].apply(lambda row: row.mean() if row.notnull().all() else None, axis=1)
+
+    return df
+
+
+def calculate_reading_mind_score_by_row(df):
+    """Count of correct RMIE answers, one row at a time."""
+    conditions = {
+        'RMIE_short-1': [2],
+        'RMIE_short-2': [2],
+        'RMIE_short-3': [3],
+        'RMIE_short-4': [1],
+        'RMIE_short-5': [1],
+        'RMIE_short-6': [1],
+        'RMIE_short-7': [1],
+        'RMIE_short-8': [2],
+        'RMIE_short-9': [1],
+        'RMIE_short-10': [4],
+    }
+
+    def score(row):
+        if row[conditions.keys()].isnull().all():
+            return np.nan  # Return NaN if all RMIE responses are missing
+        return sum(row[col] in valid_answers for col, valid_answers in conditions.items() if col in row)
+
+    df['ReadingMind_score'] = df.apply(score, axis=1)
+
+    return df
+
+
+def calculate_spatial_ability_avg_by_row(df):
+    """Average of the answered SBSOD items with reverse coding, one row at a time."""
+    sbsod_cols = [f'SBSOD-{i}' for i in range(1, 16)]
+    reverse_coded_items = [2, 6, 8, 10, 11, 12, 13, 15]
+
+    def reverse_code(item, value):
+        if item in reverse_coded_items:
+            return abs(8 - value)
+        return value
+
+    def spatial_ability_score(row):
+        scores = []
+        for i, col in enumerate(sbsod_cols, 1):
+            if not np.isnan(row[col]):
+                scores.append(reverse_code(i, row[col]))
+        if scores:
+            return np.mean(scores)
+        return None  # Return None if there are no SBSOD responses
+
+    df['SpatialAbility_avg'] = df.apply(spatial_ability_score, axis=1)
+
+    return df
+
+
+def calculate_mc_prof_avg_by_row(df):
+    """Weighted MC_PROF_15 average, one row at a time."""
+    mc_prof_cols = [f'MC_PROF_15-{i}' for i in range(1, 16)]  # Include all columns through MC_PROF_15-15
+
+    def mc_prof_score(row):
+        if row[mc_prof_cols].isnull().all():
+            return np.nan  # Return NaN if all MC_PROF_15 responses are missing
+
+        # Initialize the score with NaN, which will be updated if there are valid responses
+        score = np.nan
+
+        # Check for non-null values and perform the calculation only if they exist
+        if not row[mc_prof_cols[:7]].isnull().any():
+            # Applying the transformation as per the Excel formula
+            transformed_scores = (
+                                         np.nansum([
+                                             row['MC_PROF_15-1'] * 5,
+                                             row['MC_PROF_15-2'] * 5,
+                                             row['MC_PROF_15-3'] * 5,
+                                             row['MC_PROF_15-4'] * 14.285,
+                                             row['MC_PROF_15-5'] * 14.285,
+                                             row['MC_PROF_15-6'] * 14.285,
+                                             row['MC_PROF_15-7'] * 14.285
+                                         ]) + np.nansum(row[mc_prof_cols[7:]])) / 15
+            score = transformed_scores
+
+        return score
+
+    df['MCProf_avg'] = df.apply(mc_prof_score, axis=1)
+
+    return df
+
+
+def score_instruments_by_row(df):
+    """Instrument scores of the survey answers computed row by row."""
+    for calculate in [calculate_averages_by_row, calculate_reading_mind_score_by_row,
+                      calculate_spatial_ability_avg_by_row, calculate_mc_prof_avg_by_row]:
+        df = calculate(df)
+    return df
+
+
+def benchmark_instrument_scoring(participants=10000):
+    """Time the instrument registry scoring against the row-wise scoring on a synthetic dataset,
+    checking both produce the same scores."""
+    print("Benchmarking survey instrument scoring...")
+    data = synthetic_individual_measures_unique(participants)
+    expected, by_row_seconds = timed(score_instruments_by_row, data.copy())
+    scored, registry_seconds = timed(survey.score_instruments, data.copy())
+    pd.testing.assert_frame_equal(scored, expected, check_exact=True)
+    print(f"{participants} participants: row-wise {by_row_seconds:.2f}s, registry {registry_seconds * 1000:.1f} ms "
+          f"({by_row_seconds / max(registry_seconds, 1e-9):.0f}x)")
+    return {'by_row_seconds': by_row_seconds, 'registry_seconds': registry_seconds}
+
+
+def synthetic_player_profiles(teams=5000, team_sizes=(1, 2, 3, 4), seed=0):
+    """Synthetic player profile percentages for teams of varied sizes, some values missing."""
+    rng = np.random.default_rng(seed)
+    sizes = rng.choice(team_sizes, teams, p=[0.05, 0.15, 0.6, 0.2] if len(team_sizes) == 4 else None)
+    trial_ids = np.repeat(synthetic_ids('T', teams), sizes)
+    df = pd.DataFrame({'trial_id': rng.permutation(trial_ids)})
+    for column, high in [('PsychCollect_avg', 5), ('SociableDom_avg', 5), ('ReadingMind_score', 10),
+                         ('SpatialAbility_avg', 7), ('MCProf_avg', 100)]:
+        df[column] = synthetic_scores(rng, len(df), 0, high, missing=0.02, decimals=1)
+    return survey.preprocess_df(df)
+
+
+def calculate_alignment_per_team(df, attribute_columns, grouping_variable):
+    """Alignments of each team computed one team at a time, skipping players with missing attributes."""
+    # Ensure no infinite values and fill NaNs, for example, with zeros or mean of the column
+    df_cleaned = df.replace([np.inf, -np.inf], np.nan).dropna(subset=attribute_columns)
+    # df_cleaned = df.replace([np.inf, -np.inf], np.nan).fillna(0) # Alternative: Replace NaNs with 0
+
+    # Initialize a DataFrame to store the results
+    results = []
+
+    # Iterate over unique groups (teams)
+    for trial_id in df_cleaned[grouping_variable].unique():
+        team_data = df_cleaned[df_cleaned[grouping_variable] == trial_id][attribute_columns].values
+
+        # Check for any remaining NaN or Inf values
+        if np.isnan(team_data).any() or np.isinf(team_data).any():
+            print(f"Skipping trial_id {trial_id} due to NaN or Inf values in team data.")
+            continue
+
+        # Calculate each type of alignment
+        geom_align = survey.geometric_alignment(team_data)
+        phys_align = survey.physical_alignment(team_data)
+        alg_align = survey.algebraic_alignment(team_data)
+        cent_phys_align = survey.centroid_physical_alignment(team_data)
+
+        # Store results
+        results.append({
+            'trial_id': trial_id,
+            'geometric_alignment': geom_align,
+            'physical_alignment': phys_align,
+            'algebraic_alignment': alg_align,
+            'centroid_physical_alignment': cent_phys_align
+        })
+
+    # Convert results to a DataFrame
+    results_df = pd.DataFrame(results)
+    return results_df
+
+
+def benchmark_team_alignment(teams=5000):
+    """Time the batched team alignment against the per-team alignment on a synthetic dataset,
+    checking both agree to float tolerance."""
+    print("Benchmarking team alignment...")
+    df = synthetic_player_profiles(teams)
+    attribute_sets = [
+        ['PsychCollect_avg_percent', 'SociableDom_avg_percent', 'ReadingMind_score_percent', 'SpatialAbility_avg_percent', 'MCProf_avg_percent'],
+        ['PsychCollect_avg_percent', 'SociableDom_avg_percent', 'ReadingMind_score_percent'],
+        ['SpatialAbility_avg_percent', 'MCProf_avg_percent']
+    ]
+    expected, per_team_seconds = timed(lambda: [calculate_alignment_per_team(df, attribute_columns, 'trial_id')
+                                                for attribute_columns in attribute_sets])
+    results, batched_seconds = timed(survey.calculate_alignments, df, attribute_sets, 'trial_id')
+    for result_df, expected_df in zip(results, expected):
+        pd.testing.assert_frame_equal(result_df, expected_df, check_dtype=False, rtol=1e-9)
+    print(f"{teams} teams, {len(attribute_sets)} attribute sets: per team {per_team_seconds:.2f}s, "
+          f"batched {batched_seconds * 1000:.1f} ms ({per_team_seconds / max(batched_seconds, 1e-9):.0f}x)")
+    return {'per_team_seconds': per_team_seconds, 'batched_seconds': batched_seconds}
+
+
+def synthetic_team_player_profiles(trials=20000, players=5000, repeat=0.3, seed=0):
+    """Synthetic team player profiles: a Team_Members list, in its string form as read from disk,
+    and a StartTimestamp per trial, a share of the teams replaying an earlier team."""
+    rng = np.random.default_rng(seed)
+    player_ids = synthetic_ids('P', players)
+    teams = []
+    for trial in range(trials):
+        if teams and rng.random() < repeat:
+            teams.append(list(rng.permutation(teams[rng.integers(len(teams))])))
+        else:
+            teams.append(list(rng.choice(player_ids, rng.choice([2, 3, 4], p=[0.2, 0.6, 0.2]), replace=False)))
+    return pd.DataFrame({'trial_id': synthetic_ids('T', trials),
+                         'Team_Members': [str([str(player) for player in members]) for members in teams],
+                         'StartTimestamp': rng.permutation(trials)})
+
+
+def team_combination_counts_by_row(team_members):
+    """Running count of each sorted team combination, kept in a dict one row at a time."""
+    # Initialize a dictionary to keep track of team combination counts
+    team_counts = {}
+    # List to store the count for each row
+    counts = []
+
+    for team in team_members:
+        # Convert team list to a tuple so it can be used as a dictionary key
+        team_tuple = tuple(sorted(team))
+        # If the team combination has been seen, increment the count, otherwise start at 1
+        if team_tuple in team_counts:
+            team_counts[team_tuple] += 1
+        else:
+            team_counts[team_tuple] = 1
+        # Append the current count for this team combination to the counts list
+        counts.append(team_counts[team_tuple])
+    return counts
+
+
+def benchmark_team_index(trials=20000, queries=1000):
+    """Time the team index against the row-wise repeat counting, and its lookups against scans of the
+    trials, on a synthetic dataset, checking both agree."""
+    print("Benchmarking team index...")
+    df = synthetic_team_player_profiles(trials).sort_values(by='StartTimestamp')
+    team_members = team.parse_team_members(df['Team_Members'])
+    expected, by_row_seconds = timed(team_combination_counts_by_row, team_members)
+
+    def index_and_count():
+        keys = team.team_keys(team_members)
+        index = team.build_team_index(df['trial_id'], keys)
+        return keys, index, team.team_combination_counts(index, keys)
+    (keys, index, counts), index_seconds = timed(index_and_count)
+    assert counts.tolist() == expected
+
+    # scans of the trials answering the same questions, for a sample of teams and players
+    rng = np.random.default_rng(0)
+    sample = [keys[row] for row in rng.integers(len(keys), size=queries)]
+    trial_ids = df['trial_id'].tolist()
+    scanned, scan_seconds = timed(lambda: [
+        ([trial_id for trial_id, other in zip(trial_ids, keys) if other == key],
+         sorted({other for other in keys if other != key and len(set(key) & set(other)) >= 2}),
+         len(set().union(*(other for other in keys if key[0] in other)) - {key[0]}))
+        for key in sample])
+    looked_up, lookup_seconds = timed(lambda: [(team.trials_of_team(index, key), team.teams_sharing_members(index, key),
+                                                team.coplay_degree(index, key[0])) for key in sample])
+    for (trials_scanned, sharing_scanned, degree_scanned), (trials_found, sharing_found, degree_found) \
+            in zip(scanned, looked_up):
+        assert trials_scanned == trials_found and degree_scanned == degree_found
+        assert sharing_scanned == sorted(members for members, _ in sharing_found)
+    print(f"{trials} trials, {len(index['team_ids'])} teams: repeat counts row-wise {by_row_seconds:.2f}s, "
+          f"index build and counts {index_seconds:.2f}s; {queries} team queries scanned {scan_seconds:.2f}s, "
+          f"looked up {lookup_seconds * 1000:.1f} ms ({scan_seconds / max(lookup_seconds, 1e-9):.0f}x)")
+    return {'by_row_seconds': by_row_seconds, 'index_seconds': index_seconds, 'scan_seconds': scan_seconds,
+            'lookup_seconds': lookup_seconds}
+
+
+def synthetic_trial_player_profiles(trials=20000, team_sizes=(2, 3, 4), seed=0):
+    """Synthetic combined player profiles and trial measures: one row per player of each trial,
+    with the columns aggregated into the trial level team profiles."""
+    rng = np.random.default_rng(seed)
+    sizes = rng.choice(team_sizes, trials)
+    rows = int(sizes.sum())
+    df = pd.DataFrame({'trial_id': np.repeat(synthetic_ids('T', trials), sizes),
+                       'participant_ID': synthetic_ids('P', trials)[rng.integers(trials, size=rows)],
+                       'Number_of_Trials': rng.integers(1, 9, rows)})
+    columns = list(team.TEAM_AVERAGE_COLUMNS) + list(team.TEAM_PRSS_AVERAGE_COLUMNS) \
+        + team.TEAM_ADDITIONAL_AVERAGE_COLUMNS
+    for column in columns:
+        df[column] = synthetic_scores(rng, rows, 1, 7, missing=0.05)
+    return df
+
+
+def calculate_team_potential_categories_by_row(team_profiles):
+    """Team potential scores and their categories, each category labelled value by value."""
+    # Calculate team potential categories based on the sum of certain above_median columns
+    teamwork_vars = [
+        'Team_PsychCollect_avg_above_median',
+        'Team_SociableDom_avg_above_median',
+        'Team_ReadingMind_score_above_median'
+    ]
+    taskwork_vars_liberal = [
+        'Team_SpatialAbility_avg_above_median',
+        'Team_MCProf_avg_above_median'
+    ]
+
+    taskwork_vars_conservative = taskwork_vars_liberal  # Same variables, different condition
+
+    # Teamwork potential category
+    team_profiles['Team_teamwork_potential_score'] = team_profiles[teamwork_vars].sum(axis=1)
+    team_profiles['Team_teamwork_potential_category'] = team_profiles['Team_teamwork_potential_score'].apply(
+        lambda x: 'High Teamwork Pot' if x >= 2 else 'Low Teamwork Pot'
+    )
+
+    # Taskwork potential category - liberal
+    team_profiles['Team_taskwork_potential_score_liberal'] = team_profiles[taskwork_vars_liberal].sum(axis=1)
+    team_profiles['Team_taskwork_potential_category_liberal'] = team_profiles[
+        'Team_taskwork_potential_score_liberal'].apply(
+        lambda x: 'High Taskwork Pot' if x >= 1 else 'Low Taskwork Pot'
+    )
+
+    # Taskwork potential category - conservative
+    team_profiles['Team_taskwork_potential_score_conservative'] = team_profiles[taskwork_vars_conservative].sum(axis=1)
+    team_profiles['Team_taskwork_potential_category_conservative'] = team_profiles[
+        'Team_taskwork_potential_score_conservative'].apply(
+        lambda x: 'High Taskwork Pot' if x == 2 else 'Low Taskwork Pot'
+    )
+
+    return team_profiles
+
+
+def calculate_team_averages_and_members(df, group_by_col, source_target_map):
+    """Team averages of the mapped columns, Number_of_Trials statistics and members of each group."""
+    # Group by 'trial_ID' and calculate the mean for the specified columns
+    team_averages = df.groupby(group_by_col).agg({source: 'mean' for source in source_target_map.keys()}).reset_index()
+
+    # Calculate the sum, max, min, and range of 'Number_of_Trials' for each group
+    team_trials_stats = df.groupby(group_by_col)['Number_of_Trials'].agg(['sum', 'max', 'min']).reset_index()
+    team_trials_stats['Number_of_Trials_Range'] = team_trials_stats['max'] - team_trials_stats['min']
+    team_trials_stats.rename(columns={'sum': 'Team_Number_of_Trials_Sum', 'max': 'Number_of_Trials_Max', 'min': 'Number_of_Trials_Min'}, inplace=True)
+
+    # Merge the team averages with the team trials stats
+    team_averages = pd.merge(team_averages, team_trials_stats, on=group_by_col)
+
+    # Rename columns to the target variable names
+    team_averages.rename(columns=source_target_map, inplace=True)
+
+    # Additionally, create a list of participant_IDs for each trial_id
+    team_members = df.groupby(group_by_col)['participant_ID'].apply(list).reset_index()
+    team_members.rename(columns={'participant_ID': 'Team_Members'}, inplace=True)
+
+    # Merge the team averages with the team members based on 'trial_id'
+    team_profiles = pd.merge(team_averages, team_members, on=group_by_col)
+
+    return team_profiles
+
+
+def calculate_common_categories(df, group_by_col):
+    """Most common potential category of each group."""
+    # Function to calculate the most common category for teamwork and taskwork potentials
+    def most_common(x):
+        # Using pandas mode function which can handle non-numeric data
+        modes = x.mode()
+        if not modes.empty:
+            return modes[0]  # Return the first mode in case of multiple modes
+        else:
+            return None
+
+    common_categories = df.groupby(group_by_col)[
+        ['Team_teamwork_potential_category', 'Team_taskwork_potential_category_liberal', 'Team_taskwork_potential_category_conservative']
+    ].agg(most_common).reset_index()
+
+    common_categories.rename(columns={
+        'Team_teamwork_potential_category': 'Team_teamwork_potential_category_fromAggregate',
+        'Team_taskwork_potential_category_liberal': 'Team_taskwork_potential_category_fromLiberalAggregate',
+        'Team_taskwork_potential_category_conservative': 'Team_taskwork_potential_category_fromConservativeAggregate'
+    }, inplace=True)
+
+    return common_categories
+
+
+def calculate_prss_team_averages(df):
+    """PRSS team averages of each trial."""
+    # Group by 'trial_id' and calculate the mean for PRSS-related columns
+    prss_averages = df.groupby('trial_id').agg({column: 'mean' for column in team.TEAM_PRSS_AVERAGE_COLUMNS}).reset_index()
+
+    # Rename the columns to the specified target variable names
+    prss_averages.rename(columns=team.TEAM_PRSS_AVERAGE_COLUMNS, inplace=True)
+
+    return prss_averages
+
+
+def calculate_additional_team_averages(df):
+    """Team averages of the additional columns of each trial."""
+    # Define the columns for which we need to calculate averages
+    additional_columns = team.TEAM_ADDITIONAL_AVERAGE_COLUMNS
+
+    # Group by 'trial_id' and calculate the mean for each specified column
+    additional_averages = df.groupby('trial_id').agg({col: 'mean' for col in additional_columns}).reset_index()
+
+    # Rename the columns to include '_TeamAvg' suffix for clarity
+    additional_averages.rename(columns={col: f'{col}_TeamAvg' for col in additional_columns}, inplace=True)
+
+    return additional_averages
+
+
+def trial_level_team_profiles_frame_by_merge(df):
+    """Team profile of each trial built from separate groupby passes merged on trial_id."""
+    # Define the mapping from source variables to target variables after averaging across team members
+    source_target_map = team.TEAM_AVERAGE_COLUMNS
+
+    # Calculate team averages and members
+    team_profiles = calculate_team_averages_and_members(df, 'trial_id', source_target_map)
+
+    # Calculate PRSS-related team averages
+    prss_averages = calculate_prss_team_averages(df)
+    team_profiles = pd.merge(team_profiles, prss_averages, on='trial_id', how='left')
+
+    # Calculate additional team averages
+    additional_averages = calculate_additional_team_averages(df)
+    # Debugging print statement to check columns before merging
+    # print("Columns in additional_averages before merging:", additional_averages.columns.tolist())
+    team_profiles = pd.merge(team_profiles, additional_averages, on='trial_id', how='left')
+    # Debugging print statement to check columns after merging
+    # print("Columns in team_profiles after merging with additional_averages:", team_profiles.columns.tolist())
+
+    # Calculate if team averages are above or equal to the median for each measure
+    team_variables = list(source_target_map.values())
+    team_profiles = team.calculate_team_above_median(team_profiles, team_variables)
+
+    # Calculate team potential categories
+    team_profiles = calculate_team_potential_categories_by_row(team_profiles)
+
+    # Calculate common categories based on individual classifications
+    # Pass 'team_profiles' instead of 'df' here
+    common_categories = calculate_common_categories(team_profiles, 'trial_id')
+    team_profiles = pd.merge(team_profiles, common_categories, on='trial_id', how='left')
+    return team_profiles
+
+
+def benchmark_trial_level_team_profiles(trials=20000):
+    """Time the single pass named aggregation of the trial level team profiles against the merged
+    groupby passes on a synthetic dataset, checking both agree."""
+    print("Benchmarking trial level team profiles...")
+    df = synthetic_trial_player_profiles(trials)
+    expected, by_merge_seconds = timed(trial_level_team_profiles_frame_by_merge, df.copy())
+    result, aggregation_seconds = timed(team.trial_level_team_profiles_frame, df.copy())
+    pd.testing.assert_frame_equal(result, expected, check_dtype=False)
+    print(f"{trials} trials, {len(df)} player rows: merged passes {by_merge_seconds:.2f}s, "
+          f"named aggregation {aggregation_seconds:.2f}s ({by_merge_seconds / max(aggregation_seconds, 1e-9):.1f}x)")
+    return {'by_merge_seconds': by_merge_seconds, 'aggregation_seconds': aggregation_seconds}
+
+
+def synthetic_instrument_scores(participants=100000, seed=0):
+    """Synthetic instrument scores of INSTRUMENTS, a share of them missing, as scored by
+    survey.score_instruments."""
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({'PLAYER_ID': synthetic_ids('P', participants, width=7)})
+    for column in survey.INSTRUMENTS:
+        df[column] = synthetic_scores(rng, participants, 1, 7, missing=0.05, decimals=None)
+    return df
+
+
+def benchmark_incremental_medians(participants=100000, batches=20, batch_size=100):
+    """Time appending batches of players to a table classified against its medians through
+    incremental.classify_rows, as an append does, against reclassifying the whole table after each
+    batch, checking both agree. classify_rows keeps running medians from
+    incremental.RUNNING_MEDIAN_MIN_ROWS rows on; they are also timed forced on whatever the table
+    size, to check that threshold."""
+    print("Benchmarking incremental medians...")
+    columns = list(survey.INSTRUMENTS)
+    df = synthetic_instrument_scores(participants + batches * batch_size)
+    initial = survey.calculate_potential_scores_and_categories(
+        survey.calculate_above_median(df.iloc[:participants].copy(), columns))
+
+    def reclassify_all():
+        expected = initial
+        for batch in range(batches):
+            expected = pd.concat([expected, df.iloc[participants + batch * batch_size:][:batch_size]],
+                                 ignore_index=True)
+            expected = survey.calculate_potential_scores_and_categories(
+                survey.calculate_above_median(expected, columns))
+        return expected
+
+    def classify_batches(min_rows):
+        result, flipped = initial, 0
+        states = {column: incremental.median_state(result[column]) for column in columns}
+        for batch in range(batches):
+            rows_df = df.iloc[participants + batch * batch_size:][:batch_size].copy()
+            positions = len(result) + np.arange(len(rows_df))
+            result, rewritten = incremental.classify_rows(result, positions, rows_df, states, columns,
+                                                          survey.calculate_potential_scores_and_categories,
+                                                          min_rows=min_rows)
+            flipped += len(rewritten) - len(positions)
+        return result, flipped
+
+    expected, full_seconds = timed(reclassify_all)
+    (result, flipped), incremental_seconds = timed(classify_batches, incremental.RUNNING_MEDIAN_MIN_ROWS)
+    (running_result, _), running_seconds = timed(classify_batches, 0)
+    pd.testing.assert_frame_equal(result, expected, check_dtype=False)
+    pd.testing.assert_frame_equal(running_result, expected, check_dtype=False)
+    print(f"{participants} players, {batches} batches of {batch_size}: full reclassification {full_seconds:.2f}s, "
+          f"classify_rows {incremental_seconds:.2f}s ({full_seconds / max(incremental_seconds, 1e-9):.1f}x), "
+          f"running medians forced {running_seconds:.2f}s ({full_seconds / max(running_seconds, 1e-9):.1f}x), "
+          f"{flipped} rows flipped")
+    return {'full_seconds': full_seconds, 'incremental_seconds': incremental_seconds,
+            'running_seconds': running_seconds, 'flipped': flipped}
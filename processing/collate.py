@@ -0,0 +1,49 @@
+''' functions for collating many small csv files into one '''
+
+import os
+import csv
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+from tqdm import tqdm
+
+
+def read_header(file_path):
+    """Column names of a csv file as pd.read_csv names them, None if the file is empty."""
+    try:
+        return list(pd.read_csv(file_path, nrows=0, dtype=str).columns)
+    except pd.errors.EmptyDataError:
+        return None
+
+
+def read_as_text(file_path):
+    """Read a csv file with every cell kept as its original text."""
+    return pd.read_csv(file_path, dtype=str, keep_default_na=False)
+
+
+def collate_csv_files(file_paths, output_file_path, max_workers=None, batch_size=64):
+    """Concatenate csv files into one, with the columns of all files in order of first appearance.
+    The schema is taken from the headers up front, the files are read by a thread pool and each
+    batch is aligned to the schema and appended to the output, so only one batch is held in memory.
+    Cells are copied as text; a column missing from a file is left blank for its rows."""
+    file_paths = sorted(file_paths)
+    headers = {file_path: read_header(file_path) for file_path in file_paths}
+    file_paths = [file_path for file_path in file_paths if headers[file_path] is not None]
+    columns = list(dict.fromkeys(column for file_path in file_paths for column in headers[file_path]))
+
+    with open(output_file_path, 'w', newline='', encoding='utf-8') as output_file:
+        if columns:
+            csv.writer(output_file).writerow(columns)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            with tqdm(total=len(file_paths)) as progress:
+                for start in range(0, len(file_paths), batch_size):
+                    batch = list(executor.map(read_as_text, file_paths[start:start + batch_size]))
+                    batch_df = pd.concat([df.reindex(columns=columns) for df in batch], ignore_index=True)
+                    batch_df.to_csv(output_file, header=False, index=False)
+                    progress.update(len(batch))
+    return output_file_path
+
+
+def collate_directory(dir_path, suffix, output_file_path, max_workers=None):
+    """Collate the csv files of a directory whose names end with a suffix."""
+    file_paths = [os.path.join(dir_path, file) for file in os.listdir(dir_path) if file.endswith(suffix)]
+    return collate_csv_files(file_paths, output_file_path, max_workers=max_workers)
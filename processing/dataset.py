@@ -0,0 +1,282 @@
+''' functions for loading parts of trial time series through a trial catalog '''
+
+import os
+import io
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+from processing import timebase
+
+TRIAL_CATALOG_FILE = 'trial_catalog.csv'
+TRIAL_INDEX_SUFFIX = '_TrialIndex.npz'
+TIME_COLUMN = 'estimated_elapsed_ms'
+# elapsed times relative to the mission stage and to the trial's first message, computed over the
+# whole trial when it is indexed and attached to the rows load_trial selects
+INDEX_ELAPSED_COLUMNS = ['estimated_elapsed_ms_stage', 'estimated_elapsed_ms_global']
+# columns add_elapsed_columns reads
+ELAPSED_SOURCE_COLUMNS = ['timestamp', 'mission_state', 'elapsed_milliseconds', 'mission_stage']
+
+# columns each message subtype's extractor writes, matched case-insensitively, besides the ids,
+# timestamps and elapsed times every subtype writes
+SUBTYPE_COLUMNS = {
+    'trial': ['trial_info_experiment_id', 'trial_info_trial_id', 'trial_info_name', 'trial_info_date',
+              'trial_info_subjects', 'trial_info_condition', 'trial_info_experiment_name',
+              'trial_info_experiment_mission', 'trial_info_map_name'],
+    'Measure:flocking': ['flocking_phase', 'flocking_td', 'flocking_period', 'flocking_time_in_store',
+                         'flocking_separation', 'flocking_cohesion', 'flocking_alignment', 'elapsed_ms_field',
+                         'flocking_visits_to_store', 'straightline_distance', 'incremental_distance',
+                         'stationary_time', 'overlap', 'nonoverlap', 'ratio'],
+    'Event:PlayerState': ['mission_timer', 'player_state_motion_x', 'player_state_motion_y', 'player_state_motion_z',
+                          'player_state_x', 'player_state_y', 'player_state_z', 'player_state_yaw',
+                          'player_state_pitch', 'player_state_obs_id'],
+    'Event:UIClick': ['UIClick_call_sign_code', 'UIClick_meta_action', 'UIClick_element_id'],
+    'Event:Chat': ['Chat_addressees', 'Chat_sender', 'Chat_text'],
+    'Event:CommunicationChat': ['CommunicationChat_source', 'CommunicationChat_environment',
+                                'CommunicationChat_recipients', 'CommunicationChat_message_id',
+                                'CommunicationChat_message', 'CommunicationChat_sender_id'],
+    'Event:CommunicationEnvironment': ['CommunicationEnvironment_sender_x', 'CommunicationEnvironment_sender_y',
+                                       'CommunicationEnvironment_sender_z', 'CommunicationEnvironment_bomb_id',
+                                       'CommunicationEnvironment_fuse_start_minute',
+                                       'CommunicationEnvironment_remaining_sequence',
+                                       'CommunicationEnvironment_chained_id', 'CommunicationEnvironment_recipients',
+                                       'CommunicationEnvironment_sender_type', 'CommunicationEnvironment_message_id',
+                                       'CommunicationEnvironment_message', 'CommunicationEnvironment_sender_id'],
+    'Event:ToolUsed': ['ToolUsed_target_block_x', 'ToolUsed_target_block_y', 'ToolUsed_target_block_z',
+                       'ToolUsed_tool_type', 'ToolUsed_target_block_type'],
+    'Event:ObjectStateChange': ['ObjectStateChange_sequence', 'ObjectStateChange_fuse_start_minute',
+                                'ObjectStateChange_active', 'ObjectStateChange_outcome',
+                                'ObjectStateChange_triggering_entity', 'ObjectStateChange_x', 'ObjectStateChange_y',
+                                'ObjectStateChange_z', 'ObjectStateChange_id', 'ObjectStateChange_type'],
+    'Event:ScoreChange': ['teamScore', 'playerScore'],
+    'Event:ItemUsed': ['ItemUsed_target_x', 'ItemUsed_target_y', 'ItemUsed_target_z', 'ItemUsed_item_id',
+                       'ItemUsed_item_name'],
+    'Event:InterventionChat': ['InterventionChat_source', 'InterventionChat_duration', 'InterventionChat_receivers',
+                               'InterventionChat_response_options', 'InterventionChat_id',
+                               'InterventionChat_content', 'InterventionChat_explanation'],
+    'Intervention:Chat': ['InterventionChat_b_source', 'InterventionChat_b_duration', 'InterventionChat_b_receivers',
+                          'InterventionChat_b_response_options', 'InterventionChat_b_id',
+                          'InterventionChat_b_explanation', 'InterventionChat_b_content'],
+    'Event:InterventionResponse': ['InterventionResponse_response_index', 'InterventionResponse_intervention_id',
+                                   'InterventionResponse_agent_id'],
+    'Event:PlayerStateChange': ['PlayerStateChanged_source_x', 'PlayerStateChanged_source_y',
+                                'PlayerStateChanged_source_z', 'PlayerStateChanged_source_type',
+                                'PlayerStateChanged_source_id', 'PlayerStateChanged_changedAttributes',
+                                'PlayerStateChanged_is_frozen', 'PlayerStateChanged_ppe_equipped',
+                                'PlayerStateChanged_health', 'PlayerStateChanged_player_x',
+                                'PlayerStateChanged_player_y', 'PlayerStateChanged_player_z'],
+    'Event:PlayerSprinting': ['sprinting'],
+    'Event:MissionState': ['mission_state', 'state_change_outcome'],
+    'Event:TeamBudgetUpdate': ['team_budget'],
+    'Event:MissionStageTransition': ['mission_stage', 'transitions_to_shop', 'transitions_to_field', 'team_budget'],
+}
+
+# recently loaded trial selections, least recently used first
+TRIAL_CACHE = OrderedDict()
+TRIAL_CACHE_MAX_BYTES = 512 * 1024 ** 2
+
+
+#############################
+# functions for trial indexes
+#############################
+
+def record_offsets(file_path):
+    """Byte offset of the start of each csv record after the header, followed by the end of the
+    file. Quoted fields spanning lines are kept within their record."""
+    offsets = []
+    position, in_quotes = 0, False
+    with open(file_path, 'rb') as file:
+        for line in file:
+            if not in_quotes:
+                offsets.append(position)
+            in_quotes ^= line.count(b'"') % 2 == 1
+            position += len(line)
+    offsets.append(position)
+    # the first record is the header
+    return np.array(offsets[1:], dtype=np.int64)
+
+
+def subtype_columns(columns):
+    """Columns of each message subtype among the given columns."""
+    names = {column.lower(): column for column in columns}
+    return {subtype: [names[column.lower()] for column in subtype_cols if column.lower() in names]
+            for subtype, subtype_cols in SUBTYPE_COLUMNS.items()}
+
+
+def subtype_rows(df, by_subtype):
+    """Rows of each message subtype. A column written by several subtypes (team_budget) only marks
+    the rows of a subtype without columns of its own; the others need one of their own columns."""
+    filled = df.notna()
+    counts = pd.Series([column for subtype_cols in by_subtype.values() for column in subtype_cols]).value_counts()
+    own_columns = {subtype: [column for column in subtype_cols if counts[column] == 1]
+                   for subtype, subtype_cols in by_subtype.items()}
+    claims = {subtype: filled[columns].any(axis=1).to_numpy() for subtype, columns in own_columns.items()}
+    claimed = np.sum(list(claims.values()), axis=0) > 0
+    return {subtype: np.flatnonzero(claims[subtype] if own_columns[subtype]
+                                    else filled[subtype_cols].any(axis=1).to_numpy() & ~claimed)
+            for subtype, subtype_cols in by_subtype.items()}
+
+
+def first_valid(df, column):
+    """First non-null value of a column, matched case-insensitively, or None."""
+    matches = [name for name in df.columns if name.lower() == column]
+    values = df[matches[0]].dropna() if matches else pd.Series([], dtype=object)
+    return None if values.empty else str(values.iloc[0])
+
+
+def build_trial_index(file_path, index_file_path, time_column=TIME_COLUMN):
+    """Index one time series csv: the byte offsets of its records, its rows sorted by elapsed time,
+    the rows of each message subtype and the stage and global elapsed time of each row. Returns the
+    catalog entry of the trial."""
+    columns = list(pd.read_csv(file_path, nrows=0).columns)
+    by_subtype = subtype_columns(columns)
+    id_columns = [column for column in columns if column.lower() in ('trial_id', 'trial_info_trial_id')]
+    index_columns = list(dict.fromkeys([column for subtype_cols in by_subtype.values() for column in subtype_cols]
+                                       + id_columns + ([time_column] if time_column in columns else [])
+                                       + [column for column in ELAPSED_SOURCE_COLUMNS if column in columns]))
+    df = pd.read_csv(file_path, usecols=index_columns, low_memory=False)
+
+    arrays = {'offsets': record_offsets(file_path)}
+    if len(arrays['offsets']) - 1 != len(df):
+        raise ValueError(f"{file_path}: {len(arrays['offsets']) - 1} csv records but {len(df)} rows")
+    if time_column in df.columns:
+        times = pd.to_numeric(df[time_column], errors='coerce').to_numpy(dtype='float64')
+        timed_rows = np.flatnonzero(~np.isnan(times))
+        order = np.argsort(times[timed_rows], kind='stable')
+        arrays['time_rows'], arrays['time_values'] = timed_rows[order], times[timed_rows][order]
+    else:
+        arrays['time_rows'], arrays['time_values'] = np.array([], dtype=np.int64), np.array([], dtype='float64')
+    for subtype, rows in subtype_rows(df, by_subtype).items():
+        arrays[f'subtype:{subtype}'] = rows
+    if 'timestamp' in df.columns:
+        elapsed_df = timebase.add_elapsed_columns(
+            df[[column for column in ELAPSED_SOURCE_COLUMNS if column in df.columns]])
+        for column in INDEX_ELAPSED_COLUMNS:
+            arrays[column] = elapsed_df[column].to_numpy(dtype='float64')
+    np.savez(index_file_path, **arrays)
+
+    file = os.path.splitext(os.path.basename(file_path))[0]
+    return {'trial_id': first_valid(df, 'trial_info_trial_id') or first_valid(df, 'trial_id') or file,
+            'file': file,
+            'file_path': os.path.abspath(file_path),
+            'file_size': os.path.getsize(file_path),
+            'file_mtime': os.path.getmtime(file_path),
+            'rows': len(df),
+            'time_min': arrays['time_values'][0] if len(arrays['time_values']) else np.nan,
+            'time_max': arrays['time_values'][-1] if len(arrays['time_values']) else np.nan,
+            'index_file_path': os.path.abspath(index_file_path)}
+
+
+def build_trial_catalog(time_series_dir_path, catalog_dir_path, time_column=TIME_COLUMN):
+    """Index every time series csv of a directory and write the trial catalog listing them."""
+    print("Building trial catalog...")
+    os.makedirs(catalog_dir_path, exist_ok=True)
+    entries = []
+    for file in tqdm(sorted(os.listdir(time_series_dir_path))):
+        if file.endswith('.csv'):
+            index_file_path = os.path.join(catalog_dir_path, file.replace('.csv', TRIAL_INDEX_SUFFIX))
+            entries.append(build_trial_index(os.path.join(time_series_dir_path, file), index_file_path, time_column))
+    catalog_df = pd.DataFrame(entries)
+    catalog_df.to_csv(os.path.join(catalog_dir_path, TRIAL_CATALOG_FILE), index=False)
+    return catalog_df
+
+
+def read_trial_catalog(catalog_dir_path):
+    """Read the trial catalog of a catalog directory."""
+    return pd.read_csv(os.path.join(catalog_dir_path, TRIAL_CATALOG_FILE), dtype={'trial_id': str, 'file': str},
+                       float_precision='round_trip')
+
+
+def catalog_entry(catalog_dir_path, trial_id):
+    """Catalog entry of a trial, looked up by trial id or by file name; the index of the file is
+    rebuilt first if the file changed since it was indexed."""
+    catalog_df = read_trial_catalog(catalog_dir_path)
+    matches = catalog_df[(catalog_df['trial_id'] == trial_id) | (catalog_df['file'] == trial_id)]
+    if matches.empty:
+        raise KeyError(f"Trial {trial_id} is not in the catalog {catalog_dir_path}")
+    entry = matches.iloc[0].to_dict()
+    if (os.path.getsize(entry['file_path']) != entry['file_size']
+            or os.path.getmtime(entry['file_path']) != entry['file_mtime']):
+        entry = build_trial_index(entry['file_path'], entry['index_file_path'])
+        catalog_df.loc[matches.index[0]] = pd.Series(entry)
+        catalog_df.to_csv(os.path.join(catalog_dir_path, TRIAL_CATALOG_FILE), index=False)
+    return entry
+
+
+##############################
+# functions for loading trials
+##############################
+
+def selected_rows(index, subtypes=None, t_range=None):
+    """Sorted row positions of a trial matching the subtypes and the [start, end] elapsed time range."""
+    rows = None
+    if t_range is not None:
+        start, end = t_range
+        time_values = index['time_values']
+        low = 0 if start is None else np.searchsorted(time_values, start, side='left')
+        high = len(time_values) if end is None else np.searchsorted(time_values, end, side='right')
+        rows = np.sort(index['time_rows'][low:high])
+    if subtypes is not None:
+        unknown = [subtype for subtype in subtypes if f'subtype:{subtype}' not in index]
+        if unknown:
+            raise KeyError(f"Unknown message subtypes {unknown}, expected some of {list(SUBTYPE_COLUMNS)}")
+        subtype_rows = np.unique(np.concatenate([index[f'subtype:{subtype}'] for subtype in subtypes]))
+        rows = subtype_rows if rows is None else np.intersect1d(rows, subtype_rows, assume_unique=True)
+    return rows
+
+
+def read_records(file_path, offsets, rows, columns=None):
+    """Parse only the given csv records of a file, and only the given columns. rows=None reads all."""
+    with open(file_path, 'rb') as file:
+        header = file.read(offsets[0])
+        if rows is None:
+            data = file.read()
+        else:
+            start = offsets[rows[0]] if len(rows) else offsets[0]
+            end = offsets[rows[-1] + 1] if len(rows) else offsets[0]
+            file.seek(start)
+            span = file.read(end - start)
+            data = b''.join(span[offsets[row] - start:offsets[row + 1] - start] for row in rows)
+    return pd.read_csv(io.BytesIO(header + data), usecols=columns, low_memory=False)
+
+
+def cache_trial(key, df):
+    """Keep a loaded selection in the LRU cache, evicting the least recently used ones over the cap."""
+    TRIAL_CACHE[key] = (df, int(df.memory_usage(index=True, deep=True).sum()))
+    TRIAL_CACHE.move_to_end(key)
+    while TRIAL_CACHE and sum(size for _, size in TRIAL_CACHE.values()) > TRIAL_CACHE_MAX_BYTES:
+        TRIAL_CACHE.popitem(last=False)
+
+
+def clear_trial_cache():
+    """Empty the cache of loaded trial selections."""
+    TRIAL_CACHE.clear()
+
+
+def load_trial(catalog_dir_path, trial_id, subtypes=None, columns=None, t_range=None):
+    """Load part of one trial's time series: the rows of the given message subtypes (see
+    SUBTYPE_COLUMNS) whose estimated_elapsed_ms lies in t_range=(start, end) milliseconds,
+    either end None for open, restricted to the given columns, in file order. The stage and global
+    elapsed times of INDEX_ELAPSED_COLUMNS come from the trial index. Only the selected csv
+    records and columns are parsed, so dtypes are inferred from them. Recent selections are served
+    from an LRU cache capped at TRIAL_CACHE_MAX_BYTES; a copy is returned."""
+    entry = catalog_entry(catalog_dir_path, trial_id)
+    key = (entry['file_path'], entry['file_mtime'], tuple(subtypes) if subtypes is not None else None,
+           tuple(columns) if columns is not None else None, tuple(t_range) if t_range is not None else None)
+    if key in TRIAL_CACHE:
+        TRIAL_CACHE.move_to_end(key)
+        return TRIAL_CACHE[key][0].copy()
+
+    with np.load(entry['index_file_path']) as index_file:
+        index = dict(index_file)
+    rows = selected_rows(index, subtypes, t_range)
+    elapsed_columns = [column for column in INDEX_ELAPSED_COLUMNS
+                       if column in index and (columns is None or column in columns)]
+    csv_columns = [column for column in columns if column not in elapsed_columns] if columns is not None else None
+    df = read_records(entry['file_path'], index['offsets'], rows, csv_columns)
+    for column in elapsed_columns:
+        df[column] = index[column] if rows is None else index[column][rows]
+    if columns is not None:
+        df = df[list(columns)]
+    cache_trial(key, df)
+    return df.copy()
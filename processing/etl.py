@@ -3,9 +3,9 @@
 import os
 import json
 import csv
-import zipfile
 import pandas as pd
 from tqdm import tqdm
+from processing import archive
 
 def extract_unique_subtypes_with_examples(folder_path):
     files = [f for f in os.listdir(folder_path) if f.endswith('.metadata')]
@@ -44,27 +44,28 @@ def write_subtypes_to_csv(folder_path, output_file):
             writer.writerow([subtype, example_message])
 
 
-def extract_and_rename_csv_files(source_dir, destination_dir):
+def extract_and_rename_csv_files(source_dir, destination_dir, catalog_file_path=None):
     print("Writing intervention measures CSVs...")
     os.makedirs(destination_dir, exist_ok=True)
 
-    for file in tqdm(os.listdir(source_dir)):
-        if file.endswith('.zip'):
-            zip_file_path = os.path.join(source_dir, file)
-            folder_name = os.path.splitext(file)[0]
+    catalog = archive.load_archive_catalog(source_dir, catalog_file_path)
+    extract_catalog_intervention_measures(catalog, destination_dir)
+
 
-            try:
-                with zipfile.ZipFile(zip_file_path, 'r') as zip_ref:
-                    # Extract only 'intervention_measures.csv' if it exists in the zip
-                    if 'intervention_measures.csv' in zip_ref.namelist():
-                        zip_ref.extract('intervention_measures.csv', destination_dir)
-                        extracted_file = 'intervention_measures.csv'
-                        new_file_name = f"{folder_name}_{extracted_file}"
-                        os.rename(os.path.join(destination_dir, extracted_file),
-                                  os.path.join(destination_dir, new_file_name))
-            except zipfile.BadZipFile as e:
-                print(f"Failed to process {file} due to a zipfile error: {e}")
-                continue  # Continue to the next file
+def extract_catalog_intervention_measures(catalog, destination_dir):
+    """Copy the intervention_measures.csv of each cataloged archive to destination_dir, named after
+    the archive."""
+    for file, zip_archive in tqdm(catalog.items()):
+        if zip_archive['error']:
+            print(f"Failed to process {file} due to a zipfile error: {zip_archive['error']}")
+            continue  # Continue to the next file
+
+        # Extract only 'intervention_measures.csv' if it exists in the zip
+        entry = zip_archive['members'].get('intervention_measures.csv')
+        if entry:
+            folder_name = os.path.splitext(file)[0]
+            new_file_name = f"{folder_name}_intervention_measures.csv"
+            archive.copy_member(entry, os.path.join(destination_dir, new_file_name))
 
 
 def write_intervention_measures_content(directory_path, output_path):
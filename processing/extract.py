@@ -1,20 +1,22 @@
 ''' module for extracting zipped folder contents '''
 
 import os
-import zipfile
 from tqdm import tqdm
+from processing import archive
 
-def extract_metadata(zip_folder_path, output_path):
+def extract_metadata(zip_folder_path, output_path, catalog_file_path=None):
     print("Extracting metadata files...")
     os.makedirs(output_path, exist_ok=True)
 
-    for file_name in tqdm(os.listdir(zip_folder_path)):
-        if file_name.endswith('.zip'):
-            zip_path = os.path.join(zip_folder_path, file_name)
-            with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-                for member in zip_ref.namelist():
-                    if member.endswith('.metadata'):
-                        source = zip_ref.open(member)
-                        target = open(os.path.join(output_path, os.path.basename(member)), "wb")
-                        with source, target:
-                            target.write(source.read())
+    catalog = archive.load_archive_catalog(zip_folder_path, catalog_file_path)
+    extract_catalog_metadata(catalog, output_path)
+
+
+def extract_catalog_metadata(catalog, output_path):
+    """Copy the metadata members of the cataloged archives to output_path, returning the file paths."""
+    file_paths = []
+    for entry in tqdm(archive.member_entries(catalog, lambda member: member.endswith('.metadata'))):
+        file_path = os.path.join(output_path, os.path.basename(entry['member']))
+        archive.copy_member(entry, file_path)
+        file_paths.append(file_path)
+    return file_paths
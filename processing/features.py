@@ -0,0 +1,301 @@
+''' functions for an incremental store of derived per-trial summary features '''
+
+import os
+import hashlib
+import inspect
+import pandas as pd
+
+# registered features, in the column order they are added to the post-processed trial summaries
+FEATURES = {}
+# columns of the feature store, one row per (trial, feature, output column)
+FEATURE_STORE_COLUMNS = ['trial_id', 'feature', 'code_version', 'input_hash', 'column', 'value', 'dtype']
+
+
+def register_feature(name, inputs, outputs=None):
+    """Decorator registering a derived feature of the collated trial summaries.
+    'inputs' lists the summary columns it reads, or is a function returning them from the collated
+    columns. The decorated function takes a DataFrame of those columns, one row per trial, and
+    returns a DataFrame of its 'outputs' columns (by default just the feature name)."""
+    def decorator(function):
+        outputs_list = outputs or [name]
+        inputs_code = inputs if not callable(inputs) else inspect.getsource(inputs)
+        code = repr((inspect.getsource(function), inputs_code, outputs_list))
+        FEATURES[name] = {'function': function,
+                          'inputs': inputs,
+                          'outputs': outputs_list,
+                          'version': hashlib.md5(code.encode()).hexdigest()[:12]}
+        return function
+    return decorator
+
+
+def register_sum_feature(name, columns_to_sum):
+    """Register a feature summing summary columns, missing columns counting as zero."""
+    @register_feature(name, columns_to_sum)
+    def sum_columns(frame):
+        return frame.sum(axis=1).to_frame(name)
+    return sum_columns
+
+
+###################################
+# registered trial summary features
+###################################
+
+TOOL_USAGE_SUMS = [
+    {
+        'new_column': 'Wirecutters_Used',
+        'columns_to_sum': [
+            'toolused_count_WIRECUTTERS_GREEN',
+            'toolused_count_WIRECUTTERS_RED',
+            'toolused_count_WIRECUTTERS_BLUE'
+        ]
+    },
+    {
+        'new_column': 'toolused_on_beacon_bomb',
+        'columns_to_sum': [
+            'toolused_on_block_beacon_bomb',
+            'toolused_on_asistmod:block_beacon_bomb'
+        ]
+    },
+    {
+        'new_column': 'toolused_on_beacon_hazard',
+        'columns_to_sum': [
+            'toolused_on_block_beacon_hazard',
+            'toolused_on_asistmod:block_beacon_hazard'
+        ]
+    },
+    {
+        'new_column': 'toolused_on_bomb_chained',
+        'columns_to_sum': [
+            'toolused_on_asistmod:block_bomb_chained',
+            'toolused_on_block_bomb_chained'
+        ]
+    },
+    {
+        'new_column': 'toolused_on_bomb_standard',
+        'columns_to_sum': [
+            'toolused_on_asistmod:block_bomb_standard',
+            'toolused_on_block_bomb_standard'
+        ]
+    },
+    {
+        'new_column': 'toolused_on_bomb_fire',
+        'columns_to_sum': [
+            'toolused_on_asistmod:block_bomb_fire',
+            'toolused_on_block_bomb_fire'
+        ]
+    }
+]
+
+TASK_DESCRIPTIONS = [
+    {
+        'new_column': 'defused_bombs_count',
+        'columns_to_sum': [
+            'objectstatechange_outcome_count_block_bomb_chained_DEFUSED',
+            'objectstatechange_outcome_count_block_bomb_fire_DEFUSED',
+            'objectstatechange_outcome_count_block_bomb_standard_DEFUSED'
+        ]
+    },
+    {
+        'new_column': 'defused_disposer_bombs_count',
+        'columns_to_sum': [
+            'objectstatechange_outcome_count_block_bomb_chained_DEFUSED_DISPOSER',
+            'objectstatechange_outcome_count_block_bomb_standard_DEFUSED_DISPOSER',
+            'objectstatechange_outcome_count_block_bomb_fire_DEFUSED_DISPOSER'
+        ]
+    },
+    {
+        'new_column': 'exploded_bombs_count',
+        'columns_to_sum': [
+            'objectstatechange_outcome_count_block_bomb_chained_EXPLODE_TIME_LIMIT',
+            'objectstatechange_outcome_count_block_bomb_fire_EXPLODE_TIME_LIMIT',
+            'objectstatechange_outcome_count_block_bomb_standard_EXPLODE_TIME_LIMIT',
+            'objectstatechange_outcome_count_block_bomb_chained_EXPLODE_TOOL_MISMATCH',
+            'objectstatechange_outcome_count_block_bomb_fire_EXPLODE_TOOL_MISMATCH',
+            'objectstatechange_outcome_count_block_bomb_standard_EXPLODE_TOOL_MISMATCH',
+            'objectstatechange_outcome_count_block_bomb_chained_EXPLODE_CHAINED_ERROR',
+            'objectstatechange_outcome_count_block_bomb_standard_EXPLODE_FIRE',
+            'objectstatechange_outcome_count_block_bomb_fire_EXPLODE_FIRE',
+            'objectstatechange_outcome_count_block_bomb_chained_EXPLODE_FIRE'
+        ]
+    },
+    {
+        'new_column': 'triggered_bombs_count',
+        'columns_to_sum': [
+            'objectstatechange_outcome_count_block_bomb_standard_TRIGGERED',
+            'objectstatechange_outcome_count_block_bomb_fire_TRIGGERED',
+            'objectstatechange_outcome_count_block_bomb_chained_TRIGGERED'
+        ]
+    },
+    {
+        'new_column': 'triggered_advance_seq_bombs_count',
+        'columns_to_sum': [
+            'objectstatechange_outcome_count_block_bomb_fire_TRIGGERED_ADVANCE_SEQ',
+            'objectstatechange_outcome_count_block_bomb_standard_TRIGGERED_ADVANCE_SEQ',
+            'objectstatechange_outcome_count_block_bomb_chained_TRIGGERED_ADVANCE_SEQ'
+        ]
+    }
+]
+
+UI_CLICK_COLUMNS = [
+    'uiclick_element_id_2_1_+', 'uiclick_element_id_1_1_+', 'uiclick_element_id_0_0_+',
+    'uiclick_element_id_1_0_+', 'uiclick_element_id_0_2_+', 'uiclick_element_id_3_0_+',
+    'uiclick_element_id_2_2_+', 'uiclick_element_id_4_0_+', 'uiclick_element_id_6_1_+',
+    'uiclick_element_id_LeaveStoreButton', 'uiclick_element_id_7_0_+',
+    'uiclick_element_id_MissionBriefCloseButton', 'uiclick_element_id_0_2_-',
+    'uiclick_element_id_6_0_+', 'uiclick_element_id_7_2_+', 'uiclick_element_id_1_2_-',
+    'uiclick_element_id_1_2_+', 'uiclick_element_id_4_2_+', 'uiclick_element_id_3_2_+',
+    'uiclick_element_id_3_1_+', 'uiclick_element_id_2_0_+', 'uiclick_element_id_0_1_+',
+    'uiclick_element_id_4_2_-', 'uiclick_element_id_3_2_-', 'uiclick_element_id_5_2_+',
+    'uiclick_element_id_2_2_-', 'uiclick_element_id_4_1_+', 'uiclick_element_id_5_1_+',
+    'uiclick_element_id_6_2_+', 'uiclick_element_id_7_1_+', 'uiclick_element_id_flag_Delta_0',
+    'uiclick_element_id_2_0_-', 'uiclick_element_id_1_1_-', 'uiclick_element_id_2_1_-',
+    'uiclick_meta_action_count_PLANNING_FLAG_UPDATE', 'uiclick_element_id_7_0_-',
+    'uiclick_meta_action_count_PLANNING_FLAG_PLACED', 'uiclick_element_id_delete-button',
+    'uiclick_element_id_flag_Bravo_3', 'uiclick_element_id_flag_Bravo_2',
+    'uiclick_element_id_flag_Bravo_1', 'uiclick_element_id_flag_Bravo_0',
+    'uiclick_meta_action_count_UNDO_PLANNING_FLAG_PLACED', 'uiclick_element_id_8_1_+',
+    'uiclick_element_id_5_0_-', 'uiclick_element_id_5_0_+', 'uiclick_element_id_8_2_+',
+    'uiclick_element_id_8_0_+', 'uiclick_element_id_3_1_-', 'uiclick_element_id_0_0_-',
+    'uiclick_element_id_4_0_-', 'uiclick_element_id_6_0_-', 'uiclick_element_id_5_1_-',
+    'uiclick_element_id_4_1_-', 'uiclick_element_id_0_1_-', 'uiclick_element_id_6_1_-',
+    'uiclick_element_id_7_2_-', 'uiclick_element_id_3_0_-', 'uiclick_element_id_6_2_-',
+    'uiclick_element_id_8_1_-', 'uiclick_element_id_5_2_-', 'uiclick_element_id_7_1_-',
+    'uiclick_element_id_8_2_-', 'uiclick_element_id_8_0_-'
+]
+
+FLAGS_COLUMNS = [
+    # Delta flags
+    *[f'uiclick_element_id_flag_Delta_{i}' for i in range(16)],
+    # Bravo flags
+    *[f'uiclick_element_id_flag_Bravo_{i}' for i in range(23)],
+    # Alpha flags
+    *[f'uiclick_element_id_flag_Alpha_{i}' for i in range(13)],
+    # Planning actions
+    'uiclick_meta_action_count_PLANNING_FLAG_UPDATE',
+    'uiclick_meta_action_count_PLANNING_FLAG_PLACED',
+    'uiclick_meta_action_count_UNDO_PLANNING_FLAG_PLACED'
+]
+
+for desc in TOOL_USAGE_SUMS + TASK_DESCRIPTIONS:
+    register_sum_feature(desc['new_column'], desc['columns_to_sum'])
+
+
+@register_feature('player_score_extremes',
+                  lambda columns: [col for col in columns if col.endswith('_highest_score')],
+                  outputs=['player_score_max', 'player_score_min'])
+def player_score_extremes(frame):
+    """Maximum and minimum of the per-participant highest scores."""
+    return pd.DataFrame({'player_score_max': frame.max(axis=1), 'player_score_min': frame.min(axis=1)})
+
+
+register_sum_feature('uiclick_interact_count', UI_CLICK_COLUMNS)
+register_sum_feature('ui_flags_interaction_count', FLAGS_COLUMNS)
+
+
+#################################
+# functions for the feature store
+#################################
+
+def feature_inputs(feature, columns):
+    """Input columns of a feature given the collated summary columns."""
+    inputs = feature['inputs']
+    return list(inputs(columns)) if callable(inputs) else list(inputs)
+
+
+def feature_columns():
+    """Output columns of all registered features, in registration order."""
+    return [column for feature in FEATURES.values() for column in feature['outputs']]
+
+
+def compute_features(summary_df, columns=None):
+    """Compute every registered feature directly on summary rows, resolving the inputs against
+    'columns' (by default the rows' own columns)."""
+    columns = summary_df.columns if columns is None else columns
+    outputs = [feature['function'](summary_df.reindex(columns=feature_inputs(feature, columns)))
+               for feature in FEATURES.values()]
+    if not outputs:
+        return pd.DataFrame(index=summary_df.index)
+    return pd.concat(outputs, axis=1)[feature_columns()]
+
+
+def stored_trial_mask(summary_df):
+    """Rows of the collated summaries kept in the store: trial summaries with a unique 'trial_ID'.
+    Other rows (the metadata trial summary files collated alongside) are computed directly."""
+    if 'trial_ID' not in summary_df.columns:
+        return pd.Series(False, index=summary_df.index)
+    return summary_df['trial_ID'].notna() & ~summary_df['trial_ID'].duplicated(keep=False)
+
+
+def input_hashes(inputs_df):
+    """Content hash of each row of a feature's input columns, including the column names."""
+    columns_digest = hashlib.md5('\x1f'.join(map(str, inputs_df.columns)).encode()).hexdigest()[:8]
+    if inputs_df.shape[1] == 0:
+        return pd.Series(columns_digest, index=inputs_df.index)
+    row_hashes = pd.util.hash_pandas_object(inputs_df, index=False)
+    return row_hashes.map(lambda row_hash: f'{row_hash:016x}{columns_digest}')
+
+
+def load_feature_store(feature_store_file_path):
+    """Read the feature store, empty if it does not exist yet."""
+    if not os.path.exists(feature_store_file_path):
+        return pd.DataFrame(columns=FEATURE_STORE_COLUMNS)
+    return pd.read_csv(feature_store_file_path,
+                       dtype={'trial_id': str, 'feature': str, 'code_version': str, 'input_hash': str,
+                              'column': str, 'dtype': str})
+
+
+def update_feature_store(summary_df, feature_store_file_path):
+    """Bring the feature store up to date with the collated summaries. Only (trial, feature) cells
+    that are missing, whose input values changed or whose feature code changed are recomputed;
+    cells of trials or features that no longer exist are dropped."""
+    print("Updating trial summary feature store...")
+    store = load_feature_store(feature_store_file_path)
+    mask = stored_trial_mask(summary_df)
+    trials_df = summary_df.loc[mask].set_axis(summary_df.loc[mask, 'trial_ID'].astype(str))
+
+    kept, recomputed = [], []
+    recomputed_cells = 0
+    for name, feature in FEATURES.items():
+        inputs_df = trials_df.reindex(columns=feature_inputs(feature, summary_df.columns))
+        hashes = input_hashes(inputs_df)
+        cells = store[(store['feature'] == name) & store['trial_id'].isin(hashes.index)]
+        current = cells.drop_duplicates('trial_id').set_index('trial_id')
+        fresh = current.index[(current['code_version'] == feature['version'])
+                              & (current['input_hash'] == hashes.reindex(current.index))]
+        kept.append(cells[cells['trial_id'].isin(fresh)])
+
+        stale = hashes.index[~hashes.index.isin(fresh)]
+        if len(stale) == 0:
+            continue
+        outputs = feature['function'](inputs_df.loc[stale])
+        long_df = outputs.rename_axis('trial_id').reset_index().melt(id_vars='trial_id', var_name='column',
+                                                                     value_name='value')
+        long_df['dtype'] = long_df['column'].map(outputs.dtypes.astype(str))
+        long_df['feature'] = name
+        long_df['code_version'] = feature['version']
+        long_df['input_hash'] = hashes.loc[long_df['trial_id']].to_numpy()
+        recomputed.append(long_df[FEATURE_STORE_COLUMNS])
+        recomputed_cells += len(stale)
+
+    parts = [part for part in kept + recomputed if not part.empty]
+    store = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(columns=FEATURE_STORE_COLUMNS)
+    store.to_csv(feature_store_file_path, index=False)
+    print(f"  {recomputed_cells} of {len(FEATURES) * len(trials_df)} trial feature cells recomputed")
+    return store
+
+
+def assemble_features(summary_df, store):
+    """Feature columns for every row of the collated summaries: stored trials are read from the
+    store, the remaining rows are computed directly."""
+    mask = stored_trial_mask(summary_df)
+    trial_ids = summary_df.loc[mask, 'trial_ID'].astype(str)
+    stored = store.pivot(index='trial_id', columns='column', values='value')
+    stored = stored.reindex(index=trial_ids, columns=feature_columns())
+    stored.index = summary_df.index[mask]
+    # restore the dtype the feature returned when every stored cell of the column agrees on it
+    dtypes = store[store['trial_id'].isin(set(trial_ids))].groupby('column')['dtype'].unique()
+    for column, column_dtypes in dtypes.items():
+        if column in stored.columns and len(column_dtypes) == 1 and stored[column].notna().all():
+            stored[column] = stored[column].astype(column_dtypes[0])
+    computed = compute_features(summary_df.loc[~mask], summary_df.columns)
+    return pd.concat([stored, computed]).loc[summary_df.index]
@@ -0,0 +1,479 @@
+''' functions for appending newly downloaded trials to the processed tables, processing only the
+archives not ingested yet and keeping the median classifications current without recomputing them '''
+
+import os
+import json
+import shutil
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+from processing import archive, extract, dedup, etl, metadata, survey, team, collate
+
+INCREMENTAL_STATE_FILE = 'incremental_state.json'
+MEDIAN_STATE_SUFFIX = '_medians.npz'
+# tables are read back with exact floats, so the rows left alone are written back unchanged
+READ_OPTIONS = {'float_precision': 'round_trip'}
+# below this many rows reclassifying a whole table against its medians is faster than keeping
+# running medians and reclassifying only the rows that flip
+RUNNING_MEDIAN_MIN_ROWS = 30000
+# directory next to the tables an append writes them to, moved over the tables once every step succeeded
+STAGING_DIR = '.append'
+# tables an append adds rows to, and tables it derives anew from those
+APPENDED_TABLES = ['individual_measures_combined_file_path', 'individual_measures_unique_file_path',
+                   'individual_measures_calculated_unique_file_path', 'trial_measures_team_combined_file_path',
+                   'individual_trial_measures_combined_file_path',
+                   'individual_player_profiles_trial_measures_combined_file_path', 'trial_level_team_profiles_file_path']
+REWRITTEN_TABLES = ['intervention_measures_file_path', 'intervention_measures_unique_file_path',
+                    'teams_alignment_results_combined_file_path', 'teams_alignment_subset_sweep_file_path',
+                    'teams_player_profiles_trial_measures_combined_file_path', 'team_index_file_path']
+
+
+###################################
+# functions for the running medians
+###################################
+
+def median_state(values):
+    """Order statistics of a column: its non-null values sorted, with the row position of each."""
+    values = np.asarray(values, dtype='float64')
+    rows = np.flatnonzero(~np.isnan(values))
+    order = np.argsort(values[rows], kind='stable')
+    return values[rows][order], rows[order]
+
+
+def state_median(state):
+    """Median of the values of an order statistics state, as pandas computes it, NaN if empty."""
+    values = state[0]
+    if not len(values):
+        return np.nan
+    return (values[(len(values) - 1) // 2] + values[len(values) // 2]) / 2
+
+
+def update_median_state(state, rows, values):
+    """Order statistics with the values of the given rows, new or existing, replaced: the old
+    entries of the rows are dropped and the non-null values inserted at the positions a binary
+    search of the sorted values finds."""
+    sorted_values, sorted_rows = state
+    rows = np.asarray(rows, dtype=np.int64)
+    keep = ~np.isin(sorted_rows, rows)
+    sorted_values, sorted_rows = sorted_values[keep], sorted_rows[keep]
+
+    values = np.asarray(values, dtype='float64')
+    present = ~np.isnan(values)
+    order = np.argsort(values[present], kind='stable')
+    values, rows = values[present][order], rows[present][order]
+    positions = np.searchsorted(sorted_values, values, side='right')
+    return np.insert(sorted_values, positions, values), np.insert(sorted_rows, positions, rows)
+
+
+def flipped_rows(state, old_median, new_median):
+    """Rows whose value compares differently against the new median than against the old one, the
+    run of sorted values between the two medians; a NaN median compares false with every value."""
+    sorted_values, sorted_rows = state
+    bounds = [len(sorted_values) if np.isnan(median) else np.searchsorted(sorted_values, median, side='left')
+              for median in (old_median, new_median)]
+    return sorted_rows[min(bounds):max(bounds)]
+
+
+def file_stat(file_path):
+    """Size and modification time of a file, identifying the version a median state was saved for."""
+    stat = os.stat(file_path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def read_median_states(state_file_path, table_file_path, df, columns):
+    """Order statistics of the columns of a table, read from state_file_path if they were saved for
+    the table as it is on disk, built from the table otherwise."""
+    if os.path.exists(state_file_path):
+        with np.load(state_file_path) as state_file:
+            if (state_file['table_stat'].tolist() == file_stat(table_file_path)
+                    and all(f'values:{column}' in state_file for column in columns)):
+                return {column: (state_file[f'values:{column}'], state_file[f'rows:{column}']) for column in columns}
+    return {column: median_state(df[column]) for column in columns}
+
+
+def write_median_states(state_file_path, table_file_path, states):
+    """Save the order statistics of a table just written to table_file_path."""
+    arrays = {'table_stat': np.array(file_stat(table_file_path), dtype=np.int64)}
+    for column, (values, rows) in states.items():
+        arrays[f'values:{column}'], arrays[f'rows:{column}'] = values, rows
+    np.savez(state_file_path, **arrays)
+
+
+##################################
+# functions for merging table rows
+##################################
+
+def splice_rows(df, positions, rows_df):
+    """Table with the rows of rows_df written over the rows at positions; positions past the end of
+    the table append their rows in order. Columns new to the table are added at its end."""
+    positions = np.asarray(positions, dtype=np.int64)
+    if not len(positions) or positions.min() >= len(df):
+        return pd.concat([df, rows_df.iloc[np.argsort(positions, kind='stable')]], ignore_index=True)
+    keep = np.setdiff1d(np.arange(len(df)), positions)
+    spliced = pd.concat([df.iloc[keep], rows_df], ignore_index=True)
+    return spliced.iloc[np.argsort(np.concatenate([keep, positions]), kind='stable')].reset_index(drop=True)
+
+
+def row_positions(df, column, keys):
+    """Position of the row of each key in a table keyed by column, keys not in it numbered on from
+    its end in order."""
+    existing = pd.Series(np.arange(len(df)), index=df[column].astype(str).to_numpy())
+    positions = existing.reindex(pd.Index(keys).astype(str)).to_numpy(dtype='float64', copy=True)
+    missing = np.isnan(positions)
+    positions[missing] = len(df) + np.arange(missing.sum())
+    return positions.astype(np.int64)
+
+
+def classify_rows(df, positions, rows_df, states, columns, categorize, min_rows=RUNNING_MEDIAN_MIN_ROWS):
+    """Write rows_df over, or append it to, a table classified by calculate_above_median on columns,
+    keeping the classification current without a full median: the order statistics in states take
+    the new values, the written rows are classified against the new medians, and of the other rows
+    only those whose flag flips are reclassified. categorize recomputes the columns derived from the
+    flags on a frame of rows. Tables of fewer than min_rows rows are reclassified whole instead.
+    Returns the table and the positions of the rows written or flipped."""
+    positions = np.asarray(positions, dtype=np.int64)
+    rows_df = rows_df.reset_index(drop=True)
+    if len(df) + len(rows_df) < min_rows:
+        return reclassify_rows(df, positions, rows_df, states, columns, categorize)
+    medians, flipped = {}, []
+    for column in columns:
+        old_median = state_median(states[column])
+        states[column] = update_median_state(states[column], positions, rows_df[column].to_numpy(dtype='float64'))
+        medians[column] = state_median(states[column])
+        flipped.append(flipped_rows(states[column], old_median, medians[column]))
+    flipped = np.setdiff1d(np.concatenate(flipped), positions)
+
+    for column in columns:
+        rows_df[f'{column}_above_median'] = rows_df[column].ge(medians[column]).astype(int)
+    df = splice_rows(df, positions, categorize(rows_df))
+    if len(flipped):
+        # only the flags and the columns derived from them change, in place with their own dtypes
+        flipped_df = df.iloc[flipped].copy()
+        for column in columns:
+            flipped_df[f'{column}_above_median'] = flipped_df[column].ge(medians[column]).astype(int)
+        flipped_df = categorize(flipped_df)
+        for column in flipped_df.columns:
+            df.iloc[flipped, df.columns.get_loc(column)] = flipped_df[column].to_numpy()
+    return df, np.concatenate([positions, flipped])
+
+
+def reclassify_rows(df, positions, rows_df, states, columns, categorize):
+    """classify_rows for small tables: the order statistics in states take the new values as in
+    classify_rows, then the rows are written and the whole table reclassified against the medians."""
+    flags = [f'{column}_above_median' for column in columns]
+    old_flags = df[flags].to_numpy()
+    df = splice_rows(df, positions, rows_df)
+    for column in columns:
+        states[column] = update_median_state(states[column], positions, rows_df[column].to_numpy(dtype='float64'))
+        df[f'{column}_above_median'] = df[column].ge(state_median(states[column])).astype(int)
+    df = categorize(df)
+    flipped = np.flatnonzero((df[flags].to_numpy()[:len(old_flags)] != old_flags).any(axis=1))
+    return df, np.concatenate([positions, np.setdiff1d(flipped, positions)])
+
+
+def append_text_rows(file_path, frames):
+    """Append frames of text cells to a collated csv, with the columns of both in order of first
+    appearance."""
+    frames = [collate.read_as_text(file_path)] + list(frames)
+    columns = list(dict.fromkeys(column for df in frames for column in df.columns))
+    pd.concat([df.reindex(columns=columns) for df in frames], ignore_index=True).to_csv(file_path, index=False)
+
+
+################################
+# functions for the ingest state
+################################
+
+def cataloged_archives(catalog_file_path):
+    """Size and modification time of each archive of an archive catalog csv, as the pipeline left it."""
+    if not os.path.exists(catalog_file_path):
+        return {}
+    catalog_df = pd.read_csv(catalog_file_path, usecols=['zip_file', 'zip_size', 'zip_mtime'], dtype={'zip_file': str},
+                             float_precision='round_trip').drop_duplicates('zip_file')
+    return {row.zip_file: [int(row.zip_size), float(row.zip_mtime)] for row in catalog_df.itertuples()}
+
+
+def read_incremental_state(state_file_path, catalog_file_path):
+    """Archives ingested so far and the checksums of the unique metadata files. The state of the
+    last append holds while the archive catalog is as that append left it; once a pipeline run
+    rewrote the catalog, the archives it lists were ingested by that run."""
+    if os.path.exists(state_file_path):
+        with open(state_file_path) as state_file:
+            state = json.load(state_file)
+        if os.path.exists(catalog_file_path) and state.get('catalog_stat') == file_stat(catalog_file_path):
+            return state
+    return {'archives': cataloged_archives(catalog_file_path), 'metadata_checksums': None}
+
+
+def write_incremental_state(state_file_path, catalog_file_path, state):
+    """Save the ingest state for the archive catalog as it is on disk."""
+    state['catalog_stat'] = file_stat(catalog_file_path)
+    with open(state_file_path, 'w') as state_file:
+        json.dump(state, state_file)
+
+
+def unique_metadata_checksums(metadata_unique_dir_path):
+    """Checksum of each unique metadata file."""
+    print("Hashing unique metadata...")
+    return {dedup.compute_checksum(os.path.join(metadata_unique_dir_path, file)): file
+            for file in tqdm(sorted(os.listdir(metadata_unique_dir_path)))}
+
+
+####################################
+# functions for staging table writes
+####################################
+
+def staging_dirs(paths):
+    """Staging directories of the tables of an append and of the median states."""
+    return sorted({os.path.join(os.path.dirname(paths[key]), STAGING_DIR) for key in APPENDED_TABLES + REWRITTEN_TABLES}
+                  | {os.path.join(paths['incremental_dir_path'], STAGING_DIR)})
+
+
+def stage_tables(paths):
+    """Paths of an append with its tables and median states pointed at staging directories. The
+    appended tables and the median states are copied there with their stats, so the saved median
+    states still match the tables; the rewritten tables are written there from scratch."""
+    discard_staged(paths)
+    staged = dict(paths, incremental_dir_path=os.path.join(paths['incremental_dir_path'], STAGING_DIR))
+    for dir_path in staging_dirs(paths):
+        os.makedirs(dir_path)
+    for key in APPENDED_TABLES + REWRITTEN_TABLES:
+        staged[key] = os.path.join(os.path.dirname(paths[key]), STAGING_DIR, os.path.basename(paths[key]))
+        if key in APPENDED_TABLES:
+            shutil.copy2(paths[key], staged[key])
+    for file in os.listdir(paths['incremental_dir_path']):
+        if file.endswith(MEDIAN_STATE_SUFFIX):
+            shutil.copy2(os.path.join(paths['incremental_dir_path'], file), staged['incremental_dir_path'])
+    return staged
+
+
+def commit_staged(paths):
+    """Move the staged files over the ones they stand in for and remove the staging directories."""
+    for dir_path in staging_dirs(paths):
+        for file in os.listdir(dir_path):
+            os.replace(os.path.join(dir_path, file), os.path.join(os.path.dirname(dir_path), file))
+        os.rmdir(dir_path)
+
+
+def discard_staged(paths):
+    """Remove the staging directories with whatever an append left in them."""
+    for dir_path in staging_dirs(paths):
+        shutil.rmtree(dir_path, ignore_errors=True)
+
+
+################################
+# functions for appending trials
+################################
+
+def read_metadata_trial_ids(catalog):
+    """Trial ids of the trial summaries in the metadata files of the cataloged archives, read
+    without extracting the files."""
+    trial_ids = []
+    for entry in archive.member_entries(catalog, lambda member: member.endswith('.metadata')):
+        trial_id = metadata.trial_summary_trial_id(archive.iter_member_lines(entry))
+        if trial_id is not None:
+            trial_ids.append(str(trial_id))
+    return trial_ids
+
+
+def ingest_archives(catalog, paths, checksums):
+    """Process the archive-level stages for the cataloged archives only: their metadata files are
+    extracted, deduplicated against the unique metadata and summarized, and their intervention
+    measures extracted. Returns the team and individual level trial summary files written."""
+    print("Extracting metadata files of new archives...")
+    os.makedirs(paths['metadata_unique_dir_path'], exist_ok=True)
+    os.makedirs(paths['processed_trial_summary_dir_path'], exist_ok=True)
+    summary_files = []
+    for file_path in extract.extract_catalog_metadata(catalog, paths['metadata_dir_path']):
+        checksum = dedup.compute_checksum(file_path)
+        if checksum not in checksums:
+            checksums[checksum] = os.path.basename(file_path)
+            shutil.copyfile(file_path, os.path.join(paths['metadata_unique_dir_path'], os.path.basename(file_path)))
+        written = metadata.process_metadata_file(file_path, paths['processed_trial_summary_dir_path'])
+        if written is not None:
+            summary_files.append(written)
+
+    print("Writing intervention measures CSVs of new archives...")
+    os.makedirs(paths['intervention_measures_dir_path'], exist_ok=True)
+    etl.extract_catalog_intervention_measures(catalog, paths['intervention_measures_dir_path'])
+    etl.write_intervention_measures_content(paths['intervention_measures_dir_path'],
+                                            paths['intervention_measures_file_path'])
+    etl.write_intervention_measures_content_unique(paths['intervention_measures_dir_path'],
+                                                   paths['intervention_measures_unique_file_path'])
+    return summary_files
+
+
+def append_individual_measures(paths, by_trial):
+    """Append the individual measures of new trials to the combined, unique and calculated unique
+    individual measures. Only the players of the new trials are recompiled and rescored; the
+    classifications against the medians are kept current with classify_rows. Returns the players
+    whose calculated row was written or flipped."""
+    print("Appending individual measures...")
+    combined_file_path = paths['individual_measures_combined_file_path']
+    append_text_rows(combined_file_path, by_trial.values())
+    data = pd.read_csv(combined_file_path, **READ_OPTIONS)
+
+    # every trial of the players of the new trials, for their trial columns and teammates
+    new_players = {player for df in by_trial.values() for player in df['PLAYER_ID'] if player}
+    players_data = data[data['PLAYER_ID'].astype(str).isin(new_players)]
+    data = data[data['trial_id'].isin(players_data['trial_id'].unique())]
+    unique_rows = survey.arrange_individual_measures_unique(survey.individual_measures_unique_frame(data))
+    unique_rows = unique_rows[unique_rows['PLAYER_ID'].astype(str).isin(new_players)].reset_index(drop=True)
+
+    unique_file_path = paths['individual_measures_unique_file_path']
+    unique_df = pd.read_csv(unique_file_path, **READ_OPTIONS)
+    unique_df = splice_rows(unique_df, row_positions(unique_df, 'PLAYER_ID', unique_rows['PLAYER_ID']), unique_rows)
+    unique_df.to_csv(unique_file_path, index=False)
+
+    calculated_file_path = paths['individual_measures_calculated_unique_file_path']
+    state_file_path = os.path.join(paths['incremental_dir_path'],
+                                   os.path.basename(calculated_file_path).replace('.csv', MEDIAN_STATE_SUFFIX))
+    calculated_df = pd.read_csv(calculated_file_path, **READ_OPTIONS)
+    columns = list(survey.INSTRUMENTS)
+    states = read_median_states(state_file_path, calculated_file_path, calculated_df, columns)
+    rows_df = survey.score_instruments(survey.rename_demographic_columns(unique_rows.copy()))
+
+    def categorize(df):
+        df = survey.calculate_potential_scores_and_categories(df)
+        return survey.track_individual_missing_data(df, columns)
+
+    positions = row_positions(calculated_df, 'PLAYER_ID', rows_df['PLAYER_ID'])
+    calculated_df, rewritten = classify_rows(calculated_df, positions, rows_df, states, columns, categorize)
+    calculated_df.to_csv(calculated_file_path, index=False)
+    write_median_states(state_file_path, calculated_file_path, states)
+    return set(calculated_df['PLAYER_ID'].iloc[rewritten].astype(str))
+
+
+def append_player_profiles(paths, players, new_trials):
+    """Rewrite the combined player profile rows of the given players and append the rows of the new
+    trials, each built as write_individual_player_profile_trial_measures_combined, post_hoc_calculate
+    and integrate_individual_player_profiles_trial_measures_combined build them. Returns the trials
+    of the rows written."""
+    print("Appending individual player profiles...")
+    trial_measures_df = pd.read_csv(paths['individual_trial_measures_combined_file_path'], **READ_OPTIONS)
+    trial_measures_df = trial_measures_df[trial_measures_df['participant_ID'].astype(str).isin(players)
+                                          | trial_measures_df['trial_id'].isin(new_trials)]
+    calculated_df = pd.read_csv(paths['individual_measures_calculated_unique_file_path'], **READ_OPTIONS)
+    calculated_df = calculated_df[calculated_df['PLAYER_ID'].astype(str)
+                                  .isin(set(trial_measures_df['participant_ID'].astype(str)))]
+    additional_data_df = pd.read_csv(paths['individual_measures_combined_file_path'], **READ_OPTIONS)
+    additional_data_df = additional_data_df[additional_data_df['trial_id'].isin(trial_measures_df['trial_id'].unique())]
+    team_combined_df = pd.read_csv(paths['trial_measures_team_combined_file_path'], **READ_OPTIONS)
+    rows_df = survey.individual_player_profile_trial_measures_frame(calculated_df, trial_measures_df, additional_data_df)
+    rows_df = team.integrated_player_profiles_frame(team_combined_df, survey.post_hoc_frame(rows_df))
+
+    profiles_file_path = paths['individual_player_profiles_trial_measures_combined_file_path']
+    profiles_df = pd.read_csv(profiles_file_path, **READ_OPTIONS)
+    # the existing rows of the players follow the order of the trial measures the rows were built from
+    rewritten = np.flatnonzero(profiles_df['participant_ID'].astype(str).isin(players).to_numpy()
+                               & ~profiles_df['trial_id'].isin(new_trials).to_numpy())
+    if (~rows_df['trial_id'].isin(new_trials)).sum() != len(rewritten):
+        raise ValueError(f"{profiles_file_path} does not match its trial measures, run the full pipeline")
+    positions = np.concatenate([rewritten, len(profiles_df) + np.arange(rows_df['trial_id'].isin(new_trials).sum())])
+    rows_df = pd.concat([rows_df[~rows_df['trial_id'].isin(new_trials)], rows_df[rows_df['trial_id'].isin(new_trials)]])
+    splice_rows(profiles_df, positions, rows_df).to_csv(profiles_file_path, index=False)
+    return set(rows_df['trial_id'])
+
+
+def append_trial_level_team_profiles(paths, trials):
+    """Rewrite or append the trial level team profiles of the given trials, keeping the team
+    classifications current with classify_rows."""
+    print("Appending trial level team profiles...")
+    profiles_df = pd.read_csv(paths['individual_player_profiles_trial_measures_combined_file_path'], **READ_OPTIONS)
+    rows_df = team.team_profile_aggregates_frame(profiles_df[profiles_df['trial_id'].isin(trials)])
+
+    team_profiles_file_path = paths['trial_level_team_profiles_file_path']
+    state_file_path = os.path.join(paths['incremental_dir_path'],
+                                   os.path.basename(team_profiles_file_path).replace('.csv', MEDIAN_STATE_SUFFIX))
+    team_profiles_df = pd.read_csv(team_profiles_file_path, **READ_OPTIONS)
+    columns = list(team.TEAM_AVERAGE_COLUMNS.values())
+    states = read_median_states(state_file_path, team_profiles_file_path, team_profiles_df, columns)
+    positions = row_positions(team_profiles_df, 'trial_id', rows_df['trial_id'])
+    team_profiles_df, _ = classify_rows(team_profiles_df, positions, rows_df, states, columns,
+                                        team.calculate_team_categories)
+    team_profiles_df.to_csv(team_profiles_file_path, index=False)
+    write_median_states(state_file_path, team_profiles_file_path, states)
+
+
+def append_trials(paths):
+    """Append the trials of the archives downloaded since the last pipeline run or append: only the
+    new archives are read, their rows are merged into the survey and team tables, and the tables
+    derived from those are rewritten. Archives changed or removed since they were ingested, or a
+    trial ingested again, need a full pipeline run. The tables are written to staging copies and
+    only replaced once every step succeeded; the per-archive files of the new archives are written
+    in place, and written again alike by a retry. The time series and trial summary stages are not
+    appended; the next pipeline run rebuilds them. Returns the new trial ids."""
+    print("Appending new trials...")
+    os.makedirs(paths['incremental_dir_path'], exist_ok=True)
+    state_file_path = os.path.join(paths['incremental_dir_path'], INCREMENTAL_STATE_FILE)
+    catalog_file_path = paths['archive_catalog_file_path']
+    state = read_incremental_state(state_file_path, catalog_file_path)
+    if not state['archives']:
+        print("No ingested archives, run the full pipeline first")
+        return []
+
+    catalog = archive.load_archive_catalog(paths['download_dir_path'], catalog_file_path)
+    # the refreshed catalog lists archives not ingested yet, the state keeps track of them
+    write_incremental_state(state_file_path, catalog_file_path, state)
+    archives = {zip_file: [int(os.path.getsize(zip_archive['path'])), os.path.getmtime(zip_archive['path'])]
+                for zip_file, zip_archive in catalog.items()}
+    stale = sorted(zip_file for zip_file, stat in state['archives'].items() if archives.get(zip_file) != stat)
+    if stale:
+        print(f"Archives changed or removed since they were ingested: {stale}, run the full pipeline")
+        return []
+    new_catalog = {zip_file: zip_archive for zip_file, zip_archive in catalog.items() if zip_file not in state['archives']}
+    if not new_catalog:
+        print("No new archives")
+        return []
+
+    for file, zip_archive in new_catalog.items():
+        if zip_archive['error']:
+            print(f"Failed to process {file} due to a zipfile error: {zip_archive['error']}")
+    by_trial = survey.read_individual_measures([zip_archive for zip_archive in new_catalog.values()
+                                                if not zip_archive['error']])
+    ingested_trials = set(collate.read_as_text(paths['individual_measures_combined_file_path'])['trial_id'])
+    repeated = sorted(set(by_trial) & ingested_trials)
+    if repeated:
+        print(f"Trials ingested already: {repeated}, run the full pipeline")
+        return []
+    summarized_trials = set(collate.read_as_text(paths['trial_measures_team_combined_file_path'])['trial_id'])
+    repeated = sorted(set(read_metadata_trial_ids(new_catalog)) & summarized_trials)
+    if repeated:
+        print(f"Trials summarized already: {repeated}, run the full pipeline")
+        return []
+    print(f"Appending {len(new_catalog)} new archives...")
+
+    if state['metadata_checksums'] is None:
+        state['metadata_checksums'] = unique_metadata_checksums(paths['metadata_unique_dir_path'])
+    staged = stage_tables(paths)
+    try:
+        summary_files = ingest_archives(new_catalog, staged, state['metadata_checksums'])
+        new_trials = sorted(set(collate.read_as_text(team_file)['trial_id'].iloc[0] for team_file, _ in summary_files))
+        append_text_rows(staged['trial_measures_team_combined_file_path'],
+                         [collate.read_as_text(team_file) for team_file, _ in sorted(summary_files)])
+        append_text_rows(staged['individual_trial_measures_combined_file_path'],
+                         [collate.read_as_text(indiv_file) for _, indiv_file in sorted(summary_files)])
+
+        players = append_individual_measures(staged, by_trial) if by_trial else set()
+        trials = append_player_profiles(staged, players, new_trials)
+        append_trial_level_team_profiles(staged, trials)
+
+        # the team tables are whole-table derivations of the appended ones
+        profiles = staged['individual_player_profiles_trial_measures_combined_file_path']
+        teams_profiles = staged['teams_player_profiles_trial_measures_combined_file_path']
+        survey.align_individual_player_profiles_trial_measures_combined(
+            profiles, staged['teams_alignment_results_combined_file_path'],
+            sweep_output_file_path=staged['teams_alignment_subset_sweep_file_path'])
+        team.write_team_player_profiles_trial_measures_combined(staged['trial_measures_team_combined_file_path'],
+                                                                staged['trial_level_team_profiles_file_path'],
+                                                                staged['teams_alignment_results_combined_file_path'],
+                                                                teams_profiles)
+        team.identify_repeat_teams(teams_profiles, staged['team_index_file_path'])
+    except Exception:
+        discard_staged(paths)
+        raise
+    commit_staged(paths)
+
+    state['archives'].update({zip_file: archives[zip_file] for zip_file in new_catalog})
+    write_incremental_state(state_file_path, catalog_file_path, state)
+    print(f"Appended {len(new_trials)} new trials")
+    return new_trials
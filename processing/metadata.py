@@ -81,6 +81,15 @@ def extract_trial_summary_data(json_obj):
     return team_data, indiv_data
 
 
+def trial_summary_trial_id(lines):
+    """Trial id of the first trial summary message among the lines of a metadata file, None if it has none."""
+    for line in lines:
+        content = json.loads(line)
+        if content['msg'].get('sub_type', '') == 'Event:TrialSummary':
+            return content['msg'].get('trial_id', '')
+    return None
+
+
 def process_metadata_files(metadata_dir_path, output_folder_path):
     print("Processing metadata files...")
     output_folder_path = Path(output_folder_path)
@@ -88,20 +97,28 @@ def process_metadata_files(metadata_dir_path, output_folder_path):
     metadata_files = list(Path(metadata_dir_path).glob('*.metadata'))
 
     for i, file_path in enumerate(tqdm(metadata_files), start=1):
-        with open(file_path, 'r', encoding='utf-8') as file:
-            for line in file:
-                content = json.loads(line)
-                msg_type = content['msg'].get('sub_type', '')
-                if msg_type == 'Event:TrialSummary':
-                    team_data, indiv_data = extract_trial_summary_data(content)
-                    team_df = pd.DataFrame([team_data])
-                    indiv_df = pd.DataFrame(indiv_data)
-
-                    team_csv_path = output_folder_path / f"{file_path.stem}_TrialSummaryData_TeamLevel.csv"
-                    indiv_csv_path = output_folder_path / f"{file_path.stem}_TrialSummaryData_IndivLevel.csv"
-
-                    team_df.to_csv(team_csv_path, index=False)
-                    indiv_df.to_csv(indiv_csv_path, index=False)
-
-                    break  # Stop after processing the first TrialSummary message
+        process_metadata_file(file_path, output_folder_path)
+
+
+def process_metadata_file(file_path, output_folder_path):
+    """Write the team and individual level trial summary csv files of one metadata file, returning
+    their paths, or None if the file has no trial summary."""
+    file_path, output_folder_path = Path(file_path), Path(output_folder_path)
+    with open(file_path, 'r', encoding='utf-8') as file:
+        for line in file:
+            content = json.loads(line)
+            msg_type = content['msg'].get('sub_type', '')
+            if msg_type == 'Event:TrialSummary':
+                team_data, indiv_data = extract_trial_summary_data(content)
+                team_df = pd.DataFrame([team_data])
+                indiv_df = pd.DataFrame(indiv_data)
+
+                team_csv_path = output_folder_path / f"{file_path.stem}_TrialSummaryData_TeamLevel.csv"
+                indiv_csv_path = output_folder_path / f"{file_path.stem}_TrialSummaryData_IndivLevel.csv"
+
+                team_df.to_csv(team_csv_path, index=False)
+                indiv_df.to_csv(indiv_csv_path, index=False)
+
+                return team_csv_path, indiv_csv_path  # Stop after processing the first TrialSummary message
+    return None
 
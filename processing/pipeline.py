@@ -0,0 +1,683 @@
+''' processing pipeline as a graph of stages with declared inputs and outputs, rerunning only the
+stages whose inputs or code changed since they last ran '''
+
+import os
+import sys
+import glob
+import json
+import time
+import hashlib
+import inspect
+import argparse
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from processing import workspace, archive, extract, dedup, etl, metadata, survey, team, timeseries, dataset, incremental
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+PIPELINE_MANIFEST_FILE = 'pipeline_manifest.json'
+HASH_CHUNK_SIZE = 1024 ** 2
+# memory assumed for a stage that has not run yet, and the share of the physical memory the
+# concurrent stages may use by default
+DEFAULT_STAGE_MEMORY_BYTES = 2 * 1024 ** 3
+MEMORY_BUDGET_SHARE = 0.8
+
+
+###################################
+# functions for the pipeline stages
+###################################
+
+def pipeline_paths(download_dir_path, data_dir_path):
+    """Paths of the files and directories the pipeline reads and writes."""
+    download_dir_path, data_dir_path = str(download_dir_path), str(data_dir_path)
+    processed_time_series_split_dir_path = os.path.join(data_dir_path, "processed_time_series_split")
+    return {
+        'download_dir_path': download_dir_path,
+        'archive_catalog_file_path': os.path.join(data_dir_path, "archive_catalog.csv"),
+        'metadata_dir_path': os.path.join(data_dir_path, "metadata"),
+        'metadata_unique_dir_path': os.path.join(data_dir_path, "metadata_unique"),
+        'message_subtypes_unique_file_path': os.path.join(data_dir_path, "unique_message_subtypes_with_examples.csv"),
+        'intervention_measures_dir_path': os.path.join(data_dir_path, "intervention_measures"),
+        'intervention_measures_file_path': os.path.join(data_dir_path, "intervention_measures.csv"),
+        'intervention_measures_unique_file_path': os.path.join(data_dir_path, "intervention_measures_unique.csv"),
+        'processed_trial_summary_dir_path': os.path.join(data_dir_path, "processed_trial_summary"),
+        'individual_measures_combined_file_path': os.path.join(data_dir_path, "individual_measures_combined.csv"),
+        'individual_measures_unique_file_path': os.path.join(data_dir_path, "individual_measures_unique.csv"),
+        'individual_measures_calculated_unique_file_path': os.path.join(data_dir_path, "individual_measures_calculated_unique.csv"),
+        'individual_trial_measures_combined_file_path': os.path.join(data_dir_path, "individual_trial_measures_combined.csv"),
+        'individual_player_profiles_trial_measures_combined_file_path': os.path.join(data_dir_path, "individual_player_profiles_trial_measures_combined.csv"),
+        'teams_alignment_results_combined_file_path': os.path.join(data_dir_path, "teams_alignment_results_combined.csv"),
+        'teams_alignment_subset_sweep_file_path': os.path.join(data_dir_path, "teams_alignment_subset_sweep.csv"),
+        'trial_measures_team_combined_file_path': os.path.join(data_dir_path, "trial_measures_team_combined.csv"),
+        'trial_level_team_profiles_file_path': os.path.join(data_dir_path, "trial_level_team_profiles.csv"),
+        'teams_player_profiles_trial_measures_combined_file_path': os.path.join(data_dir_path, "teams_player_profiles_trial_measures_combined.csv"),
+        'team_index_file_path': os.path.join(data_dir_path, "team_index.npz"),
+        'incremental_dir_path': os.path.join(data_dir_path, "incremental"),
+        'processed_time_series_cleaned_dir_path': os.path.join(data_dir_path, "processed_time_series_cleaned"),
+        'processed_time_series_cleaned_profiles_dir_path': os.path.join(data_dir_path, "processed_time_series_cleaned_profiles"),
+        'profile_store_dir_path': os.path.join(data_dir_path, "profile_store"),
+        'trial_catalog_dir_path': os.path.join(data_dir_path, "trial_catalog"),
+        'trial_summary_profiles_file_path': os.path.join(data_dir_path, "trial_summary_profiles.csv"),
+        'trial_summary_long_file_path': os.path.join(data_dir_path, "trial_summary_long.csv"),
+        'trial_summary_profiles_post_processed_file_path': os.path.join(data_dir_path, "trial_summary_profiles_post_processed.csv"),
+        'trial_summary_profiles_cleaned_file_path': os.path.join(data_dir_path, "trial_summary_profiles_cleaned.csv"),
+        'trial_summary_features_file_path': os.path.join(data_dir_path, "trial_summary_features.csv"),
+        'teams_trial_summary_profiles_surveys_file_path': os.path.join(data_dir_path, "teams_trial_summary_profiles_surveys.csv"),
+        'player_state_items_objects_dir_path': os.path.join(processed_time_series_split_dir_path, "player_states_items_objects"),
+        'player_state_flocking_dir_path': os.path.join(processed_time_series_split_dir_path, "player_states_flocking"),
+        'flocking_dir_path': os.path.join(processed_time_series_split_dir_path, "flocking"),
+        'team_behaviors_asi_flocking_dir_path': os.path.join(processed_time_series_split_dir_path, "team_behaviors_asi_flocking"),
+        'team_behaviors_flocking_dir_path': os.path.join(processed_time_series_split_dir_path, "team_behaviors_flocking"),
+        'team_behaviors_asi_dir_path': os.path.join(processed_time_series_split_dir_path, "team_behaviors_asi"),
+        'split_index_dir_path': os.path.join(processed_time_series_split_dir_path, "split_index"),
+    }
+
+
+def stage(name, function, args, inputs, outputs, **options):
+    """A pipeline stage: function(*args) reads the inputs and writes the outputs, each a file, a
+    directory or a glob pattern of files. Options: 'checkpoint', the workspace checkpoint reached
+    after the stage, 'disk_inputs', set when the stage reads its inputs from disk rather than
+    through the workspace, and 'parallel', set when the stage keeps every CPU busy on its own."""
+    return {'name': name, 'function': function, 'args': list(args), 'inputs': list(inputs),
+            'outputs': list(outputs), **options}
+
+
+def pipeline_stages(paths, fused_time_series=False, summary_only_time_series=False, lazy_profiles=False,
+                    split_index=False):
+    """Stages of the processing pipeline in run order, for the given time series mode. With split_index
+    the splits are stored as row-index lists over one columnar file per trial."""
+    p = paths
+    split_dir_paths = [p['player_state_items_objects_dir_path'],
+                       p['player_state_flocking_dir_path'],
+                       p['flocking_dir_path'],
+                       p['team_behaviors_asi_flocking_dir_path'],
+                       p['team_behaviors_flocking_dir_path'],
+                       p['team_behaviors_asi_dir_path']]
+    # the trial summary directory is shared, each stage writing its own files
+    trial_summary_team_level = os.path.join(p['processed_trial_summary_dir_path'], '*_TeamLevel.csv')
+    trial_summary_indiv_level = os.path.join(p['processed_trial_summary_dir_path'], '*_IndivLevel.csv')
+    trial_summary_long = os.path.join(p['processed_trial_summary_dir_path'], '*_TrialSummary_Long.csv')
+    profiles = p['individual_player_profiles_trial_measures_combined_file_path']
+    teams_profiles = p['teams_player_profiles_trial_measures_combined_file_path']
+
+    stages = [
+        # the stages reading the archives share the catalog, refreshed once here
+        stage('archive_catalog', archive.load_archive_catalog,
+              [p['download_dir_path'], p['archive_catalog_file_path']],
+              [p['download_dir_path']], [p['archive_catalog_file_path']]),
+        stage('extract_metadata', extract.extract_metadata,
+              [p['download_dir_path'], p['metadata_dir_path'], p['archive_catalog_file_path']],
+              [p['download_dir_path'], p['archive_catalog_file_path']], [p['metadata_dir_path']]),
+        stage('dedup_metadata', dedup.save_unique_files,
+              [p['metadata_dir_path'], p['metadata_unique_dir_path']],
+              [p['metadata_dir_path']], [p['metadata_unique_dir_path']]),
+        stage('message_subtypes', etl.write_subtypes_to_csv,
+              [p['metadata_unique_dir_path'], p['message_subtypes_unique_file_path']],
+              [p['metadata_unique_dir_path']], [p['message_subtypes_unique_file_path']]),
+        stage('intervention_files', etl.extract_and_rename_csv_files,
+              [p['download_dir_path'], p['intervention_measures_dir_path'], p['archive_catalog_file_path']],
+              [p['download_dir_path'], p['archive_catalog_file_path']], [p['intervention_measures_dir_path']]),
+        stage('intervention_measures', etl.write_intervention_measures_content,
+              [p['intervention_measures_dir_path'], p['intervention_measures_file_path']],
+              [p['intervention_measures_dir_path']], [p['intervention_measures_file_path']]),
+        stage('intervention_measures_unique', etl.write_intervention_measures_content_unique,
+              [p['intervention_measures_dir_path'], p['intervention_measures_unique_file_path']],
+              [p['intervention_measures_dir_path']], [p['intervention_measures_unique_file_path']]),
+        stage('trial_summary_data', metadata.process_metadata_files,
+              [p['metadata_dir_path'], p['processed_trial_summary_dir_path']],
+              [p['metadata_dir_path']], [trial_summary_team_level, trial_summary_indiv_level]),
+        stage('individual_measures', survey.write_individual_measures_combined,
+              [p['download_dir_path'], p['individual_measures_combined_file_path'], None,
+               p['archive_catalog_file_path']],
+              [p['download_dir_path'], p['archive_catalog_file_path']], [p['individual_measures_combined_file_path']]),
+        stage('individual_measures_unique', survey.write_individual_measures_unique,
+              [p['individual_measures_combined_file_path'], p['individual_measures_unique_file_path']],
+              [p['individual_measures_combined_file_path']], [p['individual_measures_unique_file_path']]),
+        stage('individual_measures_calculated', survey.write_individual_measures_calculated_unique,
+              [p['individual_measures_unique_file_path'], p['individual_measures_calculated_unique_file_path']],
+              [p['individual_measures_unique_file_path']], [p['individual_measures_calculated_unique_file_path']]),
+        stage('individual_trial_measures', survey.write_individual_trial_measures_combined,
+              [p['processed_trial_summary_dir_path'], p['individual_trial_measures_combined_file_path']],
+              [trial_summary_indiv_level], [p['individual_trial_measures_combined_file_path']]),
+        stage('player_profiles', survey.write_individual_player_profile_trial_measures_combined,
+              [p['individual_measures_calculated_unique_file_path'], p['individual_trial_measures_combined_file_path'],
+               p['individual_measures_combined_file_path'], profiles],
+              [p['individual_measures_calculated_unique_file_path'], p['individual_trial_measures_combined_file_path'],
+               p['individual_measures_combined_file_path']], [profiles]),
+        stage('player_profiles_post_hoc', survey.post_hoc_calculate,
+              [profiles], [profiles], [profiles], checkpoint='survey'),
+        stage('team_alignment', survey.align_individual_player_profiles_trial_measures_combined,
+              [profiles, p['teams_alignment_results_combined_file_path'], 'trial_id',
+               p['teams_alignment_subset_sweep_file_path']],
+              [profiles], [p['teams_alignment_results_combined_file_path'], p['teams_alignment_subset_sweep_file_path']]),
+        stage('team_trial_measures', team.collate_team_trial_measures,
+              [p['processed_trial_summary_dir_path'], p['trial_measures_team_combined_file_path']],
+              [trial_summary_team_level], [p['trial_measures_team_combined_file_path']]),
+        stage('trial_level_team_profiles', team.calculate_trial_level_team_profiles,
+              [profiles, p['trial_level_team_profiles_file_path']],
+              [profiles], [p['trial_level_team_profiles_file_path']]),
+        stage('team_player_profiles', team.write_team_player_profiles_trial_measures_combined,
+              [p['trial_measures_team_combined_file_path'], p['trial_level_team_profiles_file_path'],
+               p['teams_alignment_results_combined_file_path'], teams_profiles],
+              [p['trial_measures_team_combined_file_path'], p['trial_level_team_profiles_file_path'],
+               p['teams_alignment_results_combined_file_path']], [teams_profiles]),
+        stage('repeat_teams', team.identify_repeat_teams,
+              [teams_profiles, p['team_index_file_path']], [teams_profiles], [teams_profiles, p['team_index_file_path']]),
+        stage('player_profiles_integrate', team.integrate_individual_player_profiles_trial_measures_combined,
+              [p['trial_measures_team_combined_file_path'], profiles],
+              [p['trial_measures_team_combined_file_path'], profiles], [profiles], checkpoint='team'),
+    ]
+
+    if summary_only_time_series:
+        # trial summaries accumulated while the metadata is read, no time series is written
+        stages.append(stage('trial_summaries', timeseries.run_trial_summaries,
+                            [p['metadata_unique_dir_path'], profiles, teams_profiles,
+                             p['processed_trial_summary_dir_path']],
+                            [p['metadata_unique_dir_path'], profiles, teams_profiles], [trial_summary_long],
+                            disk_inputs=True, parallel=True))
+    elif fused_time_series:
+        # one worker per trial keeps the time series in memory from extraction through splitting
+        stages.append(stage('fused_time_series', timeseries.run_fused_time_series,
+                            [p['metadata_unique_dir_path'], profiles, teams_profiles,
+                             p['processed_trial_summary_dir_path'], *split_dir_paths],
+                            [p['metadata_unique_dir_path'], profiles, teams_profiles],
+                            [trial_summary_long, *split_dir_paths], disk_inputs=True, parallel=True))
+    else:
+        stages.append(stage('time_series', timeseries.extract_and_write_time_series,
+                            [p['metadata_unique_dir_path'], p['processed_time_series_cleaned_dir_path']],
+                            [p['metadata_unique_dir_path']], [p['processed_time_series_cleaned_dir_path']]))
+        # catalog and indexes for loading parts of trials with dataset.load_trial
+        stages.append(stage('trial_catalog', dataset.build_trial_catalog,
+                            [p['processed_time_series_cleaned_dir_path'], p['trial_catalog_dir_path']],
+                            [p['processed_time_series_cleaned_dir_path']], [p['trial_catalog_dir_path']]))
+        if lazy_profiles:
+            # the profiles are stored once and attached whenever the later stages read a time series
+            time_series_dir_path = p['processed_time_series_cleaned_dir_path']
+            profile_store_dir_path = p['profile_store_dir_path']
+            stages.append(stage('profile_store', timeseries.write_profile_store,
+                                [profiles, teams_profiles, profile_store_dir_path],
+                                [profiles, teams_profiles], [profile_store_dir_path], disk_inputs=True))
+            time_series_inputs = [time_series_dir_path, profile_store_dir_path]
+        else:
+            time_series_dir_path = p['processed_time_series_cleaned_profiles_dir_path']
+            profile_store_dir_path = None
+            stages.append(stage('profiled_time_series', timeseries.add_profiles_to_time_series,
+                                [p['processed_time_series_cleaned_dir_path'], profiles, teams_profiles,
+                                 time_series_dir_path],
+                                [p['processed_time_series_cleaned_dir_path'], profiles, teams_profiles],
+                                [time_series_dir_path], disk_inputs=True))
+            time_series_inputs = [time_series_dir_path]
+        stages.append(stage('event_summaries', timeseries.summarize_events,
+                            [time_series_dir_path, p['processed_trial_summary_dir_path'], profile_store_dir_path],
+                            time_series_inputs, [trial_summary_long]))
+
+    stages.append(stage('collate_summaries', timeseries.collate_summaries,
+                        [p['processed_trial_summary_dir_path'], p['trial_summary_profiles_file_path'],
+                         p['trial_summary_long_file_path']],
+                        [trial_summary_long], [p['trial_summary_profiles_file_path'], p['trial_summary_long_file_path']]))
+    stages.append(stage('post_process_summaries', timeseries.post_process_trial_summaries,
+                        [p['trial_summary_profiles_file_path'], p['trial_summary_profiles_post_processed_file_path'],
+                         p['trial_summary_profiles_cleaned_file_path'], p['trial_level_team_profiles_file_path'],
+                         p['teams_trial_summary_profiles_surveys_file_path'], p['trial_summary_features_file_path']],
+                        [p['trial_summary_profiles_file_path'], p['trial_level_team_profiles_file_path']],
+                        [p['trial_summary_profiles_post_processed_file_path'],
+                         p['trial_summary_profiles_cleaned_file_path'],
+                         p['teams_trial_summary_profiles_surveys_file_path'], p['trial_summary_features_file_path']],
+                        checkpoint='summaries'))
+
+    if not (fused_time_series or summary_only_time_series):
+        if split_index:
+            split_index_dir_path = p['split_index_dir_path']
+            split_outputs = [split_index_dir_path,
+                             os.path.join(p['team_behaviors_flocking_dir_path'], timeseries.FLOCKING_PERIODS_DIR_NAME)]
+        else:
+            split_index_dir_path = None
+            split_outputs = split_dir_paths
+        stages.append(stage('split_time_series', timeseries.split_time_series,
+                            [time_series_dir_path, *split_dir_paths, split_index_dir_path, profile_store_dir_path],
+                            time_series_inputs, split_outputs))
+    return stages
+
+
+##############################
+# functions for content hashes
+##############################
+
+def is_pattern(path):
+    """Whether a declared input or output is a glob pattern of files."""
+    return any(character in os.path.basename(path) for character in '*?[')
+
+
+def matched_files(path):
+    """Files a declared input or output covers, sorted: the file itself, every file below a
+    directory or the files matching a glob pattern. None if the path does not exist."""
+    if is_pattern(path):
+        return sorted(glob.glob(path)) or None
+    if os.path.isdir(path):
+        return sorted(os.path.join(root, file) for root, _, files in os.walk(path) for file in files)
+    return [path] if os.path.isfile(path) else None
+
+
+def file_hash(file_path, file_hashes):
+    """Content hash of a file, reused from file_hashes while the file's size and mtime are unchanged."""
+    stat = os.stat(file_path)
+    key = os.path.abspath(file_path)
+    cached = file_hashes.get(key)
+    if cached is None or cached[0] != stat.st_size or cached[1] != stat.st_mtime_ns:
+        cached = file_hashes[key] = [stat.st_size, stat.st_mtime_ns,
+                                     dedup.compute_checksum(file_path, HASH_CHUNK_SIZE)]
+    return cached[2]
+
+
+def path_hash(path, file_hashes):
+    """Content hash of a declared input or output, over the names and contents of the files it
+    covers. None if it covers no file."""
+    files = matched_files(path)
+    if files is None:
+        return None
+    if files == [path]:
+        return file_hash(path, file_hashes)
+    base_path = os.path.dirname(path) if is_pattern(path) else path
+    digest = hashlib.sha256()
+    for file_path in files:
+        digest.update(os.path.relpath(file_path, base_path).encode('utf-8'))
+        digest.update(file_hash(file_path, file_hashes).encode('ascii'))
+    return digest.hexdigest()
+
+
+def code_version(function):
+    """Hash of the source of the module defining a stage function."""
+    return hashlib.sha256(inspect.getsource(inspect.getmodule(function)).encode('utf-8')).hexdigest()
+
+
+#####################################
+# functions for the pipeline manifest
+#####################################
+
+def read_manifest(manifest_file_path):
+    """Pipeline manifest: the key, input hashes and output hashes each stage last ran with, and
+    the cached content hashes of files by path."""
+    if os.path.exists(manifest_file_path):
+        with open(manifest_file_path, 'r', encoding='utf-8') as manifest_file:
+            return json.load(manifest_file)
+    return {'stages': {}, 'files': {}}
+
+
+def write_manifest(manifest, manifest_file_path):
+    """Write the pipeline manifest, dropping the cached hashes of files that no longer exist."""
+    manifest['files'] = {file_path: entry for file_path, entry in manifest['files'].items()
+                         if os.path.exists(file_path)}
+    with open(manifest_file_path, 'w', encoding='utf-8') as manifest_file:
+        json.dump(manifest, manifest_file, indent=1, sort_keys=True)
+
+
+def record_stages(manifest, stages, keys, inputs, durations, peak_memory=None):
+    """Record the stages that ran in the manifest, with the hashes of their outputs as written, their
+    run time and, when run in a worker process, its peak memory."""
+    for index, seconds in durations.items():
+        stage_config = stages[index]
+        manifest['stages'][stage_config['name']] = {
+            'key': keys[index],
+            'code_version': code_version(stage_config['function']),
+            'inputs': inputs[index],
+            'outputs': {path: path_hash(path, manifest['files']) for path in stage_config['outputs']},
+            'seconds': seconds,
+            'memory': (peak_memory or {}).get(index)}
+
+
+###################################
+# functions for planning stage runs
+###################################
+
+def stage_producers(stages):
+    """For each stage, the index of the stage last writing each of its inputs before it, by input;
+    inputs no stage writes are left out."""
+    producers = []
+    for index, stage_config in enumerate(stages):
+        producers.append({})
+        for path in stage_config['inputs']:
+            writers = [writer for writer in range(index) if path in stages[writer]['outputs']]
+            if writers:
+                producers[index][path] = writers[-1]
+    return producers
+
+
+def rewritten_groups(stages):
+    """Stages bound to a file rewritten in place: when any of its writers, or a stage reading it
+    between the first and last writer, runs, all its writers run so the file is rebuilt from
+    scratch. Returns (triggers, writers) pairs of index sets."""
+    groups = []
+    for path in dict.fromkeys(path for stage_config in stages for path in stage_config['outputs']):
+        writers = [index for index, stage_config in enumerate(stages) if path in stage_config['outputs']]
+        if len(writers) > 1:
+            readers = [index for index, stage_config in enumerate(stages)
+                       if path in stage_config['inputs'] and writers[0] < index < writers[-1]]
+            groups.append((set(writers) | set(readers), set(writers)))
+    return groups
+
+
+def stage_dependencies(stages):
+    """For each stage, the indexes of the earlier stages it waits for: those writing a path it reads
+    or writes, and those reading a path it writes."""
+    dependencies = []
+    for index, stage_config in enumerate(stages):
+        reads, writes = set(stage_config['inputs']), set(stage_config['outputs'])
+        dependencies.append({earlier for earlier in range(index)
+                             if reads & set(stages[earlier]['outputs'])
+                             or writes & (set(stages[earlier]['inputs']) | set(stages[earlier]['outputs']))})
+    return dependencies
+
+
+def stage_key(stage_config, inputs):
+    """Key of a stage run: its function, code version, arguments and input hashes."""
+    function = stage_config['function']
+    description = {'function': f'{function.__module__}.{function.__qualname__}',
+                   'code_version': code_version(function),
+                   'args': [None if arg is None else str(arg) for arg in stage_config['args']],
+                   'inputs': inputs}
+    return hashlib.sha256(json.dumps(description, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def plan_pipeline(stages, manifest, selected, force=False):
+    """Decide which stages run. A selected stage runs when forced, when it never ran, when its key
+    changed or when its outputs are missing or changed since it ran. Inputs written by no stage
+    are hashed by content; inputs written by an earlier stage stand for that stage's key, the key
+    it runs with now or, if it does not run, the key it last ran with. Returns the key and the
+    input hashes of each stage and the set of indexes of the stages to run."""
+    file_hashes = manifest['files']
+    producers = stage_producers(stages)
+    groups = rewritten_groups(stages)
+    external_hashes, output_hashes = {}, {}
+    run = set()
+    while True:
+        keys, inputs, effective_keys, planned = [], [], [], set()
+        for index, stage_config in enumerate(stages):
+            stage_inputs = {}
+            for path in stage_config['inputs']:
+                if path in producers[index]:
+                    producer = producers[index][path]
+                    stage_inputs[path] = f"{stages[producer]['name']}:{effective_keys[producer]}"
+                else:
+                    if path not in external_hashes:
+                        external_hashes[path] = path_hash(path, file_hashes)
+                    stage_inputs[path] = external_hashes[path]
+            key = stage_key(stage_config, stage_inputs)
+            keys.append(key)
+            inputs.append(stage_inputs)
+
+            record = manifest['stages'].get(stage_config['name'])
+            if index in run:
+                planned.add(index)
+            elif index in selected:
+                if index not in output_hashes:
+                    output_hashes[index] = {path: path_hash(path, file_hashes) for path in stage_config['outputs']}
+                if (force or record is None or record['key'] != key
+                        or any(output_hash is None or output_hash != record['outputs'].get(path)
+                               for path, output_hash in output_hashes[index].items())):
+                    planned.add(index)
+            effective_keys.append(key if index in planned or record is None else record['key'])
+
+        for triggers, writers in groups:
+            if planned & triggers:
+                planned |= writers
+        if planned == run:
+            return keys, inputs, run
+        run = planned
+
+
+def stage_index(stages, name):
+    """Index of the stage of the given name."""
+    names = [stage_config['name'] for stage_config in stages]
+    if name not in names:
+        raise KeyError(f"Unknown pipeline stage {name}, expected one of {names}")
+    return names.index(name)
+
+
+def select_stages(stages, start=None, end=None, only=None):
+    """Indexes of the selected stages: with start, the stage and the stages depending on it; with
+    end, the stage and the stages it depends on; with only, exactly the given stages; all stages
+    by default."""
+    if only:
+        return {stage_index(stages, name) for name in only}
+    producers = stage_producers(stages)
+    selected = set(range(len(stages)))
+    if start is not None:
+        descendants = {stage_index(stages, start)}
+        for index in range(len(stages)):
+            if descendants & set(producers[index].values()):
+                descendants.add(index)
+        selected &= descendants
+    if end is not None:
+        ancestors = {stage_index(stages, end)}
+        for index in reversed(range(len(stages))):
+            if index in ancestors:
+                ancestors.update(producers[index].values())
+        selected &= ancestors
+    return selected
+
+
+####################################
+# functions for running the pipeline
+####################################
+
+def run_stages(stages, run, checkpoints, durations):
+    """Run the stages of run in order, handing tables between them through a workspace persisted
+    at the given checkpoints and at the end. Fills durations with the run time of each stage."""
+    workspace.start_workspace(checkpoints)
+    try:
+        for index, stage_config in enumerate(stages):
+            if index in run:
+                if stage_config.get('disk_inputs'):
+                    # the stage reads its inputs from disk, in worker processes
+                    workspace.persist(stage_config['inputs'])
+                start_time = time.perf_counter()
+                stage_config['function'](*stage_config['args'])
+                durations[index] = time.perf_counter() - start_time
+            if stage_config.get('checkpoint'):
+                workspace.checkpoint(stage_config['checkpoint'])
+    finally:
+        workspace.finish_workspace()
+
+
+def peak_memory_bytes():
+    """Peak resident memory of this process, None where the resource module is unavailable."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def default_memory_budget_bytes():
+    """Share of the physical memory the concurrent stages may use, None where it is unknown."""
+    try:
+        return int(os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') * MEMORY_BUDGET_SHARE)
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def run_stage(function, args):
+    """Run one stage in a worker process, its tables persisted when it finishes. Returns the run time
+    and the peak memory of the worker."""
+    workspace.start_workspace()
+    start_time = time.perf_counter()
+    try:
+        function(*args)
+    finally:
+        workspace.finish_workspace()
+    return time.perf_counter() - start_time, peak_memory_bytes()
+
+
+def critical_path(dependencies, durations):
+    """Longest chain of dependent stages by run time, as (stage indexes, seconds)."""
+    lengths, previous = {}, {}
+    for index in sorted(durations):
+        before = [earlier for earlier in dependencies[index] if earlier in lengths]
+        previous[index] = max(before, key=lambda earlier: lengths[earlier], default=None)
+        lengths[index] = durations[index] + (lengths[previous[index]] if previous[index] is not None else 0)
+    if not lengths:
+        return [], 0.0
+    index = max(lengths, key=lambda end: lengths[end])
+    seconds, path = lengths[index], []
+    while index is not None:
+        path.append(index)
+        index = previous[index]
+    return path[::-1], seconds
+
+
+def schedule_stages(stages, run, manifest, durations, peak_memory, cpu_budget=None, memory_budget_bytes=None):
+    """Run the stages of run concurrently, each in its own worker process started once the stages
+    it depends on finished and the budgets allow: the running stages use at most cpu_budget CPUs
+    (all of them for a 'parallel' stage) and memory_budget_bytes, estimated by the peak memory each
+    stage last ran with. Ready stages on the longest remaining chain, estimated by their last run
+    times, start first. Tables are handed between the stages on disk. Fills durations and
+    peak_memory, then prints the critical path and the achieved parallelism."""
+    if not run:
+        return [], 0.0
+    cpu_budget = cpu_budget or os.cpu_count() or 1
+    if memory_budget_bytes is None:
+        memory_budget_bytes = default_memory_budget_bytes()
+    all_dependencies = stage_dependencies(stages)
+    dependencies = {index: all_dependencies[index] & run for index in run}
+    records = {index: manifest['stages'].get(stages[index]['name']) or {} for index in run}
+    cpus = {index: cpu_budget if stages[index].get('parallel') else 1 for index in run}
+    memory = {index: records[index].get('memory') or DEFAULT_STAGE_MEMORY_BYTES for index in run}
+
+    # longest chain of estimated run times from each stage to the end of the pipeline
+    remaining = {}
+    for index in sorted(run, reverse=True):
+        dependents = [later for later in run if index in dependencies[later]]
+        remaining[index] = (records[index].get('seconds') or 1.0) + max((remaining[later] for later in dependents),
+                                                                        default=0.0)
+
+    pending, running, failure = set(run), {}, None
+    start_time = time.perf_counter()
+    while pending or running:
+        if failure is None:
+            ready = sorted((index for index in pending if dependencies[index] <= set(durations)),
+                           key=lambda index: (-remaining[index], index))
+            for index in ready:
+                used_cpus = sum(cpus[running_index] for running_index, _ in running.values())
+                used_memory = sum(memory[running_index] for running_index, _ in running.values())
+                if running and (used_cpus + cpus[index] > cpu_budget or (memory_budget_bytes is not None
+                                and used_memory + memory[index] > memory_budget_bytes)):
+                    continue
+                print(f"Starting stage {stages[index]['name']}...")
+                executor = ProcessPoolExecutor(max_workers=1)
+                future = executor.submit(run_stage, stages[index]['function'], stages[index]['args'])
+                running[future] = (index, executor)
+                pending.discard(index)
+        else:
+            pending.clear()
+        if not running:
+            break
+        done, _ = wait(running, return_when=FIRST_COMPLETED)
+        for future in done:
+            index, executor = running.pop(future)
+            executor.shutdown()
+            try:
+                durations[index], peak_memory[index] = future.result()
+            except Exception as e:
+                print(f"Stage {stages[index]['name']} failed: {e}")
+                failure = failure or e
+    elapsed = time.perf_counter() - start_time
+    if failure is not None:
+        raise failure
+
+    path, path_seconds = critical_path(dependencies, durations)
+    stage_seconds = sum(durations.values())
+    print(f"Ran {len(durations)} stages in {elapsed:.1f}s for {stage_seconds:.1f}s of stage time, "
+          f"parallelism {stage_seconds / elapsed if elapsed else 1.0:.2f}")
+    print(f"Critical path ({path_seconds:.1f}s): {' -> '.join(stages[index]['name'] for index in path)}")
+    return path, elapsed
+
+
+def run_pipeline(download_dir_path, data_dir_path, fused_time_series=False, summary_only_time_series=False,
+                 lazy_profiles=False, checkpoints=(), start=None, end=None, only=None, force=False,
+                 dry_run=False, concurrent=False, cpu_budget=None, memory_budget_bytes=None, split_index=False):
+    """Run the selected stages of the processing pipeline whose inputs or code changed since they
+    last ran (all selected stages with force), recording each run in the pipeline manifest of the
+    data directory. The stages run in order, handing tables through a workspace (see run_stages), or
+    with concurrent, as soon as they are ready within the CPU and memory budgets (see
+    schedule_stages). With dry_run only the plan is printed. Returns the names of the stages run
+    or to run."""
+    stages = pipeline_stages(pipeline_paths(download_dir_path, data_dir_path),
+                             fused_time_series, summary_only_time_series, lazy_profiles, split_index)
+    manifest_file_path = os.path.join(data_dir_path, PIPELINE_MANIFEST_FILE)
+    manifest = read_manifest(manifest_file_path)
+    selected = select_stages(stages, start, end, only)
+    keys, inputs, run = plan_pipeline(stages, manifest, selected, force)
+
+    print(f"Running {len(run)} of {len(stages)} pipeline stages...")
+    for index in sorted(set(range(len(stages))) - run):
+        if index in selected:
+            print(f"Skipping unchanged stage {stages[index]['name']}")
+    for index in sorted(run - selected):
+        print(f"Also running stage {stages[index]['name']}, it writes a file rewritten in place by the selected stages")
+    if dry_run:
+        for index, stage_config in enumerate(stages):
+            print(f"{'run ' if index in run else 'skip'}  {stage_config['name']}")
+        return [stages[index]['name'] for index in sorted(run)]
+
+    os.makedirs(data_dir_path, exist_ok=True)
+    durations, peak_memory = {}, {}
+    try:
+        if concurrent:
+            schedule_stages(stages, run, manifest, durations, peak_memory, cpu_budget, memory_budget_bytes)
+        else:
+            run_stages(stages, run, checkpoints, durations)
+    finally:
+        record_stages(manifest, stages, keys, inputs, durations, peak_memory)
+        write_manifest(manifest, manifest_file_path)
+    return [stages[index]['name'] for index in sorted(durations)]
+
+
+def main(argv=None):
+    """Command line entry point: python -m processing.pipeline DOWNLOAD_DIR DATA_DIR [options]."""
+    parser = argparse.ArgumentParser(description="Process the downloaded dataset, rerunning only the stages "
+                                                 "whose inputs or code changed since they last ran.")
+    parser.add_argument('download_dir', help="dataset download directory")
+    parser.add_argument('data_dir', help="analysis files output directory")
+    parser.add_argument('--from', dest='start', metavar='STAGE', help="run from this stage and its dependents")
+    parser.add_argument('--to', dest='end', metavar='STAGE', help="run up to this stage and its dependencies")
+    parser.add_argument('--only', nargs='+', metavar='STAGE', help="run only these stages")
+    parser.add_argument('--force', action='store_true', help="run the selected stages even if unchanged")
+    parser.add_argument('--dry-run', action='store_true', help="print which stages would run and exit")
+    parser.add_argument('--list', action='store_true', help="list the stages and exit")
+    parser.add_argument('--fused-time-series', action='store_true',
+                        help="fused per-trial time series processing")
+    parser.add_argument('--summary-only-time-series', action='store_true',
+                        help="trial summaries only, no time series written")
+    parser.add_argument('--lazy-profiles', action='store_true',
+                        help="attach profiles when reading, no profiled copies written")
+    parser.add_argument('--split-index', action='store_true',
+                        help="store the time series splits as row indexes over one columnar file per trial")
+    parser.add_argument('--checkpoint', nargs='+', default=(), metavar='NAME',
+                        help="persist the workspace at these checkpoints (survey, team, summaries)")
+    parser.add_argument('--concurrent', action='store_true',
+                        help="run independent stages concurrently, each in its own process")
+    parser.add_argument('--cpus', type=int, metavar='N', help="CPUs the concurrent stages may use")
+    parser.add_argument('--memory-gb', type=float, metavar='GB', help="memory the concurrent stages may use")
+    parser.add_argument('--append', action='store_true',
+                        help="append the trials of new archives to the survey and team tables and exit")
+    args = parser.parse_args(argv)
+
+    if args.list:
+        stages = pipeline_stages(pipeline_paths(args.download_dir, args.data_dir), args.fused_time_series,
+                                 args.summary_only_time_series, args.lazy_profiles, args.split_index)
+        for stage_config in stages:
+            print(stage_config['name'])
+        return
+    if args.append:
+        incremental.append_trials(pipeline_paths(args.download_dir, args.data_dir))
+        return
+    run_pipeline(args.download_dir, args.data_dir, args.fused_time_series, args.summary_only_time_series,
+                 args.lazy_profiles, args.checkpoint, args.start, args.end, args.only, args.force, args.dry_run,
+                 args.concurrent, args.cpus, int(args.memory_gb * 1024 ** 3) if args.memory_gb else None,
+                 args.split_index)
+
+
+if __name__ == '__main__':
+    main()
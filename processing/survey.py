@@ -1,161 +1,150 @@
 ''' module for processing survey data '''
 
-import os
-import zipfile
+import itertools
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 import numpy as np
 from tqdm import tqdm
 from scipy.spatial.distance import pdist, squareform
 from scipy.linalg import svd
+from processing import collate, archive, workspace
 
 #############################################
 # functions for processing individual surveys
 #############################################
 
-def extract_specific_files(zip_file_path, destination_dir, file_names):
-    with zipfile.ZipFile(zip_file_path, 'r') as zip_ref:
-        # Extract only the specified files if they exist in the zip
-        extracted_files = []
-        for file_name in file_names:
-            if file_name in zip_ref.namelist():
-                zip_ref.extract(file_name, destination_dir)
-                extracted_files.append(os.path.join(destination_dir, file_name))
-        return extracted_files
+TRIAL_ID_COLUMNS = ['TrialID', 'Trial_ID', 'TrialId']
 
 
-def read_trial_id_from_measures(file_path):
+def read_trial_id_from_archive(entry):
+    """Trial id of a survey archive, parsed from the header and first row of its trial_measures.csv
+    catalog entry."""
     try:
-        df = pd.read_csv(file_path)
-        # Check for the presence of either 'TrialID', 'Trial_ID', or 'TrialId'
-        possible_columns = ['TrialID', 'Trial_ID', 'TrialId']
-        trial_id_column = next((col for col in possible_columns if col in df.columns), None)
-        if trial_id_column:
+        df = pd.read_csv(archive.open_member(entry), nrows=1)
+        trial_id_column = next((col for col in TRIAL_ID_COLUMNS if col in df.columns), None)
+        if trial_id_column and not df.empty:
             return df[trial_id_column].iloc[0]
-        else:
-            print(f"None of the expected trial ID columns found in {file_path}.")
-            return None
+        print(f"None of the expected trial ID columns found in {entry['zip_path']}.")
+        return None
     except Exception as e:
-        print(f"Failed to read {file_path}: {e}")
+        print(f"Failed to read trial_measures.csv of {entry['zip_path']}: {e}")
         return None
 
 
-def process_individual_measures(trial_id, individual_measures_path, destination_dir):
-    if trial_id:
-        df = pd.read_csv(individual_measures_path)
-        df.insert(0, 'trial_id', trial_id)
-        output_file_name = f"{trial_id}_individual_measures.csv"
-        df.to_csv(os.path.join(destination_dir, output_file_name), index=False)
+def read_archive_individual_measures(zip_archive):
+    """Trial id and individual measures of a cataloged survey archive, read straight from the zip
+    with every cell kept as text and the trial id inserted as the first column. None if the archive
+    lacks them."""
+    members = zip_archive['members']
+    if 'trial_measures.csv' not in members:
+        print("trial_measures.csv not found.")
+        return None
+    trial_id = read_trial_id_from_archive(members['trial_measures.csv'])
+    if not trial_id or 'individual_measures.csv' not in members:
+        print("individual_measures.csv not found or trial_id could not be determined.")
+        return None
+    df = collate.read_as_text(archive.open_member(members['individual_measures.csv']))
+    df.insert(0, 'trial_id', str(trial_id))
+    return str(trial_id), df
 
 
-def extract_and_process_files(source_dir, destination_dir):
+def write_individual_measures_combined(source_dir, output_file_path, max_workers=None, catalog_file_path=None):
+    """Read the individual measures of every survey archive across a thread pool and write them as
+    one combined table, ordered by the trial id file names <trial_id>_individual_measures.csv. An
+    archive repeating a trial id replaces the earlier one in name order."""
     print("Processing individual surveys...")
-    os.makedirs(destination_dir, exist_ok=True)
-
-    for file in tqdm(os.listdir(source_dir)):
-        if file.endswith('.zip'):
-            zip_file_path = os.path.join(source_dir, file)
-            extracted_files = extract_specific_files(zip_file_path, destination_dir,
-                                                     ['trial_measures.csv', 'individual_measures.csv'])
-
-            trial_measures_path = [f for f in extracted_files if 'trial_measures.csv' in f]
-            individual_measures_path = [f for f in extracted_files if 'individual_measures.csv' in f]
-
-            if trial_measures_path:
-                trial_id = read_trial_id_from_measures(trial_measures_path[0])
-                if trial_id and individual_measures_path:
-                    process_individual_measures(trial_id, individual_measures_path[0], destination_dir)
-                else:
-                    print("individual_measures.csv not found or trial_id could not be determined.")
-            else:
-                print("trial_measures.csv not found.")
-
-
-#############################################
-# functions for combining individual measures
-#############################################
-
-def combine_individual_measures(individual_survey_dir_path, output_file_path):
-    print("Combining individual measures...")
-    # List all CSV files in the directory
-    csv_files = [file for file in os.listdir(individual_survey_dir_path) if file.endswith('_individual_measures.csv')]
+    catalog = archive.load_archive_catalog(source_dir, catalog_file_path)
+    for file, zip_archive in catalog.items():
+        if zip_archive['error']:
+            print(f"Failed to process {file} due to a zipfile error: {zip_archive['error']}")
+    zip_archives = [zip_archive for zip_archive in catalog.values() if not zip_archive['error']]
+    by_trial = read_individual_measures(zip_archives, max_workers)
+    frames = [by_trial[trial_id] for trial_id in sorted(by_trial, key=lambda trial_id: f"{trial_id}_individual_measures.csv")]
+    columns = list(dict.fromkeys(column for df in frames for column in df.columns))
+    combined_df = pd.concat([df.reindex(columns=columns) for df in frames], ignore_index=True) if frames \
+        else pd.DataFrame(columns=columns)
+    combined_df.to_csv(output_file_path, index=False)
+    return output_file_path
 
-    # Initialize an empty list to store DataFrames
-    dfs = []
 
-    # Loop through the CSV files and append them to the dfs list
-    for file in tqdm(csv_files):
-        file_path = os.path.join(individual_survey_dir_path, file)
-        df = pd.read_csv(file_path)
-        dfs.append(df)
+def read_individual_measures(zip_archives, max_workers=None):
+    """Individual measures of each trial of the cataloged survey archives, read across a thread
+    pool; an archive repeating a trial id replaces the earlier one."""
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        archives = list(tqdm(executor.map(read_archive_individual_measures, zip_archives), total=len(zip_archives)))
 
-    # Concatenate all DataFrames in the list, retaining all columns
-    combined_df = pd.concat(dfs, axis=0, ignore_index=True, sort=False)
-
-    # Save the combined DataFrame to a new CSV file
-    combined_df.to_csv(output_file_path, index=False)
+    by_trial = {}
+    for measures in archives:
+        if measures is not None:
+            trial_id, df = measures
+            by_trial[trial_id] = df
+    return by_trial
 
 
 ##########################################
 # functions for individual measures unique
 ##########################################
 
-def write_individual_measures_unique(individual_measures_combined_file_path, output_file_path):
-    print("Writing unique individual measures...")
-    data = pd.read_csv(individual_measures_combined_file_path)
-
-    # Initialize a list to hold the data for the new DataFrame
-    compiled_data = []
-
-    # Iterate over each unique PLAYER_ID to compile its information
-    for player_id in tqdm(data['PLAYER_ID'].unique()):
-        player_data = data[data['PLAYER_ID'] == player_id]
-
-        # Get all trial_ids for this PLAYER_ID
-        unique_trial_ids = player_data['trial_id'].unique()
-
-        # Initialize the info dictionary with necessary information from the first row
-        info = player_data.iloc[0].to_dict()
+# survey item columns dropped from the unique individual measures
+INDIVIDUAL_MEASURES_UNIQUE_COLUMNS_TO_DELETE = [
+    'PRSS-1', 'PRSS-2', 'PRSS-3', 'PRSS-4', 'PRSS-5', 'PRSS-6', 'PRSS-7', 'PRSS-8', 'PRSS-9',
+    'SATIS-1', 'SATIS-2', 'SATIS-3', 'SATIS-4', 'SATIS-5',
+    'SELF_EFF-1', 'SELF_EFF-2', 'SELF_EFF-3', 'SELF_EFF-4', 'SELF_EFF-5', 'SELF_EFF-6', 'SELF_EFF-7', 'SELF_EFF-8',
+    'EVAL-1', 'EVAL-2', 'EVAL-3', 'EVAL-4', 'EVAL-5', 'EVAL-6',
+    'TEAM_FAMIL-1', 'TEAM_FAMIL-2', 'TEAM_FAMIL-3'
+]
 
-        # Initialize Number_of_Trials
-        info['Number_of_Trials'] = len(unique_trial_ids)
-
-        # Iterate over each unique trial_id and teamed_with_ids to create dynamic columns
-        for i, trial_id in enumerate(unique_trial_ids, start=1):
-            # Get all unique PLAYER_IDs associated with this trial_id, excluding the current PLAYER_ID
-            teamed_with_ids = data[(data['trial_id'] == trial_id) & (data['PLAYER_ID'] != player_id)]['PLAYER_ID'].unique()
-
-            # Dynamic column names for trial_id and associated PLAYER_IDs
-            trial_column_name = f'associated_trial_id_{i}'
-            teamed_column_name = f'Teamed_With_{i}'
-
-            # Populate info dictionary with trial_id and teamed_with_ids
-            info[trial_column_name] = trial_id
-            info[teamed_column_name] = ', '.join(map(str, teamed_with_ids))
-
-        # Append this compiled info to our list
-        compiled_data.append(info)
-
-    # Convert compiled_data to a DataFrame
-    compiled_df = pd.DataFrame(compiled_data)
 
+def arrange_individual_measures_unique(compiled_df):
+    """Rename the profile source trial column and drop the survey item columns."""
     # Rename 'trial_id' column to 'source_trial_id' in the DataFrame
     if 'trial_id' in compiled_df.columns:
         compiled_df.rename(columns={'trial_id': 'profile_source_trial_id'}, inplace=True)
 
-    # Columns to be deleted
-    columns_to_delete = [
-        'PRSS-1', 'PRSS-2', 'PRSS-3', 'PRSS-4', 'PRSS-5', 'PRSS-6', 'PRSS-7', 'PRSS-8', 'PRSS-9',
-        'SATIS-1', 'SATIS-2', 'SATIS-3', 'SATIS-4', 'SATIS-5',
-        'SELF_EFF-1', 'SELF_EFF-2', 'SELF_EFF-3', 'SELF_EFF-4', 'SELF_EFF-5', 'SELF_EFF-6', 'SELF_EFF-7', 'SELF_EFF-8',
-        'EVAL-1', 'EVAL-2', 'EVAL-3', 'EVAL-4', 'EVAL-5', 'EVAL-6',
-        'TEAM_FAMIL-1', 'TEAM_FAMIL-2', 'TEAM_FAMIL-3'
-    ]
-
     # Delete specified columns if they exist in DataFrame to avoid KeyError
-    compiled_df = compiled_df.drop(columns=[col for col in columns_to_delete if col in compiled_df.columns], errors='ignore')
+    columns_to_delete = INDIVIDUAL_MEASURES_UNIQUE_COLUMNS_TO_DELETE
+    return compiled_df.drop(columns=[col for col in columns_to_delete if col in compiled_df.columns], errors='ignore')
+
+
+def individual_measures_unique_frame(data):
+    """One row per PLAYER_ID: its first row of the combined measures, its Number_of_Trials and, for
+    each of its trials in order, associated_trial_id_i and the comma separated Teamed_With_i.
+    Built from the distinct (player, trial) pairs and one self-join of them on trial_id."""
+    data = data[data['PLAYER_ID'].notna()].reset_index(drop=True)
+    first_rows = data.drop_duplicates('PLAYER_ID').reset_index(drop=True)
+
+    # each player's trials in order of first appearance, ranked from 1
+    pairs = data[['PLAYER_ID', 'trial_id']].drop_duplicates().reset_index(drop=True)
+    pairs['rank'] = pairs.groupby('PLAYER_ID', sort=False).cumcount() + 1
+    pairs['pair'] = np.arange(len(pairs))
+
+    # the other players of each trial, in order of first appearance in the data
+    roster = pairs[pairs['trial_id'].notna()][['trial_id', 'PLAYER_ID', 'pair']]
+    teammates = pairs[['pair', 'PLAYER_ID', 'trial_id']].merge(roster, on='trial_id', suffixes=('', '_teammate'))
+    teammates = teammates[teammates['PLAYER_ID'] != teammates['PLAYER_ID_teammate']]
+    teammates = teammates.sort_values(['pair', 'pair_teammate'], kind='stable')
+    teamed_with = teammates['PLAYER_ID_teammate'].astype(str).groupby(teammates['pair'], sort=False).agg(', '.join)
+    pairs['Teamed_With'] = teamed_with.reindex(pairs['pair']).fillna('').to_numpy()
+
+    trial_columns = {}
+    trials = pairs.pivot(index='PLAYER_ID', columns='rank', values=['trial_id', 'Teamed_With'])
+    trials = trials.reindex(first_rows['PLAYER_ID'])
+    for i in range(1, pairs['rank'].max() + 1 if len(pairs) else 1):
+        trial_columns[f'associated_trial_id_{i}'] = trials[('trial_id', i)].to_numpy()
+        trial_columns[f'Teamed_With_{i}'] = trials[('Teamed_With', i)].to_numpy()
+    number_of_trials = pairs.groupby('PLAYER_ID', sort=False).size().reindex(first_rows['PLAYER_ID'])
+    return pd.concat([first_rows,
+                      pd.DataFrame({'Number_of_Trials': number_of_trials.to_numpy(), **trial_columns})], axis=1)
+
+
+def write_individual_measures_unique(individual_measures_combined_file_path, output_file_path):
+    print("Writing unique individual measures...")
+    data = workspace.read_csv(individual_measures_combined_file_path)
+
+    compiled_df = arrange_individual_measures_unique(individual_measures_unique_frame(data))
 
     # Save the compiled DataFrame to a new CSV file
-    compiled_df.to_csv(output_file_path, index=False)
+    workspace.to_csv(compiled_df, output_file_path)
 
 
 #######################################################
@@ -164,8 +153,11 @@ def write_individual_measures_unique(individual_measures_combined_file_path, out
 
 def load_and_rename_columns(file_path):
     # Load the dataset
-    df = pd.read_csv(file_path)
+    df = workspace.read_csv(file_path)
+    return rename_demographic_columns(df)
+
 
+def rename_demographic_columns(df):
     # Rename columns
     df.rename(columns={
         'DEMO-1': 'Age',
@@ -176,96 +168,106 @@ def load_and_rename_columns(file_path):
     return df
 
 
-def calculate_averages(df):
-    # Calculate 'PsychCollect_avg' for complete responses
-    psych_collect_cols = [f'PSY_COL-{i}' for i in range(1, 16)]
-    df['PsychCollect_avg'] = df[psych_collect_cols].apply(lambda row: row.mean() if row.notnull().all() else None,
-                                                          axis=1)
-
-    # Calculate 'SociableDom_avg' for complete responses
-    sociable_dom_cols = [f'SOC_DOM-{i}' for i in range(1, 16)]
-    df['SociableDom_avg'] = df[sociable_dom_cols].apply(lambda row: row.mean() if row.notnull().all() else None, axis=1)
-
-    return df
-
-
-def calculate_reading_mind_score(df):
-    conditions = {
-        'RMIE_short-1': [2],
-        'RMIE_short-2': [2],
-        'RMIE_short-3': [3],
-        'RMIE_short-4': [1],
-        'RMIE_short-5': [1],
-        'RMIE_short-6': [1],
-        'RMIE_short-7': [1],
-        'RMIE_short-8': [2],
-        'RMIE_short-9': [1],
-        'RMIE_short-10': [4],
-    }
+# survey instruments scored into the individual measures: each declares its items, the items
+# reverse coded as abs(scale - answer), the answer key of items scored as correct or not, the
+# weights of weighted items and the rule for a complete response ('all' items answered, 'any'
+# item answered, or a list of items that must be answered)
+INSTRUMENTS = {
+    'PsychCollect_avg': {'items': [f'PSY_COL-{i}' for i in range(1, 16)],
+                         'score': 'mean',
+                         'complete': 'all'},
+    'SociableDom_avg': {'items': [f'SOC_DOM-{i}' for i in range(1, 16)],
+                        'score': 'mean',
+                        'complete': 'all'},
+    'ReadingMind_score': {'items': [f'RMIE_short-{i}' for i in range(1, 11)],
+                          'score': 'correct',
+                          'answer_key': {'RMIE_short-1': [2], 'RMIE_short-2': [2], 'RMIE_short-3': [3],
+                                         'RMIE_short-4': [1], 'RMIE_short-5': [1], 'RMIE_short-6': [1],
+                                         'RMIE_short-7': [1], 'RMIE_short-8': [2], 'RMIE_short-9': [1],
+                                         'RMIE_short-10': [4]},
+                          'complete': 'any'},
+    'SpatialAbility_avg': {'items': [f'SBSOD-{i}' for i in range(1, 16)],
+                           'score': 'mean',
+                           'reverse_coded': {f'SBSOD-{i}': 8 for i in [2, 6, 8, 10, 11, 12, 13, 15]},
+                           'complete': 'any'},
+    # weighted sum over the Excel formula's 15 points: the weighted items are summed first, then
+    # the answered unweighted items are added
+    'MCProf_avg': {'items': [f'MC_PROF_15-{i}' for i in range(1, 16)],
+                   'score': 'weighted_sum',
+                   'weights': {'MC_PROF_15-1': 5, 'MC_PROF_15-2': 5, 'MC_PROF_15-3': 5,
+                               'MC_PROF_15-4': 14.285, 'MC_PROF_15-5': 14.285, 'MC_PROF_15-6': 14.285,
+                               'MC_PROF_15-7': 14.285},
+                   'divisor': 15,
+                   'complete': [f'MC_PROF_15-{i}' for i in range(1, 8)]},
+}
+
+
+def instrument_answers(df, instrument):
+    """Answers to an instrument's items as a float matrix, one row per participant, reverse coded."""
+    items = instrument['items']
+    answers = np.ascontiguousarray(df[items].to_numpy(dtype='float64'))
+    for item, scale in instrument.get('reverse_coded', {}).items():
+        answers[:, items.index(item)] = np.abs(scale - answers[:, items.index(item)])
+    return answers
+
+
+def score_instrument(df, instrument):
+    """Score every participant on one instrument with whole-column operations. Incomplete
+    responses score NaN."""
+    items = instrument['items']
+    answers = instrument_answers(df, instrument)
+    answered = ~np.isnan(answers)
+    complete = instrument['complete']
+    if complete == 'all':
+        valid = answered.all(axis=1)
+    elif complete == 'any':
+        valid = answered.any(axis=1)
+    else:
+        valid = answered[:, [items.index(item) for item in complete]].all(axis=1) & answered.any(axis=1)
+
+    if instrument['score'] == 'mean':
+        with np.errstate(invalid='ignore', divide='ignore'):
+            scores = np.where(answered, answers, 0).sum(axis=1) / answered.sum(axis=1)
+    elif instrument['score'] == 'correct':
+        key = instrument['answer_key']
+        correct = np.column_stack([np.isin(answers[:, items.index(item)], key[item]) for item in key])
+        scores = correct.sum(axis=1)
+    elif instrument['score'] == 'weighted_sum':
+        weights = instrument['weights']
+        weighted = [items.index(item) for item in weights]
+        unweighted = [j for j in range(len(items)) if items[j] not in weights]
+        scores = np.ascontiguousarray(np.where(answered[:, weighted], answers[:, weighted], 0)
+                                      * np.array(list(weights.values()))).sum(axis=1)
+        scores = (scores + np.where(answered[:, unweighted], answers[:, unweighted], 0).sum(axis=1)) \
+                 / instrument.get('divisor', 1)
+    else:
+        raise ValueError(f"Unknown instrument score {instrument['score']}")
 
-    def score(row):
-        if row[conditions.keys()].isnull().all():
-            return np.nan  # Return NaN if all RMIE responses are missing
-        return sum(row[col] in valid_answers for col, valid_answers in conditions.items() if col in row)
+    scores = pd.Series(scores, index=df.index)
+    return scores if valid.all() else scores.where(valid)
 
-    df['ReadingMind_score'] = df.apply(score, axis=1)
 
+def score_instruments(df, names=None):
+    """Add the score column of each named instrument, all instruments of INSTRUMENTS by default."""
+    for name in names if names is not None else INSTRUMENTS:
+        df[name] = score_instrument(df, INSTRUMENTS[name])
     return df
 
 
-def calculate_spatial_ability_avg(df):
-    sbsod_cols = [f'SBSOD-{i}' for i in range(1, 16)]
-    reverse_coded_items = [2, 6, 8, 10, 11, 12, 13, 15]
+def calculate_averages(df):
+    return score_instruments(df, ['PsychCollect_avg', 'SociableDom_avg'])
 
-    def reverse_code(item, value):
-        if item in reverse_coded_items:
-            return abs(8 - value)
-        return value
 
-    def spatial_ability_score(row):
-        scores = []
-        for i, col in enumerate(sbsod_cols, 1):
-            if not np.isnan(row[col]):
-                scores.append(reverse_code(i, row[col]))
-        if scores:
-            return np.mean(scores)
-        return None  # Return None if there are no SBSOD responses
+def calculate_reading_mind_score(df):
+    return score_instruments(df, ['ReadingMind_score'])
 
-    df['SpatialAbility_avg'] = df.apply(spatial_ability_score, axis=1)
 
-    return df
+def calculate_spatial_ability_avg(df):
+    return score_instruments(df, ['SpatialAbility_avg'])
 
 
 def calculate_mc_prof_avg(df):
-    mc_prof_cols = [f'MC_PROF_15-{i}' for i in range(1, 16)]  # Include all columns through MC_PROF_15-15
-
-    def mc_prof_score(row):
-        if row[mc_prof_cols].isnull().all():
-            return np.nan  # Return NaN if all MC_PROF_15 responses are missing
-
-        # Initialize the score with NaN, which will be updated if there are valid responses
-        score = np.nan
-
-        # Check for non-null values and perform the calculation only if they exist
-        if not row[mc_prof_cols[:7]].isnull().any():
-            # Applying the transformation as per the Excel formula
-            transformed_scores = (
-                                         np.nansum([
-                                             row['MC_PROF_15-1'] * 5,
-                                             row['MC_PROF_15-2'] * 5,
-                                             row['MC_PROF_15-3'] * 5,
-                                             row['MC_PROF_15-4'] * 14.285,
-                                             row['MC_PROF_15-5'] * 14.285,
-                                             row['MC_PROF_15-6'] * 14.285,
-                                             row['MC_PROF_15-7'] * 14.285
-                                         ]) + np.nansum(row[mc_prof_cols[7:]])) / 15
-            score = transformed_scores
-
-        return score
-
-    df['MCProf_avg'] = df.apply(mc_prof_score, axis=1)
-
-    return df
+    return score_instruments(df, ['MCProf_avg'])
 
 
 def calculate_above_median(df, columns):
@@ -291,19 +293,16 @@ def calculate_potential_scores_and_categories(df):
                                      + df['MCProf_avg_above_median']
 
     # Categorize 'Teamwork_potential_category'
-    df['Teamwork_potential_category'] = df['Teamwork_potential_score'].apply(
-        lambda x: 'High Teamwork Pot' if x >= 2 else 'Low Teamwork Pot'
-    )
+    df['Teamwork_potential_category'] = np.where(df['Teamwork_potential_score'] >= 2,
+                                                 'High Teamwork Pot', 'Low Teamwork Pot')
 
     # Categorize 'Taskwork_potential_category_liberal'
-    df['Taskwork_potential_category_liberal'] = df['Taskwork_potential_score'].apply(
-        lambda x: 'High Taskwork Pot' if x >= 1 else 'Low Taskwork Pot'
-    )
+    df['Taskwork_potential_category_liberal'] = np.where(df['Taskwork_potential_score'] >= 1,
+                                                         'High Taskwork Pot', 'Low Taskwork Pot')
 
     # Categorize 'Taskwork_potential_category_conservative'
-    df['Taskwork_potential_category_conservative'] = df['Taskwork_potential_score'].apply(
-        lambda x: 'High Taskwork Pot' if x == 2 else 'Low Taskwork Pot'
-    )
+    df['Taskwork_potential_category_conservative'] = np.where(df['Taskwork_potential_score'] == 2,
+                                                             'High Taskwork Pot', 'Low Taskwork Pot')
 
     return df
 
@@ -311,8 +310,8 @@ def calculate_potential_scores_and_categories(df):
 def track_individual_missing_data(df, columns):
     for col in columns:
         missing_col_name = f'{col}_missing'
-        # Create a binary column indicating if the data is missing for the participant
-        df[missing_col_name] = df[col].isnull().astype(int).apply(lambda x: 'Missing' if x == 1 else 'Not Missing')
+        # Create a column indicating if the data is missing for the participant
+        df[missing_col_name] = np.where(df[col].isnull(), 'Missing', 'Not Missing')
     return df
 
 
@@ -321,30 +320,20 @@ def write_individual_measures_calculated_unique(individual_measures_unique_file_
     # Load the dataset and rename columns
     df = load_and_rename_columns(individual_measures_unique_file_path)
 
-    # Perform the existing calculations
-    df = calculate_averages(df)
-    df = calculate_reading_mind_score(df)
-    df = calculate_spatial_ability_avg(df)
-    df = calculate_mc_prof_avg(df)
+    # Score every survey instrument
+    df = score_instruments(df)
 
     # Calculate if scores are above or equal to the median for each measure
-    df = calculate_above_median(df, [
-        'PsychCollect_avg', 'SociableDom_avg', 'ReadingMind_score',
-        'SpatialAbility_avg', 'MCProf_avg'
-    ])
+    df = calculate_above_median(df, list(INSTRUMENTS))
 
     # Calculate potential scores and categories
     df = calculate_potential_scores_and_categories(df)
 
     # Track missing data for individual participants
-    columns_to_check_for_missing = [
-        'PsychCollect_avg', 'SociableDom_avg', 'ReadingMind_score',
-        'SpatialAbility_avg', 'MCProf_avg'
-    ]
-    df = track_individual_missing_data(df, columns_to_check_for_missing)
+    df = track_individual_missing_data(df, list(INSTRUMENTS))
 
     # Save the modified DataFrame to a new CSV file
-    df.to_csv(output_file_path, index=False)
+    workspace.to_csv(df, output_file_path)
 
 
 ##########################################################
@@ -353,26 +342,7 @@ def write_individual_measures_calculated_unique(individual_measures_unique_file_
 
 def write_individual_trial_measures_combined(processed_trial_summary_dir_path, output_file_path):
     print("Writing combined individual trial measures...")
-    # List files in the directory
-    files = os.listdir(processed_trial_summary_dir_path)
-
-    # Initialize an empty list to store DataFrames
-    dfs = []
-
-    # Iterate through each file in the directory
-    for file in tqdm(files):
-        if file.endswith('_IndivLevel.csv'):  # Check if file ends with '_IndivLevel.csv'
-            file_path = os.path.join(processed_trial_summary_dir_path, file)
-            # Read the CSV file
-            df = pd.read_csv(file_path)
-            # Append DataFrame to the list
-            dfs.append(df)
-
-    # Concatenate all DataFrames in the list
-    combined_data = pd.concat(dfs, ignore_index=True)
-
-    # Save the combined data to a new CSV file
-    combined_data.to_csv(output_file_path, index=False)
+    collate.collate_directory(processed_trial_summary_dir_path, '_IndivLevel.csv', output_file_path)
 
 #########################################################################
 # functions for writing individual player profile trial measures combined
@@ -391,10 +361,19 @@ def write_individual_player_profile_trial_measures_combined(individual_measures_
                                                             output_path):
     print("Writing combined individual player profile trial measures...")
     # Read the CSV files
-    individual_measures_df = pd.read_csv(individual_measures_calculated_unique_file_path)
-    trial_measures_df = pd.read_csv(individual_trial_measures_combined_file_path)
-    additional_data_df = pd.read_csv(individual_measures_combined_file_path)
+    individual_measures_df = workspace.read_csv(individual_measures_calculated_unique_file_path)
+    trial_measures_df = workspace.read_csv(individual_trial_measures_combined_file_path)
+    additional_data_df = workspace.read_csv(individual_measures_combined_file_path)
+
+    combined_df = individual_player_profile_trial_measures_frame(individual_measures_df, trial_measures_df,
+                                                                 additional_data_df)
 
+    # Save the combined data to a new CSV file
+    workspace.to_csv(combined_df, output_path)
+
+
+def individual_player_profile_trial_measures_frame(individual_measures_df, trial_measures_df, additional_data_df):
+    """Trial measures of each player with the player's calculated measures and survey items."""
     # Merge the data frames - Assuming this is correct and required
     common_columns = trial_measures_df.columns.intersection(individual_measures_df.columns).tolist()
     combined_df = pd.merge(trial_measures_df,
@@ -428,9 +407,7 @@ def write_individual_player_profile_trial_measures_combined(individual_measures_
     common_columns = combined_df.columns.intersection(additional_data_df_selected.columns).tolist()
     # NOTE: Added common_columns to merge, see explanation at previous merge above.
     combined_df = pd.merge(combined_df, additional_data_df_selected, on=['trial_id', 'PLAYER_ID'] + common_columns, how='left')
-
-    # Save the combined data to a new CSV file
-    combined_df.to_csv(output_path, index=False)
+    return combined_df
 
 
 #####################################
@@ -440,8 +417,15 @@ def write_individual_player_profile_trial_measures_combined(individual_measures_
 def post_hoc_calculate(individual_player_profiles_trial_measures_combined_file_path):
     print("Doing in-place post-hoc calculations on combined individual player profile trial measures...")
     # Load the dataset
-    df = pd.read_csv(individual_player_profiles_trial_measures_combined_file_path)
+    df = workspace.read_csv(individual_player_profiles_trial_measures_combined_file_path)
+    df = post_hoc_frame(df)
 
+    # Save the updated DataFrame back to the same CSV file
+    workspace.to_csv(df, individual_player_profiles_trial_measures_combined_file_path)
+
+
+def post_hoc_frame(df):
+    """Rename the survey item columns and average the PRSS items of each player row."""
     # Renaming columns
     rename_columns = {
         'SATIS-1': 'SATIS_score',
@@ -472,9 +456,7 @@ def post_hoc_calculate(individual_player_profiles_trial_measures_combined_file_p
     df['PRSS_action'] = df[['PRSS-4', 'PRSS-5', 'PRSS-6']].mean(axis=1)
     df['PRSS_interpersonal'] = df[['PRSS-7', 'PRSS-8', 'PRSS-9']].mean(axis=1)
     df['PRSS_avg'] = df[['PRSS-1', 'PRSS-2', 'PRSS-3', 'PRSS-4', 'PRSS-5', 'PRSS-6', 'PRSS-7', 'PRSS-8', 'PRSS-9']].mean(axis=1)
-
-    # Save the updated DataFrame back to the same CSV file
-    df.to_csv(individual_player_profiles_trial_measures_combined_file_path, index=False)
+    return df
 
 
 ##################################################################
@@ -482,7 +464,7 @@ def post_hoc_calculate(individual_player_profiles_trial_measures_combined_file_p
 ##################################################################
 
 def read_csv(file_path):
-    return pd.read_csv(file_path)
+    return workspace.read_csv(file_path)
 
 
 def preprocess_df(df):
@@ -543,44 +525,173 @@ def algebraic_alignment(attributes):
     return alignment_strength
 
 
-def calculate_alignment(df, attribute_columns, grouping_variable):
-    # Ensure no infinite values and fill NaNs, for example, with zeros or mean of the column
-    df_cleaned = df.replace([np.inf, -np.inf], np.nan).dropna(subset=attribute_columns)
-    # df_cleaned = df.replace([np.inf, -np.inf], np.nan).fillna(0) # Alternative: Replace NaNs with 0
-
-    # Initialize a DataFrame to store the results
-    results = []
-
-    # Iterate over unique groups (teams)
-    for trial_id in df_cleaned[grouping_variable].unique():
-        team_data = df_cleaned[df_cleaned[grouping_variable] == trial_id][attribute_columns].values
-
-        # Check for any remaining NaN or Inf values
-        if np.isnan(team_data).any() or np.isinf(team_data).any():
-            print(f"Skipping trial_id {trial_id} due to NaN or Inf values in team data.")
-            continue
+ALIGNMENT_MEASURES = ['geometric_alignment', 'physical_alignment', 'algebraic_alignment', 'centroid_physical_alignment']
 
-        # Calculate each type of alignment
-        geom_align = geometric_alignment(team_data)
-        phys_align = physical_alignment(team_data)
-        alg_align = algebraic_alignment(team_data)
-        cent_phys_align = centroid_physical_alignment(team_data)
 
-        # Store results
-        results.append({
-            'trial_id': trial_id,
-            'geometric_alignment': geom_align,
-            'physical_alignment': phys_align,
-            'algebraic_alignment': alg_align,
-            'centroid_physical_alignment': cent_phys_align
-        })
+def batch_alignments(teams):
+    """Geometric, physical, algebraic and centroid physical alignment of a stack of equally sized
+    teams, an array of shape (teams, players, attributes), as the per-team functions compute them."""
+    n_teams, n_players, _ = teams.shape
+    off_diagonal = ~np.eye(n_players, dtype=bool)
+    distances = np.sqrt(((teams[:, :, None, :] - teams[:, None, :, :]) ** 2).sum(axis=3))[:, off_diagonal]
 
-    # Convert results to a DataFrame
-    results_df = pd.DataFrame(results)
-    return results_df
+    if n_players > 1:
+        geometric = (distances ** 2).mean(axis=1)
+    else:
+        geometric = np.full(n_teams, np.nan)
+    with np.errstate(divide='ignore'):
+        physical = np.where(distances >= 1e-10, 1 / distances, 0).sum(axis=1)
+    algebraic = np.linalg.svd(teams, compute_uv=False).sum(axis=1)
+
+    centroid_distances = np.linalg.norm(teams - teams.mean(axis=1, keepdims=True), axis=2)
+    centroid_distances[centroid_distances == 0] = np.finfo(float).eps
+    distinct = (teams != teams[:, :1, :]).any(axis=(1, 2))
+    centroid_physical = np.where(distinct, (1 / centroid_distances).sum(axis=1), np.nan)
+    return {'geometric_alignment': geometric,
+            'physical_alignment': physical,
+            'algebraic_alignment': algebraic,
+            'centroid_physical_alignment': centroid_physical}
+
+
+def team_alignments(values, codes):
+    """Alignment measures of the teams labelled by codes, one per row of values, packing the teams
+    of each size into one array. Returns the team codes in order of first appearance and a dict of
+    measure name to values in that order."""
+    team_codes, first_rows, sizes = np.unique(codes, return_index=True, return_counts=True)
+    sorted_values = values[np.argsort(codes, kind='stable')]
+    starts = np.concatenate([[0], np.cumsum(sizes)[:-1]]).astype(np.int64)
+    results = {measure: np.full(len(team_codes), np.nan) for measure in ALIGNMENT_MEASURES}
+    for size in np.unique(sizes):
+        selected = np.flatnonzero(sizes == size)
+        teams = sorted_values[starts[selected][:, None] + np.arange(size)]
+        for measure, measure_values in batch_alignments(teams).items():
+            results[measure][selected] = measure_values
+    order = np.argsort(first_rows, kind='stable')
+    return team_codes[order], {measure: measure_values[order] for measure, measure_values in results.items()}
+
+
+def calculate_alignments(df, attribute_sets, grouping_variable):
+    """Alignment results of each attribute set, grouping the teams once. Each set keeps the rows
+    with finite values for all of its attributes."""
+    codes, groups = pd.factorize(df[grouping_variable])
+    results = []
+    for attribute_columns in attribute_sets:
+        values = df[attribute_columns].to_numpy(dtype='float64')
+        valid = np.isfinite(values).all(axis=1) & (codes >= 0)
+        team_codes, measures = team_alignments(values[valid], codes[valid])
+        results.append(pd.DataFrame({grouping_variable: groups.take(team_codes), **measures})
+                       .rename(columns={grouping_variable: 'trial_id'}))
+    return results
 
 
-def align_individual_player_profiles_trial_measures_combined(file_path, output_file_path, grouping_variable='trial_id'):
+def calculate_alignment(df, attribute_columns, grouping_variable):
+    return calculate_alignments(df, [attribute_columns], grouping_variable)[0]
+
+
+# profile percentages swept over by the attribute subset alignment sweep, with their short names
+PROFILE_PERCENT_COLUMNS = {'PsychCollect_avg_percent': 'PsychCollect',
+                           'SociableDom_avg_percent': 'SociableDom',
+                           'ReadingMind_score_percent': 'ReadingMind',
+                           'SpatialAbility_avg_percent': 'SpatialAbility',
+                           'MCProf_avg_percent': 'MCProf'}
+
+
+def attribute_subsets(attribute_columns):
+    """Every non-empty subset of the attribute columns, smallest first, as a 0/1 matrix of shape
+    (attributes, subsets)."""
+    subsets = [subset for size in range(1, len(attribute_columns) + 1)
+               for subset in itertools.combinations(range(len(attribute_columns)), size)]
+    masks = np.zeros((len(attribute_columns), len(subsets)))
+    for j, subset in enumerate(subsets):
+        masks[list(subset), j] = 1
+    return subsets, masks
+
+
+def batch_subset_alignments(teams, masks):
+    """Alignment measures of a stack of equally sized teams, an array of shape (teams, players,
+    attributes) that may hold NaN, for every attribute subset of masks. The per-attribute squared
+    pairwise differences are computed once and summed per subset; within a subset only the
+    players with all of its attributes count. Returns the players counted, of shape (teams,
+    players, subsets), and the measures, each of shape (teams, subsets)."""
+    n_teams, n_players, _ = teams.shape
+    finite = np.isfinite(teams)
+    values = np.where(finite, teams, 0)
+    subset_sizes = masks.sum(axis=0)
+
+    # players counted, and pairs of distinct counted players, per subset
+    counted = (finite @ masks) == subset_sizes
+    pairs = counted[:, :, None, :] & counted[:, None, :, :] & ~np.eye(n_players, dtype=bool)[None, :, :, None]
+    n_counted = counted.sum(axis=1)
+
+    differences = values[:, :, None, :] - values[:, None, :, :]
+    distances = np.sqrt((differences ** 2) @ masks)
+    differing = ((differences != 0) @ masks > 0) & pairs
+    n_pairs = pairs.sum(axis=(1, 2))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        geometric = np.where(pairs, distances ** 2, 0).sum(axis=(1, 2)) / n_pairs
+        physical = np.where(pairs & (distances >= 1e-10), 1 / distances, 0).sum(axis=(1, 2))
+    geometric[n_pairs == 0] = np.nan
+
+    algebraic = np.empty((n_teams, masks.shape[1]))
+    centroid_physical = np.empty((n_teams, masks.shape[1]))
+    for j in range(masks.shape[1]):
+        subset_values = values[:, :, masks[:, j] == 1] * counted[:, :, j, None]
+        algebraic[:, j] = np.linalg.svd(subset_values, compute_uv=False).sum(axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            centroid = subset_values.sum(axis=1, keepdims=True) / n_counted[:, None, j, None]
+        centroid_distances = np.linalg.norm(subset_values - centroid, axis=2)
+        centroid_distances[centroid_distances == 0] = np.finfo(float).eps
+        centroid_physical[:, j] = np.where(counted[:, :, j], 1 / centroid_distances, 0).sum(axis=1)
+    centroid_physical[~differing.any(axis=(1, 2))] = np.nan
+    return counted, {'geometric_alignment': geometric,
+                     'physical_alignment': physical,
+                     'algebraic_alignment': algebraic,
+                     'centroid_physical_alignment': centroid_physical}
+
+
+def sweep_alignment_subsets(df, grouping_variable='trial_id', attribute_columns=PROFILE_PERCENT_COLUMNS):
+    """Alignment measures of every team for all non-empty subsets of the attribute columns, as one
+    long table with a row per subset and team. Each subset counts the players with all of its
+    attributes, and matches calculate_alignment run on that subset."""
+    attribute_columns = list(attribute_columns)
+    subsets, masks = attribute_subsets(attribute_columns)
+    codes, groups = pd.factorize(df[grouping_variable])
+    values = df[attribute_columns].to_numpy(dtype='float64')
+    values[np.isinf(values)] = np.nan
+    values, codes = values[codes >= 0], codes[codes >= 0]
+
+    team_codes, sizes = np.unique(codes, return_counts=True)
+    rows = np.argsort(codes, kind='stable')
+    sorted_values = values[rows]
+    starts = np.concatenate([[0], np.cumsum(sizes)[:-1]]).astype(np.int64)
+    n_counted = np.zeros((len(team_codes), len(subsets)), dtype=np.int64)
+    first_rows = np.zeros((len(team_codes), len(subsets)), dtype=np.int64)
+    results = {measure: np.full((len(team_codes), len(subsets)), np.nan) for measure in ALIGNMENT_MEASURES}
+    for size in tqdm(np.unique(sizes)):
+        selected = np.flatnonzero(sizes == size)
+        positions = starts[selected][:, None] + np.arange(size)
+        counted, measures = batch_subset_alignments(sorted_values[positions], masks)
+        n_counted[selected] = counted.sum(axis=1)
+        first_rows[selected] = np.take_along_axis(rows[positions], counted.argmax(axis=1), axis=1)
+        for measure, measure_values in measures.items():
+            results[measure][selected] = measure_values
+
+    # a row per subset and team with counted players, teams in order of their first counted player
+    short_names = [PROFILE_PERCENT_COLUMNS.get(column, column) for column in attribute_columns]
+    frames = []
+    for j, subset in enumerate(subsets):
+        order = np.argsort(first_rows[:, j], kind='stable')
+        teams_with_players = order[n_counted[order, j] > 0]
+        frames.append(pd.DataFrame({
+            'trial_id': groups.take(team_codes[teams_with_players]),
+            'attribute_set': '+'.join(short_names[i] for i in subset),
+            'n_attributes': len(subset),
+            **{measure: results[measure][teams_with_players, j] for measure in ALIGNMENT_MEASURES}}))
+    return pd.concat(frames, ignore_index=True)
+
+
+def align_individual_player_profiles_trial_measures_combined(file_path, output_file_path, grouping_variable='trial_id',
+                                                              sweep_output_file_path=None):
     print("Writing combined team alignment results...")
     df = read_csv(file_path)
     df = preprocess_df(df)
@@ -596,10 +707,8 @@ def align_individual_player_profiles_trial_measures_combined(file_path, output_f
     # Initialize an empty DataFrame to store all results
     all_results_df = pd.DataFrame()
 
-    for attribute_columns, set_name in zip(tqdm(attribute_sets), attribute_set_names):
-        # Calculate alignment for each attribute set
-        results_df = calculate_alignment(df, attribute_columns, grouping_variable)
-
+    # Calculate alignment for each attribute set
+    for results_df, set_name in zip(calculate_alignments(df, attribute_sets, grouping_variable), attribute_set_names):
         # Rename the columns with the set name as a suffix
         results_df = results_df.rename(columns=lambda x: f"{x}_{set_name}" if x != 'trial_id' else x)
 
@@ -610,5 +719,10 @@ def align_individual_player_profiles_trial_measures_combined(file_path, output_f
             all_results_df = pd.merge(all_results_df, results_df, on='trial_id', how='outer')
 
     # Save to CSV
-    all_results_df.to_csv(output_file_path, index=False)
+    workspace.to_csv(all_results_df, output_file_path)
+
+    # Sweep mode: alignment for every non-empty subset of the profile percentages
+    if sweep_output_file_path:
+        print("Writing team alignment attribute subset sweep...")
+        workspace.to_csv(sweep_alignment_subsets(df, grouping_variable), sweep_output_file_path)
     # print("All results saved to Study_4_teams_alignment_results_combined.csv")
\ No newline at end of file
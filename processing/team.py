@@ -1,8 +1,11 @@
 ''' module for processing team data '''
 
 import os
+import ast
+import numpy as np
 import pandas as pd
-from tqdm import tqdm
+import scipy.sparse
+from processing import collate, workspace
 
 #############################################
 # functions for collating team trial measures
@@ -10,65 +13,64 @@ from tqdm import tqdm
 
 def collate_team_trial_measures(processed_trial_summary_dir_path, output_file_path):
     print("Collating team trial measures...")
-    # List files in the directory
-    files = os.listdir(processed_trial_summary_dir_path)
-
-    # Initialize an empty list to store DataFrames
-    dfs = []
-
-    # Iterate through each file in the directory
-    for file in tqdm(files):
-        if file.endswith('_TeamLevel.csv'):  # Check if file ends with '_TeamLevel.csv'
-            file_path = os.path.join(processed_trial_summary_dir_path, file)
-            # Read the CSV file
-            df = pd.read_csv(file_path)
-            # Append DataFrame to the list
-            dfs.append(df)
-
-    # Concatenate all DataFrames in the list
-    combined_data = pd.concat(dfs, ignore_index=True)
-
-    # Save the combined data to a new CSV file
-    combined_data.to_csv(output_file_path, index=False)
-
-    # print("Combined trial level summary data saved to:", output_file_path)
+    collate.collate_directory(processed_trial_summary_dir_path, '_TeamLevel.csv', output_file_path)
 
 
 #####################################################
 # functions for calculating trial level team profiles
 #####################################################
 
+# player columns averaged into team columns, source to target
+TEAM_AVERAGE_COLUMNS = {
+    'PsychCollect_avg': 'Team_PsychCollect_avg',
+    'SociableDom_avg': 'Team_SociableDom_avg',
+    'ReadingMind_score': 'Team_ReadingMind_score',
+    'SpatialAbility_avg': 'Team_SpatialAbility_avg',
+    'MCProf_avg': 'Team_MCProf_avg',
+    # Add any other variables you need to map here
+}
+
+TEAM_PRSS_AVERAGE_COLUMNS = {
+    'PRSS_avg': 'PRSS_TeamAvg',
+    'PRSS_transition': 'PRSS_transition_TeamAvg',
+    'PRSS_action': 'PRSS_action_TeamAvg',
+    'PRSS_interpersonal': 'PRSS_interpersonal_TeamAvg'
+}
+
+TEAM_ADDITIONAL_AVERAGE_COLUMNS = [
+    'SATIS_score', 'SATIS_workedTogether', 'SATIS_teamPlan', 'SATIS_teamAgain',
+    'SATIS_teamCapable', 'EFF_workEthic', 'EFF_overcomeProblems', 'EFF_planStrategy',
+    'EFF_maintainPositivity', 'EFF_disposeBombs', 'EFF_speedRun', 'EFF_knowledgeCoord',
+    'EFF_roleCoord', 'advisorEVAL_improvedScore', 'AdvisorEVAL_improvedCoord',
+    'advisorEVAL_comfortDependingOn', 'advisorEVAL_understoodRecommends', 'advisorEVAL_wasTrustworthy'
+]
+
+# named aggregation of the player rows of a trial into its team profile columns, in output order:
+# target column -> (source column, aggregation); Number_of_Trials_Range follows Number_of_Trials_Min
+TEAM_PROFILE_AGGREGATIONS = {
+    **{target: (source, 'mean') for source, target in TEAM_AVERAGE_COLUMNS.items()},
+    'Team_Number_of_Trials_Sum': ('Number_of_Trials', 'sum'),
+    'Number_of_Trials_Max': ('Number_of_Trials', 'max'),
+    'Number_of_Trials_Min': ('Number_of_Trials', 'min'),
+    'Team_Members': ('participant_ID', list),
+    **{target: (source, 'mean') for source, target in TEAM_PRSS_AVERAGE_COLUMNS.items()},
+    **{f'{column}_TeamAvg': (column, 'mean') for column in TEAM_ADDITIONAL_AVERAGE_COLUMNS},
+}
+
+# team potential categories and the columns holding their most common value across the trial's rows
+TEAM_COMMON_CATEGORY_COLUMNS = {
+    'Team_teamwork_potential_category': 'Team_teamwork_potential_category_fromAggregate',
+    'Team_taskwork_potential_category_liberal': 'Team_taskwork_potential_category_fromLiberalAggregate',
+    'Team_taskwork_potential_category_conservative': 'Team_taskwork_potential_category_fromConservativeAggregate'
+}
+
+
 def load_data(file_path):
     # Load the dataset
-    df = pd.read_csv(file_path)
+    df = workspace.read_csv(file_path)
     return df
 
 
-def calculate_team_averages_and_members(df, group_by_col, source_target_map):
-    # Group by 'trial_ID' and calculate the mean for the specified columns
-    team_averages = df.groupby(group_by_col).agg({source: 'mean' for source in source_target_map.keys()}).reset_index()
-
-    # Calculate the sum, max, min, and range of 'Number_of_Trials' for each group
-    team_trials_stats = df.groupby(group_by_col)['Number_of_Trials'].agg(['sum', 'max', 'min']).reset_index()
-    team_trials_stats['Number_of_Trials_Range'] = team_trials_stats['max'] - team_trials_stats['min']
-    team_trials_stats.rename(columns={'sum': 'Team_Number_of_Trials_Sum', 'max': 'Number_of_Trials_Max', 'min': 'Number_of_Trials_Min'}, inplace=True)
-
-    # Merge the team averages with the team trials stats
-    team_averages = pd.merge(team_averages, team_trials_stats, on=group_by_col)
-
-    # Rename columns to the target variable names
-    team_averages.rename(columns=source_target_map, inplace=True)
-
-    # Additionally, create a list of participant_IDs for each trial_id
-    team_members = df.groupby(group_by_col)['participant_ID'].apply(list).reset_index()
-    team_members.rename(columns={'participant_ID': 'Team_Members'}, inplace=True)
-
-    # Merge the team averages with the team members based on 'trial_id'
-    team_profiles = pd.merge(team_averages, team_members, on=group_by_col)
-
-    return team_profiles
-
-
 def calculate_team_above_median(team_profiles, variables):
     # Calculate the median for each variable
     medians = team_profiles[variables].median()
@@ -82,102 +84,48 @@ def calculate_team_above_median(team_profiles, variables):
 
 
 def calculate_team_potential_categories(team_profiles):
-    # Calculate team potential categories based on the sum of certain above_median columns
-    teamwork_vars = [
-        'Team_PsychCollect_avg_above_median',
-        'Team_SociableDom_avg_above_median',
-        'Team_ReadingMind_score_above_median'
-    ]
-    taskwork_vars_liberal = [
-        'Team_SpatialAbility_avg_above_median',
-        'Team_MCProf_avg_above_median'
-    ]
-
-    taskwork_vars_conservative = taskwork_vars_liberal  # Same variables, different condition
-
-    # Teamwork potential category
-    team_profiles['Team_teamwork_potential_score'] = team_profiles[teamwork_vars].sum(axis=1)
-    team_profiles['Team_teamwork_potential_category'] = team_profiles['Team_teamwork_potential_score'].apply(
-        lambda x: 'High Teamwork Pot' if x >= 2 else 'Low Teamwork Pot'
-    )
-
-    # Taskwork potential category - liberal
-    team_profiles['Team_taskwork_potential_score_liberal'] = team_profiles[taskwork_vars_liberal].sum(axis=1)
-    team_profiles['Team_taskwork_potential_category_liberal'] = team_profiles[
-        'Team_taskwork_potential_score_liberal'].apply(
-        lambda x: 'High Taskwork Pot' if x >= 1 else 'Low Taskwork Pot'
-    )
-
-    # Taskwork potential category - conservative
-    team_profiles['Team_taskwork_potential_score_conservative'] = team_profiles[taskwork_vars_conservative].sum(axis=1)
-    team_profiles['Team_taskwork_potential_category_conservative'] = team_profiles[
-        'Team_taskwork_potential_score_conservative'].apply(
-        lambda x: 'High Taskwork Pot' if x == 2 else 'Low Taskwork Pot'
-    )
+    """Team potential scores, the sums of the above_median columns, and their categories."""
+    teamwork_vars = ['Team_PsychCollect_avg_above_median', 'Team_SociableDom_avg_above_median',
+                     'Team_ReadingMind_score_above_median']
+    taskwork_vars = ['Team_SpatialAbility_avg_above_median', 'Team_MCProf_avg_above_median']
 
+    team_profiles['Team_teamwork_potential_score'] = team_profiles[teamwork_vars].sum(axis=1)
+    team_profiles['Team_teamwork_potential_category'] = np.where(team_profiles['Team_teamwork_potential_score'] >= 2,
+                                                                 'High Teamwork Pot', 'Low Teamwork Pot')
+    team_profiles['Team_taskwork_potential_score_liberal'] = team_profiles[taskwork_vars].sum(axis=1)
+    team_profiles['Team_taskwork_potential_category_liberal'] = np.where(
+        team_profiles['Team_taskwork_potential_score_liberal'] >= 1, 'High Taskwork Pot', 'Low Taskwork Pot')
+    team_profiles['Team_taskwork_potential_score_conservative'] = team_profiles[taskwork_vars].sum(axis=1)
+    team_profiles['Team_taskwork_potential_category_conservative'] = np.where(
+        team_profiles['Team_taskwork_potential_score_conservative'] == 2, 'High Taskwork Pot', 'Low Taskwork Pot')
     return team_profiles
 
 
-def calculate_common_categories(df, group_by_col):
-    # Function to calculate the most common category for teamwork and taskwork potentials
-    def most_common(x):
-        # Using pandas mode function which can handle non-numeric data
-        modes = x.mode()
-        if not modes.empty:
-            return modes[0]  # Return the first mode in case of multiple modes
-        else:
-            return None
-
-    common_categories = df.groupby(group_by_col)[
-        ['Team_teamwork_potential_category', 'Team_taskwork_potential_category_liberal', 'Team_taskwork_potential_category_conservative']
-    ].agg(most_common).reset_index()
-
-    common_categories.rename(columns={
-        'Team_teamwork_potential_category': 'Team_teamwork_potential_category_fromAggregate',
-        'Team_taskwork_potential_category_liberal': 'Team_taskwork_potential_category_fromLiberalAggregate',
-        'Team_taskwork_potential_category_conservative': 'Team_taskwork_potential_category_fromConservativeAggregate'
-    }, inplace=True)
-
-    return common_categories
-
-
-def calculate_prss_team_averages(df):
-    # Group by 'trial_id' and calculate the mean for PRSS-related columns
-    prss_averages = df.groupby('trial_id').agg({
-        'PRSS_avg': 'mean',
-        'PRSS_transition': 'mean',
-        'PRSS_action': 'mean',
-        'PRSS_interpersonal': 'mean'
-    }).reset_index()
-
-    # Rename the columns to the specified target variable names
-    prss_averages.rename(columns={
-        'PRSS_avg': 'PRSS_TeamAvg',
-        'PRSS_transition': 'PRSS_transition_TeamAvg',
-        'PRSS_action': 'PRSS_action_TeamAvg',
-        'PRSS_interpersonal': 'PRSS_interpersonal_TeamAvg'
-    }, inplace=True)
-
-    return prss_averages
+def team_profile_aggregates_frame(df):
+    """Aggregated columns of the team profile of each trial: one grouped named aggregation of the
+    player rows following TEAM_PROFILE_AGGREGATIONS."""
+    team_profiles = df.groupby('trial_id').agg(**TEAM_PROFILE_AGGREGATIONS).reset_index()
+    team_profiles.insert(team_profiles.columns.get_loc('Number_of_Trials_Min') + 1, 'Number_of_Trials_Range',
+                         team_profiles['Number_of_Trials_Max'] - team_profiles['Number_of_Trials_Min'])
+    return team_profiles
 
 
-def calculate_additional_team_averages(df):
-    # Define the columns for which we need to calculate averages
-    additional_columns = [
-        'SATIS_score', 'SATIS_workedTogether', 'SATIS_teamPlan', 'SATIS_teamAgain',
-        'SATIS_teamCapable', 'EFF_workEthic', 'EFF_overcomeProblems', 'EFF_planStrategy',
-        'EFF_maintainPositivity', 'EFF_disposeBombs', 'EFF_speedRun', 'EFF_knowledgeCoord',
-        'EFF_roleCoord', 'advisorEVAL_improvedScore', 'AdvisorEVAL_improvedCoord',
-        'advisorEVAL_comfortDependingOn', 'advisorEVAL_understoodRecommends', 'advisorEVAL_wasTrustworthy'
-    ]
+def calculate_team_categories(team_profiles):
+    """Team potential categories of the above_median columns and their most common values."""
+    team_profiles = calculate_team_potential_categories(team_profiles)
 
-    # Group by 'trial_id' and calculate the mean for each specified column
-    additional_averages = df.groupby('trial_id').agg({col: 'mean' for col in additional_columns}).reset_index()
+    # one row per trial, so the most common category of a trial is its own category
+    for column, common_column in TEAM_COMMON_CATEGORY_COLUMNS.items():
+        team_profiles[common_column] = team_profiles[column]
+    return team_profiles
 
-    # Rename the columns to include '_TeamAvg' suffix for clarity
-    additional_averages.rename(columns={col: f'{col}_TeamAvg' for col in additional_columns}, inplace=True)
 
-    return additional_averages
+def trial_level_team_profiles_frame(df):
+    """Team profile of each trial: its aggregated columns, then the above_median columns and the
+    potential categories."""
+    team_profiles = team_profile_aggregates_frame(df)
+    team_profiles = calculate_team_above_median(team_profiles, list(TEAM_AVERAGE_COLUMNS.values()))
+    return calculate_team_categories(team_profiles)
 
 
 def calculate_trial_level_team_profiles(individual_player_profiles_trial_measures_combined_file_path,
@@ -186,45 +134,10 @@ def calculate_trial_level_team_profiles(individual_player_profiles_trial_measure
     # Load the dataset
     df = load_data(individual_player_profiles_trial_measures_combined_file_path)
 
-    # Define the mapping from source variables to target variables after averaging across team members
-    source_target_map = {
-        'PsychCollect_avg': 'Team_PsychCollect_avg',
-        'SociableDom_avg': 'Team_SociableDom_avg',
-        'ReadingMind_score': 'Team_ReadingMind_score',
-        'SpatialAbility_avg': 'Team_SpatialAbility_avg',
-        'MCProf_avg': 'Team_MCProf_avg',
-        # Add any other variables you need to map here
-    }
-
-    # Calculate team averages and members
-    team_profiles = calculate_team_averages_and_members(df, 'trial_id', source_target_map)
-
-    # Calculate PRSS-related team averages
-    prss_averages = calculate_prss_team_averages(df)
-    team_profiles = pd.merge(team_profiles, prss_averages, on='trial_id', how='left')
-
-    # Calculate additional team averages
-    additional_averages = calculate_additional_team_averages(df)
-    # Debugging print statement to check columns before merging
-    # print("Columns in additional_averages before merging:", additional_averages.columns.tolist())
-    team_profiles = pd.merge(team_profiles, additional_averages, on='trial_id', how='left')
-    # Debugging print statement to check columns after merging
-    # print("Columns in team_profiles after merging with additional_averages:", team_profiles.columns.tolist())
-
-    # Calculate if team averages are above or equal to the median for each measure
-    team_variables = list(source_target_map.values())
-    team_profiles = calculate_team_above_median(team_profiles, team_variables)
-
-    # Calculate team potential categories
-    team_profiles = calculate_team_potential_categories(team_profiles)
-
-    # Calculate common categories based on individual classifications
-    # Pass 'team_profiles' instead of 'df' here
-    common_categories = calculate_common_categories(team_profiles, 'trial_id')
-    team_profiles = pd.merge(team_profiles, common_categories, on='trial_id', how='left')
+    team_profiles = trial_level_team_profiles_frame(df)
 
     # Save the new DataFrame to a CSV file
-    team_profiles.to_csv(output_file_path, index=False)
+    workspace.to_csv(team_profiles, output_file_path)
     # print(f'Team profiles saved to {output_file_path}')
 
 
@@ -238,9 +151,9 @@ def write_team_player_profiles_trial_measures_combined(trial_measures_team_combi
                                                        output_file_path):
     print("Writing combined team player profiles trial measures...")
     # Read in the files
-    trial_measures = pd.read_csv(trial_measures_team_combined_file_path)
-    trial_level_profiles = pd.read_csv(trial_level_team_profiles_file_path)
-    teams_alignment_results = pd.read_csv(teams_alignment_results_combined_file_path)  # Reading the new CSV
+    trial_measures = workspace.read_csv(trial_measures_team_combined_file_path)
+    trial_level_profiles = workspace.read_csv(trial_level_team_profiles_file_path)
+    teams_alignment_results = workspace.read_csv(teams_alignment_results_combined_file_path)  # Reading the new CSV
 
     # Combine the trial measures and trial level profiles on 'trial_id'
     combined_data = pd.merge(trial_measures, trial_level_profiles, on='trial_id', how='outer')
@@ -252,54 +165,203 @@ def write_team_player_profiles_trial_measures_combined(trial_measures_team_combi
     final_combined_data['duplicate_count'] = final_combined_data.groupby('trial_id')['trial_id'].transform('count')
 
     # Save the final combined dataset to a new CSV file
-    final_combined_data.to_csv(output_file_path, index=False)
+    workspace.to_csv(final_combined_data, output_file_path)
 
     # print('Team profiles, trial summary data, and team alignment results have been successfully combined and saved to', output_file_path)
 
 
+##########################################
+# functions for the team composition index
+##########################################
+
+# arrays of a team index, as built by build_team_index
+TEAM_INDEX_ARRAYS = ['player_ids', 'team_indptr', 'team_players', 'trial_ids', 'trial_teams', 'team_trial_indptr',
+                     'team_trials', 'coplay_indptr', 'coplay_indices', 'coplay_data', 'shared_indptr',
+                     'shared_indices', 'shared_data']
+
+
+def parse_team_members(values):
+    """Team_Members as lists, parsing each distinct string form (as read from disk) once."""
+    parsed = {}
+
+    def parse(value):
+        if not isinstance(value, str):
+            return value
+        if value not in parsed:
+            parsed[value] = ast.literal_eval(value)
+        return parsed[value]
+
+    return values.map(parse)
+
+
+def team_key(members):
+    """Canonical key of a team: its sorted participant ids, None for a missing member list."""
+    if not isinstance(members, (list, tuple)):
+        return None
+    return tuple(sorted(str(member) for member in members))
+
+
+def team_keys(team_members):
+    """Canonical keys of the given member lists."""
+    return [team_key(members) for members in team_members]
+
+
+def build_team_index(trial_ids, keys):
+    """Index of the team compositions of the given trials, in order, by their canonical team keys
+    (see team_keys); the first row of a repeated trial is kept. Arrays:
+    'player_ids' (sorted); 'team_indptr'/'team_players', the player codes of each canonical team;
+    'trial_ids' and 'trial_teams', the team id of each trial; 'team_trial_indptr'/'team_trials', the
+    trials of each team in order; the co-play matrix of trials played together by each pair of
+    players and the shared matrix of the members two teams share, when at least 2, as CSR arrays
+    'coplay_*' and 'shared_*'. Lookups as added by team_index_lookups."""
+    trials = pd.DataFrame({'trial_id': list(trial_ids), 'key': list(keys)})
+    trials = trials[trials['key'].notna()].drop_duplicates('trial_id').reset_index(drop=True)
+    trial_teams, keys = pd.factorize(trials['key'])
+    player_ids = np.unique(np.array([player for key in keys for player in key], dtype=str))
+
+    sizes = np.array([len(key) for key in keys], dtype=np.int64)
+    team_indptr = np.concatenate([[0], np.cumsum(sizes)])
+    team_players = np.searchsorted(player_ids, np.array([player for key in keys for player in key], dtype=str))
+    teams_by_player = scipy.sparse.csr_matrix((np.ones(len(team_players)), team_players, team_indptr),
+                                              shape=(len(keys), len(player_ids)))
+    teams_by_player.sum_duplicates()
+    teams_by_player.data[:] = 1
+
+    team_trials = np.argsort(trial_teams, kind='stable')
+    team_trial_indptr = np.concatenate([[0], np.cumsum(np.bincount(trial_teams, minlength=len(keys)))])
+
+    # players x players: trials played together, trials x players incidence times its transpose
+    trials_by_player = teams_by_player[trial_teams]
+    coplay = (trials_by_player.T @ trials_by_player).tocsr()
+    coplay.setdiag(0)
+    coplay.eliminate_zeros()
+    # teams x teams: members shared, kept when at least 2
+    shared = (teams_by_player @ teams_by_player.T).tocsr()
+    shared.setdiag(0)
+    shared.data[shared.data < 2] = 0
+    shared.eliminate_zeros()
+    coplay.sort_indices()
+    shared.sort_indices()
+
+    return {'player_ids': player_ids,
+            'team_indptr': team_indptr,
+            'team_players': team_players,
+            'trial_ids': trials['trial_id'].to_numpy(dtype=str),
+            'trial_teams': trial_teams.astype(np.int64),
+            'team_trial_indptr': team_trial_indptr,
+            'team_trials': team_trials.astype(np.int64),
+            'coplay_indptr': coplay.indptr, 'coplay_indices': coplay.indices,
+            'coplay_data': coplay.data.astype(np.int64),
+            'shared_indptr': shared.indptr, 'shared_indices': shared.indices,
+            'shared_data': shared.data.astype(np.int64),
+            'team_ids': {key: team for team, key in enumerate(keys)},
+            'player_codes': {player: code for code, player in enumerate(player_ids.tolist())}}
+
+
+def write_team_index(index, team_index_file_path):
+    """Write the arrays of a team index to an npz file."""
+    np.savez(team_index_file_path, **{name: index[name] for name in TEAM_INDEX_ARRAYS})
+
+
+def load_team_index(team_index_file_path):
+    """Read a team index written by write_team_index, adding the lookups: 'team_ids', canonical
+    team key to team id, and 'player_codes', player id to its row of the co-play matrix."""
+    with np.load(team_index_file_path) as index_file:
+        return team_index_lookups({name: index_file[name] for name in TEAM_INDEX_ARRAYS})
+
+
+def team_index_lookups(index):
+    """Add the lookups of a team index from its arrays."""
+    player_ids, indptr, players = index['player_ids'], index['team_indptr'], index['team_players']
+    index['team_ids'] = {tuple(player_ids[players[indptr[team]:indptr[team + 1]]].tolist()): team
+                         for team in range(len(indptr) - 1)}
+    index['player_codes'] = {player: code for code, player in enumerate(player_ids.tolist())}
+    return index
+
+
+def team_members_of(index, team):
+    """Sorted participant ids of a team id."""
+    return tuple(index['player_ids'][index['team_players'][index['team_indptr'][team]:index['team_indptr'][team + 1]]].tolist())
+
+
+def trials_of_team(index, members):
+    """Trial ids of the exact team of the given members, in order; empty if it never played."""
+    team = index['team_ids'].get(team_key(members))
+    if team is None:
+        return []
+    start, end = index['team_trial_indptr'][team], index['team_trial_indptr'][team + 1]
+    return index['trial_ids'][index['team_trials'][start:end]].tolist()
+
+
+def teams_sharing_members(index, members, min_shared=2):
+    """Teams sharing at least min_shared (2 or more) members with the team of the given members, as
+    a list of (members, shared) pairs."""
+    team = index['team_ids'].get(team_key(members))
+    if team is None:
+        return []
+    start, end = index['shared_indptr'][team], index['shared_indptr'][team + 1]
+    return [(team_members_of(index, other), int(shared))
+            for other, shared in zip(index['shared_indices'][start:end], index['shared_data'][start:end])
+            if shared >= min_shared]
+
+
+def coplay_degree(index, player_id):
+    """Number of distinct players a player played with."""
+    code = index['player_codes'].get(str(player_id))
+    return 0 if code is None else int(index['coplay_indptr'][code + 1] - index['coplay_indptr'][code])
+
+
+def coplayers(index, player_id):
+    """Players a player played with, with the number of trials played together."""
+    code = index['player_codes'].get(str(player_id))
+    if code is None:
+        return {}
+    start, end = index['coplay_indptr'][code], index['coplay_indptr'][code + 1]
+    return dict(zip(index['player_ids'][index['coplay_indices'][start:end]].tolist(),
+                    index['coplay_data'][start:end].tolist()))
+
+
 ####################################
 # functions to identify repeat teams
 ####################################
 
-def identify_repeat_teams(team_player_profiles_trial_measures_combined_file_path):
+def team_combination_counts(index, keys):
+    """Running count of each team's appearances over the given canonical team keys, in order, by
+    the team ids of the index; NA for a missing member list."""
+    teams = pd.Series([index['team_ids'].get(key, -1) for key in keys])
+    counts = teams.groupby(teams).cumcount() + 1
+    return counts.where(teams >= 0).astype('Int64').to_numpy()
+
+
+def identify_repeat_teams(team_player_profiles_trial_measures_combined_file_path, team_index_file_path=None):
+    """Count the repeats of each team combination in chronological order, from the team index of
+    the trials, written to team_index_file_path if given."""
     print("Identifying repeat teams in combined team player profiles trial measures...")
     # Step 1: Read the CSV File
     # file_path = 'C:\\Post-doc Work\\ASIST Study 4\\Study_4_team_playerProfiles_trialMeasures_Combined.csv'
-    df = pd.read_csv(team_player_profiles_trial_measures_combined_file_path)
-
-    # Ensure 'Team_Members' is processed correctly (assuming it's a string representation of a list)
-    import ast
-    df['Team_Members'] = df['Team_Members'].apply(ast.literal_eval)
+    df = workspace.read_csv(team_player_profiles_trial_measures_combined_file_path)
 
-    # Step 2: Process Team Members - sort IDs within each list to ensure consistency
-    df['Sorted_Team_Members'] = df['Team_Members'].apply(lambda x: sorted(x))
+    # Ensure 'Team_Members' is processed correctly (a string representation of a list when read from disk)
+    df['Team_Members'] = parse_team_members(df['Team_Members'])
 
-    # Step 3: Order Chronologically
+    # Step 2: Order Chronologically
     df = df.sort_values(by='StartTimestamp')
 
-    # Step 4: Count Team Combinations
-    # Initialize a dictionary to keep track of team combination counts
-    team_counts = {}
-    # List to store the count for each row
-    counts = []
-
-    for team in df['Sorted_Team_Members']:
-        # Convert team list to a tuple so it can be used as a dictionary key
-        team_tuple = tuple(team)
-        # If the team combination has been seen, increment the count, otherwise start at 1
-        if team_tuple in team_counts:
-            team_counts[team_tuple] += 1
-        else:
-            team_counts[team_tuple] = 1
-        # Append the current count for this team combination to the counts list
-        counts.append(team_counts[team_tuple])
+    # Step 3: Process Team Members - sort IDs within each list once, missing lists staying missing
+    keys = team_keys(df['Team_Members'])
+    df['Sorted_Team_Members'] = [list(key) if key is not None else None for key in keys]
+
+    # Step 4: Index the team compositions and count each team's trials
+    index = build_team_index(df['trial_id'], keys)
+    if team_index_file_path:
+        write_team_index(index, team_index_file_path)
 
     # Step 5: Add New Column with Counts
-    df['Team_Combination_Count'] = counts
+    df['Team_Combination_Count'] = team_combination_counts(index, keys)
 
     # Step 6: Save the Modified DataFrame
     # output_file_path = 'C:\\Post-doc Work\\ASIST Study 4\\Study_4_team_playerProfiles_trialMeasures_Combined.csv'
-    df.to_csv(team_player_profiles_trial_measures_combined_file_path, index=False)
+    workspace.to_csv(df, team_player_profiles_trial_measures_combined_file_path)
 
     # print(f"Modified file saved to {output_file_path}")
 
@@ -385,9 +447,20 @@ def integrate_individual_player_profiles_trial_measures_combined(trial_measures_
     # individual_profiles_path = 'C:\\Post-doc Work\\ASIST Study 4\\Study_4_individual_playerProfiles_trialMeasures_Combined.csv'
 
     # Load the CSV files into pandas DataFrames
-    team_combined_df = pd.read_csv(trial_measures_team_combined_file_path)
-    individual_profiles_df = pd.read_csv(individual_player_profiles_trial_measures_combined_file_path)
+    team_combined_df = workspace.read_csv(trial_measures_team_combined_file_path)
+    individual_profiles_df = workspace.read_csv(individual_player_profiles_trial_measures_combined_file_path)
 
+    merged_df = integrated_player_profiles_frame(team_combined_df, individual_profiles_df)
+
+    # Save the merged DataFrame to a new CSV file
+    # output_path = 'C:\\Post-doc Work\\ASIST Study 4\\Study_4_individual_playerProfiles_trialMeasures_Combined.csv'
+    workspace.to_csv(merged_df, individual_player_profiles_trial_measures_combined_file_path)
+
+    # print(f'Merged data saved to {output_path}')
+
+
+def integrated_player_profiles_frame(team_combined_df, individual_profiles_df):
+    """Player profile rows with the mission and trial end conditions of their trial."""
     # Selecting the relevant columns from the team_combined DataFrame
     team_combined_df = team_combined_df[['trial_id', 'MissionEndCondition', 'TrialEndCondition']]
 
@@ -396,9 +469,4 @@ def integrate_individual_player_profiles_trial_measures_combined(trial_measures_
     # will be kept, and matching rows from team_combined_df will be merged based on 'trial_id'.
     # This will automatically replicate the trial information for each PLAYER_ID associated with a given trial_id.
     merged_df = pd.merge(individual_profiles_df, team_combined_df, on='trial_id', how='left')
-
-    # Save the merged DataFrame to a new CSV file
-    # output_path = 'C:\\Post-doc Work\\ASIST Study 4\\Study_4_individual_playerProfiles_trialMeasures_Combined.csv'
-    merged_df.to_csv(individual_player_profiles_trial_measures_combined_file_path, index=False)
-
-    # print(f'Merged data saved to {output_path}')
+    return merged_df
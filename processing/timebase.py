@@ -0,0 +1,115 @@
+''' functions for putting message timestamps on a common time base '''
+
+import numpy as np
+import pandas as pd
+from datetime import datetime, timedelta, timezone
+
+# format of the testbed message timestamps, tried before the general ISO 8601 parser
+TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%S.%fZ'
+# format of the timestamps written to the cleaned time series
+OUTPUT_TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S.%f+00:00'
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def message_timestamp(json_obj):
+    """Timestamp of a message: '@timestamp' at the root, falling back to 'timestamp' within 'msg'."""
+    if '@timestamp' in json_obj:
+        return json_obj['@timestamp']
+    return json_obj.get('msg', {}).get('timestamp', '')
+
+
+def parse_timestamp_us(timestamp):
+    """Parse one ISO 8601 timestamp into int64 epoch microseconds, None if it is blank or invalid.
+    The fixed testbed format is tried first, like parse_timestamps_us. Naive timestamps are taken as UTC."""
+    if not timestamp or not isinstance(timestamp, str):
+        return None
+    try:
+        parsed = datetime.strptime(timestamp, TIMESTAMP_FORMAT)
+    except ValueError:
+        # fromisoformat only accepts a trailing 'Z' from Python 3.11 on
+        if timestamp.endswith('Z'):
+            timestamp = timestamp[:-1] + '+00:00'
+        try:
+            parsed = datetime.fromisoformat(timestamp)
+        except ValueError:
+            return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return (parsed - EPOCH) // timedelta(microseconds=1)
+
+
+def parse_timestamps_us(timestamps):
+    """Vectorized parse of a column of timestamps into nullable Int64 epoch microseconds.
+    The fixed testbed format is tried first; only values it rejects go through the ISO 8601 parser."""
+    timestamps = pd.Series(timestamps, dtype=object)
+    parsed = pd.to_datetime(timestamps, format=TIMESTAMP_FORMAT, errors='coerce', utc=True).dt.as_unit('us')
+    retry = parsed.isna() & timestamps.notna() & (timestamps != '')
+    if retry.any():
+        parsed[retry] = pd.to_datetime(timestamps[retry].astype(str), format='ISO8601', errors='coerce',
+                                       utc=True).dt.as_unit('us')
+    micros = (parsed - pd.Timestamp(EPOCH)) // pd.Timedelta(microseconds=1)
+    return micros.astype('Int64')
+
+
+def format_timestamp_us(timestamp_us):
+    """Format epoch microseconds the way the cleaned time series stores timestamps."""
+    return (EPOCH + timedelta(microseconds=int(timestamp_us))).strftime(OUTPUT_TIMESTAMP_FORMAT)
+
+
+def format_timestamps_us(timestamps_us):
+    """Vectorized format_timestamp_us, missing values stay missing."""
+    timestamps_us = pd.Series(timestamps_us).astype('Int64')
+    formatted = pd.to_datetime(timestamps_us.astype('float64'), unit='us', utc=True).dt.strftime(OUTPUT_TIMESTAMP_FORMAT)
+    return formatted.where(timestamps_us.notna(), np.nan)
+
+
+def elapsed_ms(timestamps_us, origin_us, origin_elapsed_ms=0):
+    """Milliseconds since an origin timestamp, shifted by the elapsed time recorded at the origin."""
+    return (timestamps_us - origin_us) / 1000 + origin_elapsed_ms
+
+
+def mission_start(df, timestamps_us):
+    """(timestamp_us, elapsed_milliseconds) of the first mission_state 'Start' row, or None."""
+    if 'mission_state' not in df.columns:
+        return None
+    start_rows = np.flatnonzero((df['mission_state'] == 'Start').to_numpy())
+    if len(start_rows) == 0:
+        return None
+    start_row = start_rows[0]
+    start_us = timestamps_us.iloc[start_row]
+    if pd.isna(start_us):
+        return None
+    start_elapsed = df['elapsed_milliseconds'].iloc[start_row] if 'elapsed_milliseconds' in df.columns else None
+    return int(start_us), 0 if pd.isnull(start_elapsed) else start_elapsed
+
+
+def add_elapsed_columns(df, timestamp_column='timestamp', trial_column=None):
+    """Add the mission-relative ('estimated_elapsed_ms'), stage-relative ('estimated_elapsed_ms_stage')
+    and global ('estimated_elapsed_ms_global') elapsed columns, each timestamp being parsed once.
+    The stage origin is the latest mission_stage transition at or before the row, the global origin
+    the first timestamp of the trial. With 'trial_column' the origins are taken per trial."""
+    timestamps_us = parse_timestamps_us(df[timestamp_column]).set_axis(df.index)
+    if trial_column is None:
+        groups = [(None, df.index)]
+    else:
+        groups = df.groupby(trial_column, sort=False, dropna=False).groups.items()
+
+    mission = pd.Series(np.nan, index=df.index)
+    stage = pd.Series(np.nan, index=df.index)
+    global_ = pd.Series(np.nan, index=df.index)
+    for _, index in groups:
+        trial_df = df.loc[index]
+        trial_us = timestamps_us.loc[index].astype('float64')
+        start = mission_start(trial_df, timestamps_us.loc[index])
+        if start is not None:
+            mission.loc[index] = elapsed_ms(trial_us, *start)
+        if 'mission_stage' in trial_df.columns:
+            stage_origin = trial_us.where(trial_df['mission_stage'].notna()).ffill()
+            stage.loc[index] = elapsed_ms(trial_us, stage_origin)
+        if trial_us.notna().any():
+            global_.loc[index] = elapsed_ms(trial_us, trial_us.min())
+
+    df['estimated_elapsed_ms'] = mission
+    df['estimated_elapsed_ms_stage'] = stage
+    df['estimated_elapsed_ms_global'] = global_
+    return df
@@ -1,24 +1,73 @@
 ''' functions for processing time series data '''
 
 import os
+import io
 import json
+import time
 import pandas as pd
+import numpy as np
 import csv
 from pathlib import Path
 import glob
 import hashlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
 from tqdm import tqdm
+from processing import timebase, features, collate, workspace
+
+# columns dropped from the cleaned time series, never written by the extractor
+TIME_SERIES_COLUMNS_TO_REMOVE = [
+    'metadata', 'study_version', 'MissionEndCondition', 'gold_pub_minute',
+    'alignment_alpha_bravo_delta_stage', 'TimesFrozen', 'semantic_map', 'period',
+    'motion_y', 'observers', 'BudgetExpended', 'date', 'dependencies', 'td',
+    'BombBeaconsPlaced', 'TeammatesRescued', 'locations', 'group', 'y', 'id',
+    'BombsExploded', 'door_x', 'experiment_name', 'list', 'observation', 'agent',
+    'blocks', 'responder', 'open', 'Alpha_goal', 'gelp_results',
+    'item_name', 'TeamsList', 'version', 'ParticipationCount', 'phase', 'z',
+    'corresponding_observation_number', 'observation_number', 'item_id',
+    'TotalStoreTime', 'status', 'obj', 'requester', 'currAttributes', 'Delta',
+    'additional_info', 'NumFieldVisits', 'door_y', 'compact_extractions',
+    'predictions', 'MissionVariant', 'exited_locations', 'request_time',
+    'gold_results', 'OptionalSurveys', 'alignment_alpha_bravo_trial',
+    'alignment_alpha_bravo_stage', 'type', 'separation', 'config', 'client_info',
+    'transitionsToShop', 'entered_blocks', 'alignment_bravo_delta_stage',
+    'playerScores', 'intervention_agents', 'experiment_mission', 'jag', 'priority',
+    'corrected_text', 'ExperimentName', 'agent_name', 'group_number', 'alignment',
+    'response_time_duration', 'TrialId', 'source', 'yaw', 'message',
+    'semantic_map_name', 'created_ts', 'event_properties',
+    'agent_type', 'exited_grid_location', 'left_blocks', 'exited_connections',
+    'amount_discarded', 'Bravo_goal', 'stage_start', 'respond_stage', 'ExperimentId',
+    'testbed_version', 'triggering_entity', 'equippeditemname', 'subjects',
+    'response_index', 'gold_msg_id', 'bomb_id', 'requested_tool', 'gelp_msg_id',
+    'CommBeaconsPlaced', 'experiment_date', 'PreTrialSurveys', 'subscribes',
+    'response_tool', 'TrialName', 'tool_type', 'request_stage', 'connections',
+    'callsign', 'gelp_pub_minute', 'cohesion', 'TeamId', 'DamageTaken',
+    'LastActiveMissionTime', 'alignment_bravo_delta_trial', 'player_y', 'BombsTotal',
+    'res_player_compliance_by_all_reqs', 'surveys', 'notes', 'motion_x',
+    'map_block_filename', 'grid_location', 'records', 'Team', 'utterance_id',
+    'FlagsPlaced', 'participant', 'team_id', 'door_z', 'ObjectStateChange_fuse_start_minute',
+    'TextChatsSent', 'text', 'life', 'alignment_alpha_delta_trial', 'ParticipantId',
+    'mission', 'map_name', 'state', 'experimenter', 'x', 'Bravo', 'measure_data',
+    'condition', 'time_in_store', 'FiresExtinguished', 'player_x',
+    'player_z', 'pitch', 'created', 'publishes', 'stage_end', 'owner', 'respond_time',
+    'NumCompletePostSurveys', 'remaining_sequence', 'alignment_alpha_bravo_delta_trial',
+    'complied_dyad_raw_balance', 'BombSummaryPlayer', 'changedAttributes', 'active',
+    'Members', 'experiment_author', 'extractions',
+    'dyad_compliance_by_requester_reqs', 'Delta_goal',
+    'alignment_alpha_delta_stage', 'created_elapsed_time',
+    'complied_dyad_raw', 'trial_number', 'currInv', 'PostTrialSurveys', 'swinging',
+    'motion_z', 'study_number', 'Alpha', 'name' , 'SuccessfulBombDisposals', 'response',
+    'interventions-given'
+]
+
 
 ##################################
 # functions for message extraction
 ##################################
 
 def get_timestamp(json_obj):
-    # Check for '@timestamp' at the root of the JSON object
-    if '@timestamp' in json_obj:
-        return json_obj['@timestamp']
-    # If not found, fall back to 'timestamp' within the 'msg' object
-    return json_obj.get('msg', {}).get('timestamp', '')
+    # '@timestamp' at the root of the JSON object, falling back to 'timestamp' within the 'msg' object
+    return timebase.message_timestamp(json_obj)
 
 
 def extract_trial_data(json_obj):
@@ -374,7 +423,7 @@ def extract_team_budget_update_data(json_obj):
 
 def extract_mission_stage_transition_data(json_obj):
     """Extracts data for Event:MissionStageTransition messages."""
-    timestamp = json_obj.get('@timestamp', '')
+    timestamp = get_timestamp(json_obj)
 
     extracted_data = {
         'timestamp': timestamp,
@@ -531,68 +580,144 @@ def pre_scan_for_fieldnames(folder_path):
     return list(unique_keys)
 
 
+def extract_message_rows(content):
+    """Dispatch a parsed message to its extractor and return the rows it produces."""
+    msg_type = content.get('msg', {}).get('sub_type', '')
+    data_list = []
+    if msg_type == 'Event:PlayerState':
+        data_list = [extract_player_state_data(content)]
+    elif msg_type == 'trial':
+        data_list = extract_trial_data(content)
+    elif msg_type == 'Measure:flocking':
+        data_list = extract_flocking_data(content)
+    elif msg_type == 'Event:UIClick':
+        data_list = extract_ui_click_data(content)
+    elif msg_type == 'Event:Chat':
+        data_list = extract_chat_data(content)
+    elif msg_type == 'Event:CommunicationChat':
+        data_list = extract_communication_chat_data(content)
+    elif msg_type == 'Event:CommunicationEnvironment':
+        data_list = extract_communication_environment_data(content)
+    elif msg_type == 'Event:ToolUsed':
+        data_list = extract_tool_used_data(content)
+    elif msg_type == 'Event:ObjectStateChange':
+        data_list = extract_object_state_change_data(content)
+    elif msg_type == 'Event:ScoreChange':
+        data_list = extract_score_change_data(content)
+    elif msg_type == 'Event:ItemUsed':
+        data_list = extract_item_used_data(content)
+    elif msg_type == 'Event:InterventionChat':
+        data_list = extract_intervention_chat_data(content)
+    elif msg_type == 'Intervention:Chat':
+        data_list = extract_intervention_chat_b_data(content)
+    elif msg_type == 'Event:InterventionResponse':
+        data_list = extract_intervention_response_data(content)
+    elif msg_type == 'Event:PlayerStateChange':
+        data_list = extract_player_state_change_data(content)
+    elif msg_type == 'Event:PlayerSprinting':
+        data_list = extract_player_sprinting_data(content)
+    elif msg_type == 'Event:MissionState':
+        data_list = extract_mission_state_data(content)
+    elif msg_type == 'Event:TeamBudgetUpdate':
+        data_list = extract_team_budget_update_data(content)
+    elif msg_type == 'Event:MissionStageTransition':
+        data_list = extract_mission_stage_transition_data(content)
+    return data_list
+
+
+def cleaned_fieldnames(fieldnames):
+    """Drop the removed columns from the pre-scanned fieldnames and append the derived time columns."""
+    columns_to_remove = set(TIME_SERIES_COLUMNS_TO_REMOVE)
+    return [field for field in fieldnames if field not in columns_to_remove] + ['timestamp_numeric', 'estimated_elapsed_ms']
+
+
+def find_mission_start(file_path):
+    """Cheap first pass over a metadata file returning the (epoch microseconds, elapsed_milliseconds) of
+    the first MissionState Start message, or None. Only MissionState lines are parsed as JSON."""
+    with open(file_path, 'r', encoding='utf-8') as file:
+        for line in file:
+            if 'Event:MissionState' not in line:
+                continue
+            try:
+                content = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if content.get('msg', {}).get('sub_type', '') != 'Event:MissionState':
+                continue
+            data = extract_mission_state_data(content)[0]
+            if data['mission_state'] == 'Start':
+                start_timestamp = timebase.parse_timestamp_us(data['timestamp'])
+                if start_timestamp is None:
+                    continue
+                start_elapsed = data['elapsed_milliseconds']
+                start_elapsed = start_elapsed if isinstance(start_elapsed, (int, float)) else 0
+                return start_timestamp, start_elapsed
+    return None
+
+
+def add_time_columns(row, mission_start):
+    """Normalize 'timestamp' and add 'timestamp_numeric' and 'estimated_elapsed_ms' to an extracted row,
+    matching what estimate_elapsed_milliseconds_and_convert_timestamp computes on the whole file."""
+    timestamp_us = timebase.parse_timestamp_us(row.get('timestamp', ''))
+    if timestamp_us is None:
+        row['timestamp'] = ''
+        return row
+    row['timestamp'] = timebase.format_timestamp_us(timestamp_us)
+    row['timestamp_numeric'] = timestamp_us // 1000000
+    if mission_start is not None:
+        row['estimated_elapsed_ms'] = timebase.elapsed_ms(timestamp_us, *mission_start)
+    return row
+
+
+def write_time_series_rows(file_path, csvfile, fieldnames, accumulator=None):
+    """Write the cleaned time series rows of one metadata file to an open CSV file object.
+    Each row also updates the summary accumulator if one is given; without a CSV file object
+    the rows only feed the accumulator."""
+    filename = os.path.basename(file_path)
+    mission_start = find_mission_start(file_path)
+    if mission_start is None:
+        print(f"Warning: No rows with 'mission_state' == 'Start' found in {filename}.")
+    with open(file_path, 'r', encoding='utf-8') as file:
+        writer = None
+        if csvfile is not None:
+            writer = csv.DictWriter(csvfile, fieldnames=fieldnames, extrasaction='ignore')
+            writer.writeheader()
+        for line in file:
+            try:
+                content = json.loads(line)
+                for data in extract_message_rows(content):
+                    data = add_time_columns(data, mission_start)
+                    if writer is not None:
+                        writer.writerow(data)
+                    if accumulator is not None:
+                        accumulate_summary_row(accumulator, data)
+            except json.JSONDecodeError:
+                print(f"Skipping invalid JSON line in file: {filename}")
+
+
+def extract_time_series_frame(file_path, fieldnames, accumulator=None):
+    """Extract the cleaned time series of one metadata file into a DataFrame without touching disk.
+    Rows go through an in-memory CSV buffer so the frame parses exactly like the written file."""
+    buffer = io.StringIO()
+    write_time_series_rows(file_path, buffer, fieldnames, accumulator)
+    buffer.seek(0)
+    return pd.read_csv(buffer, low_memory=False)
+
+
 # extract_and_save_data function to use pre-scanned fieldnames
-def extract_and_write_time_series(metadata_unique_dir_path, processed_time_series_dir_path):
+def extract_and_write_time_series(metadata_unique_dir_path, processed_time_series_cleaned_dir_path):
+    """Extract the time series of every metadata file straight into its cleaned form: the removed
+    columns are never written and the time columns are added as each row is extracted."""
     print("Processing time series messages...")
-    os.makedirs(processed_time_series_dir_path, exist_ok=True)
+    os.makedirs(processed_time_series_cleaned_dir_path, exist_ok=True)
     files = [f for f in os.listdir(metadata_unique_dir_path) if f.endswith('.metadata')]
-    total_files = len(files)
-    fieldnames = pre_scan_for_fieldnames(metadata_unique_dir_path)
-    for file_index, filename in enumerate(tqdm(files), start=1):
+    fieldnames = cleaned_fieldnames(pre_scan_for_fieldnames(metadata_unique_dir_path))
+    for filename in tqdm(files):
         file_path = os.path.join(metadata_unique_dir_path, filename)
         output_file_name = filename.replace('.metadata', '_TimeSeriesData.csv')
-        output_file_path = os.path.join(processed_time_series_dir_path, output_file_name)
-        with open(file_path, 'r', encoding='utf-8') as file, open(output_file_path, 'w', newline='', encoding='utf-8') as csvfile:
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames, extrasaction='ignore')
-            writer.writeheader()
-            for line in file:
-                try:
-                    content = json.loads(line)
-                    msg_type = content.get('msg', {}).get('sub_type', '')
-                    data_list = []
-                    if msg_type == 'Event:PlayerState':
-                        data_list = [extract_player_state_data(content)]
-                    elif msg_type == 'trial':
-                        data_list = extract_trial_data(content)
-                    elif msg_type == 'Measure:flocking':
-                        data_list = extract_flocking_data(content)
-                    elif msg_type == 'Event:UIClick':
-                        data_list = extract_ui_click_data(content)
-                    elif msg_type == 'Event:Chat':
-                        data_list = extract_chat_data(content)
-                    elif msg_type == 'Event:CommunicationChat':
-                        data_list = extract_communication_chat_data(content)
-                    elif msg_type == 'Event:CommunicationEnvironment':
-                        data_list = extract_communication_environment_data(content)
-                    elif msg_type == 'Event:ToolUsed':
-                        data_list = extract_tool_used_data(content)
-                    elif msg_type == 'Event:ObjectStateChange':
-                        data_list = extract_object_state_change_data(content)
-                    elif msg_type == 'Event:ScoreChange':
-                        data_list = extract_score_change_data(content)
-                    elif msg_type == 'Event:ItemUsed':
-                        data_list = extract_item_used_data(content)
-                    elif msg_type == 'Event:InterventionChat':
-                        data_list = extract_intervention_chat_data(content)
-                    elif msg_type == 'Intervention:Chat':
-                        data_list = extract_intervention_chat_b_data(content)
-                    elif msg_type == 'Event:InterventionResponse':
-                        data_list = extract_intervention_response_data(content)
-                    elif msg_type == 'Event:PlayerStateChange':
-                        data_list = extract_player_state_change_data(content)
-                    elif msg_type == 'Event:PlayerSprinting':
-                        data_list = extract_player_sprinting_data(content)
-                    elif msg_type == 'Event:MissionState':
-                        data_list = extract_mission_state_data(content)
-                    elif msg_type == 'Event:TeamBudgetUpdate':
-                        data_list = extract_team_budget_update_data(content)
-                    elif msg_type == 'Event:MissionStageTransition':
-                        data_list = extract_mission_stage_transition_data(content)
-                    for data in data_list:
-                        writer.writerow(data)
-                except json.JSONDecodeError:
-                    print(f"Skipping invalid JSON line in file: {filename}")
-        # print(f"Processed {file_index}/{total_files} files ({(file_index / total_files) * 100:.2f}%)")
+        output_file_path = os.path.join(processed_time_series_cleaned_dir_path, output_file_name)
+        with open(output_file_path, 'w', newline='', encoding='utf-8') as csvfile:
+            write_time_series_rows(file_path, csvfile, fieldnames)
 
 
 #########################################
@@ -600,22 +725,16 @@ def extract_and_write_time_series(metadata_unique_dir_path, processed_time_serie
 #########################################
 
 def estimate_elapsed_milliseconds_and_convert_timestamp(df):
-    # Convert timestamp to a numeric value (e.g., UNIX timestamp)
-    # First, ensure conversion to datetime is correct
-    df['timestamp'] = pd.to_datetime(df['timestamp'])
-    # Convert datetime to UNIX timestamp in seconds
-    df['timestamp_numeric'] = df['timestamp'].astype('int64') // 10 ** 9
-
-    # Find the start row
-    start_rows = df[df['mission_state'] == "Start"]
-    if not start_rows.empty:
-        start_row = start_rows.iloc[0]
-        start_timestamp = start_row['timestamp']
-        start_elapsed = start_row['elapsed_milliseconds'] if 'elapsed_milliseconds' in start_row and not pd.isnull(
-            start_row['elapsed_milliseconds']) else 0
-
-        # Calculate elapsed milliseconds for each row based on the 'start' timestamp
-        df['estimated_elapsed_ms'] = (df['timestamp'] - start_timestamp).dt.total_seconds() * 1000 + start_elapsed
+    # Parse each timestamp once into epoch microseconds
+    timestamps_us = timebase.parse_timestamps_us(df['timestamp']).set_axis(df.index)
+    df['timestamp'] = timebase.format_timestamps_us(timestamps_us)
+    # UNIX timestamp in seconds
+    df['timestamp_numeric'] = timestamps_us // 1000000
+
+    # Elapsed milliseconds for each row based on the 'start' timestamp
+    mission_start = timebase.mission_start(df, timestamps_us)
+    if mission_start is not None:
+        df['estimated_elapsed_ms'] = timebase.elapsed_ms(timestamps_us.astype('float64'), *mission_start)
     else:
         print("Warning: No rows with 'mission_state' == 'Start' found.")
         df['estimated_elapsed_ms'] = pd.NA  # or set to 0 or any other default value as needed
@@ -627,51 +746,6 @@ def clean_time_series(processed_time_series_dir_path,
     print("Cleaning time series messages...")
     os.makedirs(processed_time_series_cleaned_dir_path, exist_ok=True)
 
-    # List of columns to remove
-    columns_to_remove = [
-        'metadata', 'study_version', 'MissionEndCondition', 'gold_pub_minute',
-        'alignment_alpha_bravo_delta_stage', 'TimesFrozen', 'semantic_map', 'period',
-        'motion_y', 'observers', 'BudgetExpended', 'date', 'dependencies', 'td',
-        'BombBeaconsPlaced', 'TeammatesRescued', 'locations', 'group', 'y', 'id',
-        'BombsExploded', 'door_x', 'experiment_name', 'list', 'observation', 'agent',
-        'blocks', 'responder', 'open', 'Alpha_goal', 'gelp_results',
-        'item_name', 'TeamsList', 'version', 'ParticipationCount', 'phase', 'z',
-        'corresponding_observation_number', 'observation_number', 'item_id',
-        'TotalStoreTime', 'status', 'obj', 'requester', 'currAttributes', 'Delta',
-        'additional_info', 'NumFieldVisits', 'door_y', 'compact_extractions',
-        'predictions', 'MissionVariant', 'exited_locations', 'request_time',
-        'gold_results', 'OptionalSurveys', 'alignment_alpha_bravo_trial',
-        'alignment_alpha_bravo_stage', 'type', 'separation', 'config', 'client_info',
-        'transitionsToShop', 'entered_blocks', 'alignment_bravo_delta_stage',
-        'playerScores', 'intervention_agents', 'experiment_mission', 'jag', 'priority',
-        'corrected_text', 'ExperimentName', 'agent_name', 'group_number', 'alignment',
-        'response_time_duration', 'TrialId', 'source', 'yaw', 'message',
-        'semantic_map_name', 'created_ts', 'event_properties',
-        'agent_type', 'exited_grid_location', 'left_blocks', 'exited_connections',
-        'amount_discarded', 'Bravo_goal', 'stage_start', 'respond_stage', 'ExperimentId',
-        'testbed_version', 'triggering_entity', 'equippeditemname', 'subjects',
-        'response_index', 'gold_msg_id', 'bomb_id', 'requested_tool', 'gelp_msg_id',
-        'CommBeaconsPlaced', 'experiment_date', 'PreTrialSurveys', 'subscribes',
-        'response_tool', 'TrialName', 'tool_type', 'request_stage', 'connections',
-        'callsign', 'gelp_pub_minute', 'cohesion', 'TeamId', 'DamageTaken',
-        'LastActiveMissionTime', 'alignment_bravo_delta_trial', 'player_y', 'BombsTotal',
-        'res_player_compliance_by_all_reqs', 'surveys', 'notes', 'motion_x',
-        'map_block_filename', 'grid_location', 'records', 'Team', 'utterance_id',
-        'FlagsPlaced', 'participant', 'team_id', 'door_z', 'ObjectStateChange_fuse_start_minute',
-        'TextChatsSent', 'text', 'life', 'alignment_alpha_delta_trial', 'ParticipantId',
-        'mission', 'map_name', 'state', 'experimenter', 'x', 'Bravo', 'measure_data',
-        'condition', 'time_in_store', 'FiresExtinguished', 'player_x',
-        'player_z', 'pitch', 'created', 'publishes', 'stage_end', 'owner', 'respond_time',
-        'NumCompletePostSurveys', 'remaining_sequence', 'alignment_alpha_bravo_delta_trial',
-        'complied_dyad_raw_balance', 'BombSummaryPlayer', 'changedAttributes', 'active',
-        'Members', 'experiment_author', 'extractions',
-        'dyad_compliance_by_requester_reqs', 'Delta_goal',
-        'alignment_alpha_delta_stage', 'created_elapsed_time',
-        'complied_dyad_raw', 'trial_number', 'currInv', 'PostTrialSurveys', 'swinging',
-        'motion_z', 'study_number', 'Alpha', 'name' , 'SuccessfulBombDisposals', 'response',
-        'interventions-given'
-    ]
-
     # Iterate through each file in the directory
     for filename in tqdm(os.listdir(processed_time_series_dir_path)):
         if filename.endswith('.csv'):
@@ -679,7 +753,7 @@ def clean_time_series(processed_time_series_dir_path,
             df = pd.read_csv(file_path, low_memory=False)
 
             # Remove the unwanted columns
-            df.drop(columns_to_remove, axis=1, inplace=True, errors='ignore')
+            df.drop(TIME_SERIES_COLUMNS_TO_REMOVE, axis=1, inplace=True, errors='ignore')
 
             # Estimate elapsed_milliseconds and convert timestamp
             df = estimate_elapsed_milliseconds_and_convert_timestamp(df)
@@ -694,10 +768,9 @@ def clean_time_series(processed_time_series_dir_path,
 # functions to add profiles to time series
 ##########################################
 
-# Function to process and save a file
-def process_and_save_file(file_path, individuals_df, teams_df, output_folder):
-    # Read the time series CSV, convert column names to lowercase, and 'participant_id', 'trial_id' to string
-    time_series_df = pd.read_csv(file_path, low_memory=False)
+def add_profiles_to_frame(time_series_df, individuals_df, teams_df):
+    """Lowercase the time series columns and merge the player and team profiles onto every row."""
+    # Convert column names to lowercase, and 'participant_id', 'trial_id' to string
     time_series_df.columns = time_series_df.columns.str.lower()
     time_series_df['participant_id'] = time_series_df['participant_id'].astype(str)
     time_series_df['trial_id'] = time_series_df['trial_id'].astype(str)
@@ -707,6 +780,14 @@ def process_and_save_file(file_path, individuals_df, teams_df, output_folder):
 
     # Merge with teams data
     final_df = pd.merge(merged_df, teams_df, on='trial_id', how='left')
+    return final_df
+
+
+# Function to process and save a file
+def process_and_save_file(file_path, individuals_df, teams_df, output_folder):
+    # Read the time series CSV and add the profiles
+    time_series_df = pd.read_csv(file_path, low_memory=False)
+    final_df = add_profiles_to_frame(time_series_df, individuals_df, teams_df)
 
     # Prepare new file path for the output folder
     new_file_name = os.path.basename(file_path).replace('.csv', '_Profiled.csv')
@@ -717,14 +798,9 @@ def process_and_save_file(file_path, individuals_df, teams_df, output_folder):
     # print(f"Processed and saved: {new_file_name}")
 
 
-def add_profiles_to_time_series(processed_time_series_cleaned_dir_path,
-                                individual_player_profiles_trial_measures_combined_file_path,
-                                team_player_profiles_trial_measures_combined_file_path,
-                                output_dir_path):
-    print("Adding profiles to time series data...")
-    # Ensure the output directory exists
-    os.makedirs(output_dir_path, exist_ok=True)
-
+def load_profile_tables(individual_player_profiles_trial_measures_combined_file_path,
+                        team_player_profiles_trial_measures_combined_file_path):
+    """Read the player and team profile columns that get attached to the time series."""
     # Read the individual and team datasheets with specified columns
     individuals_df = pd.read_csv(individual_player_profiles_trial_measures_combined_file_path,
                                  usecols=['participant_ID', 'trial_id', 'Teamwork_potential_score',
@@ -758,6 +834,19 @@ def add_profiles_to_time_series(processed_time_series_cleaned_dir_path,
     individuals_df['participant_id'] = individuals_df['participant_id'].astype(str)
     individuals_df['trial_id'] = individuals_df['trial_id'].astype(str)
     teams_df['trial_id'] = teams_df['trial_id'].astype(str)
+    return individuals_df, teams_df
+
+
+def add_profiles_to_time_series(processed_time_series_cleaned_dir_path,
+                                individual_player_profiles_trial_measures_combined_file_path,
+                                team_player_profiles_trial_measures_combined_file_path,
+                                output_dir_path):
+    print("Adding profiles to time series data...")
+    # Ensure the output directory exists
+    os.makedirs(output_dir_path, exist_ok=True)
+
+    individuals_df, teams_df = load_profile_tables(individual_player_profiles_trial_measures_combined_file_path,
+                                                   team_player_profiles_trial_measures_combined_file_path)
 
     # Iterate over CSV files in the folder and process them
     for file_name in tqdm(os.listdir(processed_time_series_cleaned_dir_path)):
@@ -766,6 +855,86 @@ def add_profiles_to_time_series(processed_time_series_cleaned_dir_path,
             process_and_save_file(file_path, individuals_df, teams_df, output_dir_path)
 
 
+# files of the profile store, holding the profile tables as attached to the time series
+PROFILE_STORE_FILES = {'individuals': 'player_profiles.parquet', 'teams': 'team_profiles.parquet'}
+
+
+def write_profile_store(individual_player_profiles_trial_measures_combined_file_path,
+                        team_player_profiles_trial_measures_combined_file_path,
+                        profile_store_dir_path):
+    """Store the player and team profile tables once, so the time series need no profiled copies."""
+    print("Writing profile store...")
+    os.makedirs(profile_store_dir_path, exist_ok=True)
+    individuals_df, teams_df = load_profile_tables(individual_player_profiles_trial_measures_combined_file_path,
+                                                   team_player_profiles_trial_measures_combined_file_path)
+    individuals_df.to_parquet(os.path.join(profile_store_dir_path, PROFILE_STORE_FILES['individuals']), index=False)
+    teams_df.to_parquet(os.path.join(profile_store_dir_path, PROFILE_STORE_FILES['teams']), index=False)
+
+
+def load_profile_store(profile_store_dir_path):
+    """Read the stored profile tables and precompute the indexes mapping their keys to row codes."""
+    individuals_df = pd.read_parquet(os.path.join(profile_store_dir_path, PROFILE_STORE_FILES['individuals']))
+    teams_df = pd.read_parquet(os.path.join(profile_store_dir_path, PROFILE_STORE_FILES['teams']))
+    return {'individuals': individuals_df,
+            'teams': teams_df,
+            'individual_index': pd.MultiIndex.from_frame(individuals_df[['participant_id', 'trial_id']]),
+            'team_index': pd.Index(teams_df['trial_id'])}
+
+
+def take_profile_rows(profile_df, rows):
+    """Rows of a profile table by row code, a code of -1 giving missing values with the dtypes
+    a left merge would give."""
+    return profile_df.reset_index(drop=True).reindex(rows).reset_index(drop=True)
+
+
+def attach_profiles(time_series_df, profile_store):
+    """add_profiles_to_frame using the integer row codes of the profile store: each distinct key of
+    the time series is looked up once and the profile rows are taken by code. Falls back to the
+    merges when a profile key is duplicated or a profile column is already in the time series."""
+    individuals_df, teams_df = profile_store['individuals'], profile_store['teams']
+    time_series_df.columns = time_series_df.columns.str.lower()
+    time_series_df['participant_id'] = time_series_df['participant_id'].astype(str)
+    time_series_df['trial_id'] = time_series_df['trial_id'].astype(str)
+
+    player_columns = [column for column in individuals_df.columns if column not in ('participant_id', 'trial_id')]
+    team_columns = [column for column in teams_df.columns if column != 'trial_id']
+    if (not profile_store['individual_index'].is_unique or not profile_store['team_index'].is_unique
+            or time_series_df.columns.isin(player_columns + team_columns).any()):
+        return add_profiles_to_frame(time_series_df, individuals_df, teams_df)
+
+    # missing ids are keys too, matching missing profile keys as the merges do
+    key_codes, player_keys = pd.MultiIndex.from_frame(time_series_df[['participant_id', 'trial_id']]).factorize(
+        use_na_sentinel=False)
+    player_rows = profile_store['individual_index'].get_indexer(player_keys)[key_codes]
+    trial_codes, trial_keys = pd.factorize(time_series_df['trial_id'], use_na_sentinel=False)
+    team_rows = profile_store['team_index'].get_indexer(trial_keys)[trial_codes]
+    return pd.concat([time_series_df.reset_index(drop=True),
+                      take_profile_rows(individuals_df[player_columns], player_rows),
+                      take_profile_rows(teams_df[team_columns], team_rows)], axis=1)
+
+
+def read_profiled_time_series(file_path, profile_store):
+    """Read a cleaned time series file with the profiles attached, as its _Profiled copy would read."""
+    df = attach_profiles(pd.read_csv(file_path, low_memory=False), profile_store)
+    # reading a _Profiled copy turns the stringified missing ids into NaN again
+    df[['participant_id', 'trial_id']] = df[['participant_id', 'trial_id']].replace('nan', np.nan)
+    return df
+
+
+def read_time_series_files(time_series_dir_path, profile_store_dir_path=None):
+    """Yield (profiled file name, DataFrame) for each time series csv of a directory. Without a
+    profile store the directory holds the _Profiled copies; with one it holds the cleaned time
+    series and the profiles are attached as each file is read."""
+    profile_store = load_profile_store(profile_store_dir_path) if profile_store_dir_path is not None else None
+    for file in tqdm(sorted(os.listdir(time_series_dir_path))):
+        if file.endswith('.csv'):
+            file_path = os.path.join(time_series_dir_path, file)
+            if profile_store is None:
+                yield file, pd.read_csv(file_path, low_memory=False)
+            else:
+                yield file.replace('.csv', '_Profiled.csv'), read_profiled_time_series(file_path, profile_store)
+
+
 ##################################
 # functions for summarizing events
 ##################################
@@ -984,60 +1153,185 @@ def retain_one_entry_for_columns(df, columns):
 def process_file(filepath):
     """Process each file and generate summary."""
     df = pd.read_csv(filepath, low_memory=False)
-
-    # Call the function and store its return value
-    mission_state_change_outcome = record_state_change_outcome_with_prefix(df)
-
-    summary = {
-        **count_tool_usage(df),
-        'Max_Store_Visits_flocking': max_flocking_visits(df),
-        **count_playerstate_ppe(df),
-        'Trial_Info_Experiment_Mission': record_trial_info_experiment_mission(df),
-        'Communication_Messages_Count': count_communication_messages(df),
-        'Intervention_Responses_Count': count_intervention_responses(df),
-        'Trial_Info_Condition': record_trial_info_condition(df),
-        **record_trial_info_subjects(df),  # Ensure this isn't duplicating with the line below
-        'Trial_Info_Subjects': record_trial_info_subjects(df)['trial_info_subjects'],  # Adjust based on actual function return
-        'PlayerState_Is_Frozen_Count': count_playerstate_is_frozen(df),
-        'Mission_State_Change_Outcome': mission_state_change_outcome,  # Directly use the returned value
-        'Trial_Info_Map_Name': record_trial_info_map_name(df),
-        'trial_ID': record_trial_info_trial_id(df),  # Ensure key consistency (Trial_ID vs trial_id)
-        **count_toolused_target_block_type(df),
-        **count_uiclick_element_id(df),
-        **count_communicationchat_source(df),
-        **count_sprinting_start(df),
-        **count_interventionchat_b_id(df),
-        **record_team_budget_lowest(df),
-        **count_objectstatechange_outcome_by_type(df),
-        **count_chat_sender(df),
-        **count_uiclick_meta_action(df),
-        **count_communicationchat_message(df),
-        **record_max_flocking_time_in_store(df),
-        **count_playerstatechanged_health(df),
-        **find_highest_score_per_participant(df),
-        **count_interventionchat_b_source(df),
-        **retain_one_entry_for_columns(df, [
-            'team_teamwork_potential_score', 'team_teamwork_potential_category',
-            'team_taskwork_potential_score_liberal', 'team_taskwork_potential_category_liberal',
-            'team_taskwork_potential_score_conservative', 'team_taskwork_potential_category_conservative',
-            'geometric_alignment_allattributes', 'physical_alignment_allattributes',
-            'algebraic_alignment_allattributes', 'centroid_physical_alignment_allattributes',
-            'geometric_alignment_teamworkattributes', 'physical_alignment_teamworkattributes',
-            'algebraic_alignment_teamworkattributes',
-            'centroid_physical_alignment_teamworkattributes',
-            'geometric_alignment_taskworkattributes', 'physical_alignment_taskworkattributes',
-            'algebraic_alignment_taskworkattributes',
-            'centroid_physical_alignment_taskworkattributes'
-        ])
-    }
-
-    summary_for_csv = {key: value if not isinstance(value, dict) else json.dumps(value) for key, value in summary.items()}
-    summary_df = pd.DataFrame([summary_for_csv])
-    return summary_df
+    return summarize_frame(df)
+
+
+# trial summary metrics as (column, reducer, metric[, value when the column is missing]) in the
+# column order of the summary row; keyed reducers fill the '{key}' of the metric with each value,
+# '_'-joined pair or participant to name their summary columns
+SUMMARY_METRICS = [
+    ('toolused_tool_type', 'value_counts', 'toolused_count_{key}'),
+    ('flocking_visits_to_store', 'max', 'Max_Store_Visits_flocking', 0),
+    ('playerstatechanged_ppe_equipped', 'true_count', 'ppe_equipped_true_count'),
+    ('playerstatechanged_ppe_equipped', 'false_count', 'ppe_equipped_false_count'),
+    ('trial_info_experiment_mission', 'first', 'Trial_Info_Experiment_Mission'),
+    ('communicationenvironment_message', 'count', 'Communication_Messages_Count'),
+    ('interventionresponse_intervention_id', 'count', 'Intervention_Responses_Count'),
+    ('trial_info_condition', 'first', 'Trial_Info_Condition'),
+    ('trial_info_subjects', 'first_valid', 'trial_info_subjects'),
+    ('trial_info_subjects', 'first_valid', 'Trial_Info_Subjects'),
+    ('playerstatechanged_is_frozen', 'true_count', 'PlayerState_Is_Frozen_Count'),
+    ('state_change_outcome', 'first_mission_stop', 'Mission_State_Change_Outcome'),
+    ('trial_info_map_name', 'first', 'Trial_Info_Map_Name'),
+    ('trial_info_trial_id', 'first', 'trial_ID'),
+    ('toolused_target_block_type', 'value_counts', 'toolused_on_{key}'),
+    ('uiclick_element_id', 'value_counts', 'uiclick_element_id_{key}'),
+    ('communicationchat_source', 'value_counts', 'communicationchat_source_id_{key}'),
+    ('sprinting', 'true_count', 'sprinting_start_count'),
+    ('interventionchat_b_id', 'count', 'interventionchat_b_count'),
+    ('team_budget', 'min', 'team_budget_lowest'),
+    (('objectstatechange_type', 'objectstatechange_outcome'), 'pair_counts', 'objectstatechange_outcome_count_{key}'),
+    ('chat_sender', 'value_counts', 'chat_sender_count_{key}'),
+    ('uiclick_meta_action', 'value_counts', 'uiclick_meta_action_count_{key}'),
+    ('communicationchat_message', 'count', 'communicationchat_message_count'),
+    ('flocking_time_in_store', 'max', 'max_flocking_time_in_store'),
+    ('playerstatechanged_health', 'count', 'playerstatechanged_health_count'),
+    (('participant_id', 'playerscore'), 'max_by', '{key}_highest_score'),
+    ('interventionchat_b_source', 'count', 'interventionchat_b_source_count'),
+] + [(column, 'first_valid', column) for column in [
+    'team_teamwork_potential_score', 'team_teamwork_potential_category',
+    'team_taskwork_potential_score_liberal', 'team_taskwork_potential_category_liberal',
+    'team_taskwork_potential_score_conservative', 'team_taskwork_potential_category_conservative',
+    'geometric_alignment_allattributes', 'physical_alignment_allattributes',
+    'algebraic_alignment_allattributes', 'centroid_physical_alignment_allattributes',
+    'geometric_alignment_teamworkattributes', 'physical_alignment_teamworkattributes',
+    'algebraic_alignment_teamworkattributes',
+    'centroid_physical_alignment_teamworkattributes',
+    'geometric_alignment_taskworkattributes', 'physical_alignment_taskworkattributes',
+    'algebraic_alignment_taskworkattributes',
+    'centroid_physical_alignment_taskworkattributes'
+]]
+
+# reducers producing one summary entry per value rather than a single entry
+KEYED_REDUCERS = {'value_counts', 'pair_counts', 'max_by'}
+# summary value of the counting reducers when their column is missing
+MISSING_COLUMN_COUNTS = {'count', 'true_count', 'false_count'}
+
+
+# columns of the long-format trial summaries, one row per summary entry
+SUMMARY_LONG_COLUMNS = ['trial_id', 'metric', 'key', 'value']
+
+
+def summary_key(value):
+    """Key of a keyed summary entry: the value itself, or the '_'-joined pair of values."""
+    return '_'.join(str(part) for part in value) if isinstance(value, tuple) else str(value)
+
+
+def summary_column(metric, key):
+    """Wide summary column name of a (metric, key) entry."""
+    return metric.format(key=key) if '{key}' in metric else metric
+
+
+def summary_row(summary):
+    """One-row wide summary DataFrame of the summary entries."""
+    summary_for_csv = {summary_column(metric, key): value if not isinstance(value, dict) else json.dumps(value)
+                       for (metric, key), value in summary.items()}
+    return pd.DataFrame([summary_for_csv])
+
+
+def summary_long(summary, trial_id):
+    """Long-format (trial_id, metric, key, value) DataFrame of the summary entries of one trial."""
+    return pd.DataFrame({'trial_id': trial_id,
+                         'metric': [metric for metric, _ in summary],
+                         'key': [key for _, key in summary],
+                         'value': pd.Series(list(summary.values()), dtype=object)},
+                        columns=SUMMARY_LONG_COLUMNS)
+
+
+def normalized_value_counts(column):
+    """Counts of the stripped, uppercased string form of a column. Only the unique values are
+    normalized, so each column is normalized once however many flag metrics read it."""
+    codes, uniques = pd.factorize(column)
+    normalized = pd.Series(uniques, dtype=object).astype(str).str.strip().str.upper()
+    counts = np.bincount(codes[codes >= 0], minlength=len(uniques))
+    return pd.Series(counts).groupby(normalized.to_numpy()).sum().to_dict()
+
+
+def stacked_value_counts(df, columns):
+    """value_counts of several columns from a single groupby over their stacked non-null values,
+    each ordered the way Series.value_counts orders it."""
+    if not columns:
+        return {}
+    parts = [df[column].dropna().astype(object) for column in columns]
+    stacked = pd.DataFrame({'column': np.repeat(np.arange(len(columns)), [len(part) for part in parts]),
+                            'value': pd.concat(parts, ignore_index=True)})
+    sizes = stacked.groupby(['column', 'value'], sort=False).size()
+    value_counts = {column: {} for column in columns}
+    for position, column_sizes in sizes.groupby(level='column', sort=False):
+        column_sizes = column_sizes.droplevel('column').sort_values(ascending=False, kind='stable')
+        value_counts[columns[position]] = column_sizes.to_dict()
+    return value_counts
+
+
+def summary_entries(df):
+    """Trial summary entries of a profiled time series DataFrame from SUMMARY_METRICS, as
+    {(metric, key): value} in summary column order; key is '' for the single-entry metrics.
+    Non-null tests and value_counts are each computed in one pass over all the columns needing them."""
+    def present(column):
+        return all(name in df.columns for name in (column if isinstance(column, tuple) else (column,)))
+
+    # one non-null pass serves both the counts and the first valid entry of the retained columns
+    notna_columns = list(dict.fromkeys(column for column, reducer, *_ in SUMMARY_METRICS
+                                       if reducer in ('count', 'first_valid') and present(column)))
+    notna = df[notna_columns].notna().to_numpy()
+    non_null_counts = dict(zip(notna_columns, notna.sum(axis=0)))
+    first_valid_rows = dict(zip(notna_columns, np.where(notna.any(axis=0), notna.argmax(axis=0), -1)))
+    value_counts = stacked_value_counts(df, [column for column, reducer, *_ in SUMMARY_METRICS
+                                             if reducer == 'value_counts' and present(column)])
+    flags = {}
+
+    summary = {}
+    for column, reducer, key, *missing in SUMMARY_METRICS:
+        if not present(column):
+            if reducer not in KEYED_REDUCERS:
+                summary[key, ''] = missing[0] if missing else (0 if reducer in MISSING_COLUMN_COUNTS else None)
+            continue
+        if reducer == 'count':
+            summary[key, ''] = non_null_counts[column]
+        elif reducer in ('true_count', 'false_count'):
+            if column not in flags:
+                flags[column] = normalized_value_counts(df[column])
+            summary[key, ''] = flags[column].get('TRUE' if reducer == 'true_count' else 'FALSE', 0)
+        elif reducer == 'max':
+            summary[key, ''] = df[column].max()
+        elif reducer == 'min':
+            summary[key, ''] = df[column].min()
+        elif reducer == 'first':
+            summary[key, ''] = df[column].iloc[0] if not df[column].empty else None
+        elif reducer == 'first_valid':
+            first_row = first_valid_rows[column]
+            summary[key, ''] = df[column].iloc[first_row] if first_row >= 0 else None
+        elif reducer == 'first_mission_stop':
+            matches = df[column].astype(str).str.contains('MISSION_STOP_', na=False)
+            summary[key, ''] = df.loc[matches, column].iloc[0] if matches.any() else None
+        elif reducer == 'value_counts':
+            summary.update({(key, summary_key(value)): count for value, count in value_counts[column].items()})
+        elif reducer == 'pair_counts':
+            pair_counts = df.groupby(list(column)).size()
+            summary.update({(key, summary_key(pair)): count for pair, count in pair_counts.items()})
+        elif reducer == 'max_by':
+            maxima = df.groupby(column[0])[column[1]].max()
+            summary.update({(key, summary_key(value)): maximum for value, maximum in maxima.items()})
+    return summary
+
+
+def summarize_frame(df):
+    """Generate the one-row trial summary of a profiled time series DataFrame."""
+    return summary_row(summary_entries(df))
+
+
+def write_trial_summary_long(summary, trial_id, processed_trial_summary_dir_path):
+    """Write the long-format _TrialSummary_Long file of one trial's summary entries."""
+    summary_file_path = os.path.join(processed_trial_summary_dir_path, f'{trial_id}_TrialSummary_Long.csv')
+    summary_long(summary, trial_id).to_csv(summary_file_path, index=False)
+    return summary_file_path
 
 
 def summarize_events(processed_time_series_cleaned_profiled_dir_path,
-                     output_dir_path):
+                     output_dir_path,
+                     profile_store_dir_path=None):
+    """Write the long-format summary of each profiled time series. With 'profile_store_dir_path'
+    the input directory holds the cleaned time series and the profiles are attached on reading."""
     print("Summarizing time series events...")
     # input_dir = Path('C:/Post-doc Work/ASIST Study 4/Processed_TimeSeries_CSVs_Cleaned_Profiled')
     # output_dir = Path('C:/Post-doc Work/ASIST Study 4/Processed_TrialSummary_Output_CSVs')
@@ -1047,42 +1341,271 @@ def summarize_events(processed_time_series_cleaned_profiled_dir_path,
     # os.makedirs(output_dir_path, exist_ok=True)
     processed_time_series_cleaned_profiled_dir_path = Path(processed_time_series_cleaned_profiled_dir_path)
 
-    for filepath in tqdm(processed_time_series_cleaned_profiled_dir_path.glob('*.csv')):
-        # Modify the filename by replacing the suffix
-        new_filename = filepath.name.replace('_TimeSeriesData_Profiled', '_TrialSummary_Profiled')
-        output_filename = output_dir_path / new_filename
+    for file, df in read_time_series_files(processed_time_series_cleaned_profiled_dir_path, profile_store_dir_path):
+        trial_id = file.replace('_TimeSeriesData_Profiled.csv', '')
+        write_trial_summary_long(summary_entries(df), trial_id, output_dir_path)
 
-        summary_df = process_file(filepath)  # summary is already a DataFrame now
-        summary_df.to_csv(output_filename, index=False)  # Save the DataFrame directly
-        # print(f'Summary saved to {output_filename}')
 
+#############################################
+# functions for streaming trial summaries
+#############################################
 
-################################
-# functions to collate summaries
-################################
+def summary_source_columns():
+    """Profiled columns read by SUMMARY_METRICS, plus the ids the profiles are joined on."""
+    columns = {'participant_id', 'trial_id'}
+    for column, *_ in SUMMARY_METRICS:
+        columns.update(column if isinstance(column, tuple) else (column,))
+    return columns
+
+
+# cell strings pd.read_csv reads as missing, and those it reads as booleans
+CSV_NA_STRINGS = ['', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+                  '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null']
+CSV_BOOLEAN_STRINGS = {'True': True, 'TRUE': True, 'true': True, 'False': False, 'FALSE': False, 'false': False}
+
+
+def csv_string(value):
+    """The text csv.DictWriter writes for a value."""
+    return '' if value is None else str(value)
+
+
+def csv_typed_values(strings, has_blank):
+    """Type distinct cell strings the way pd.read_csv types a column holding them (and blank cells)."""
+    index = pd.Index(strings, dtype=object)
+    cells = pd.Series(strings, index=index, dtype=object)
+    missing = cells.isin(CSV_NA_STRINGS).to_numpy()
+    has_blank = has_blank or missing.any()
+    present = cells[~missing]
+    if present.empty:
+        return pd.Series(np.nan, index=index, dtype='float64')
+
+    numbers = pd.to_numeric(present, errors='coerce')
+    if numbers.notna().all():
+        numbers = pd.to_numeric(present)
+        return numbers.reindex(index).astype('float64') if has_blank else numbers
+    flags = present.map(CSV_BOOLEAN_STRINGS)
+    if flags.notna().all():
+        return flags.reindex(index).astype(object) if has_blank else flags.astype(bool)
+    return pd.Series(cells.where(~missing, np.nan).tolist(), index=index)
+
+
+def new_summary_accumulator(fieldnames):
+    """Empty accumulator of one trial's summary, fed by accumulate_summary_row as rows are extracted.
+    Only the summary columns are tracked, as tallies of their cell strings in first-appearance order."""
+    source_columns = summary_source_columns()
+    return {
+        'fields': {field: field.lower() for field in fieldnames if field.lower() in source_columns},
+        'columns': {field.lower() for field in fieldnames},
+        'rows': 0,
+        'first_row': {},
+        'tallies': {field.lower(): {} for field in fieldnames if field.lower() in source_columns},
+        'pairs': {column: {} for column, reducer, *_ in SUMMARY_METRICS if isinstance(column, tuple)},
+    }
 
-def collate_summaries(processed_trial_summary_dir_path,
-                      output_file_path):
-    print("Writing profiles trial summaries...")
-    # Use glob to list all CSV files in the source directory
-    csv_files = glob.glob(os.path.join(processed_trial_summary_dir_path, "*.csv"))
 
-    # Initialize an empty list to store dataframes
-    df_list = []
+def accumulate_summary_row(accumulator, row):
+    """Update the accumulator with one extracted (cleaned) row."""
+    fields = accumulator['fields']
+    strings = {}
+    for field, value in row.items():
+        if field in fields:
+            string = csv_string(value)
+            if string != '':
+                strings[fields[field]] = string
+    if accumulator['rows'] == 0:
+        accumulator['first_row'] = strings
+    accumulator['rows'] += 1
+    tallies = accumulator['tallies']
+    for column, string in strings.items():
+        tally = tallies[column]
+        tally[string] = tally.get(string, 0) + 1
+    for (first, second), tally in accumulator['pairs'].items():
+        if first in strings:
+            pair = (strings[first], strings.get(second, ''))
+            tally[pair] = tally.get(pair, 0) + 1
+
+
+def team_profile_values(accumulator, typed, teams_df):
+    """First valid value of each team profile column after the team merge on 'trial_id', typed the
+    way it reads back from the profiled time series."""
+    trial_ids = typed['trial_id'].astype(str)
+    trial_counts = pd.Series(accumulator['tallies']['trial_id'], dtype='int64')
+    matched = trial_ids.isin(set(teams_df['trial_id']))
+    unmatched_rows = accumulator['rows'] - int(trial_counts[matched.to_numpy()].sum())
+
+    # rows join in time series order, so the first trial id with a team profile decides
+    matched_trial_ids = trial_ids[matched]
+    team_rows = teams_df[teams_df['trial_id'] == matched_trial_ids.iloc[0]] if matched.any() else teams_df.iloc[:0]
+    values = {}
+    for column in teams_df.columns:
+        if column == 'trial_id':
+            continue
+        column_values = team_rows[column].dropna()
+        if column_values.empty:
+            values[column] = None
+            continue
+        string = csv_string(column_values.iloc[0])
+        has_blank = unmatched_rows > 0 or len(column_values) < len(team_rows)
+        values[column] = csv_typed_values([string], has_blank).iloc[0]
+    return values
+
+
+def accumulator_summary_entries(accumulator, individuals_df, teams_df):
+    """Trial summary entries from an accumulator, joining the profile columns at the end.
+    Gives the same entries as summary_entries on the profiled time series."""
+    rows = accumulator['rows']
+    typed = {column: csv_typed_values(list(tally), sum(tally.values()) < rows)
+             for column, tally in accumulator['tallies'].items()}
+    counts = {column: pd.Series(tally, dtype='int64').to_numpy() for column, tally in accumulator['tallies'].items()}
+    profile_values = team_profile_values(accumulator, typed, teams_df) if 'trial_id' in typed else {}
+    present_columns = accumulator['columns'] | set(individuals_df.columns) | set(teams_df.columns)
+
+    def present(column):
+        return all(name in present_columns for name in (column if isinstance(column, tuple) else (column,)))
+
+    def typed_pairs(column):
+        pairs = list(accumulator['pairs'][column])
+        return pd.DataFrame({
+            'first': typed[column[0]].reindex([pair[0] for pair in pairs]).to_numpy(),
+            'second': typed[column[1]].reindex([pair[1] for pair in pairs]).to_numpy(),
+            'count': list(accumulator['pairs'][column].values())})
+
+    summary = {}
+    for column, reducer, key, *missing in SUMMARY_METRICS:
+        if not present(column):
+            if reducer not in KEYED_REDUCERS:
+                summary[key, ''] = missing[0] if missing else (0 if reducer in MISSING_COLUMN_COUNTS else None)
+            continue
+        if column in profile_values:
+            summary[key, ''] = profile_values[column]
+            continue
+        if reducer in ('pair_counts', 'max_by'):
+            pairs = typed_pairs(column)
+            if reducer == 'pair_counts':
+                pair_counts = pairs.groupby(['first', 'second'])['count'].sum()
+                summary.update({(key, summary_key(pair)): count for pair, count in pair_counts.items()})
+            else:
+                maxima = pairs.groupby('first')['second'].max()
+                summary.update({(key, summary_key(value)): maximum for value, maximum in maxima.items()})
+            continue
+        if column not in typed:
+            # a profile column with nothing joined
+            typed[column], counts[column] = pd.Series([], dtype='float64'), np.array([], dtype='int64')
+        values, value_counts = typed[column], counts[column]
+        valid = values.notna().to_numpy()
+        if reducer == 'count':
+            summary[key, ''] = value_counts[valid].sum()
+        elif reducer in ('true_count', 'false_count'):
+            normalized = values.astype(str).str.strip().str.upper().to_numpy()
+            summary[key, ''] = value_counts[normalized == ('TRUE' if reducer == 'true_count' else 'FALSE')].sum()
+        elif reducer == 'max':
+            summary[key, ''] = values.max()
+        elif reducer == 'min':
+            summary[key, ''] = values.min()
+        elif reducer == 'first':
+            first_string = accumulator['first_row'].get(column)
+            summary[key, ''] = None if rows == 0 else (values[first_string] if first_string is not None else np.nan)
+        elif reducer == 'first_valid':
+            summary[key, ''] = values[valid].iloc[0] if valid.any() else None
+        elif reducer == 'first_mission_stop':
+            matches = values.astype(str).str.contains('MISSION_STOP_', na=False).to_numpy()
+            summary[key, ''] = values[matches].iloc[0] if matches.any() else None
+        elif reducer == 'value_counts':
+            tallies = pd.Series(value_counts[valid], index=values[valid].to_numpy())
+            tallies = tallies.groupby(level=0, sort=False).sum().sort_values(ascending=False, kind='stable')
+            summary.update({(key, summary_key(value)): count for value, count in tallies.items()})
+    return summary
+
+
+def summarize_accumulator(accumulator, individuals_df, teams_df):
+    """Generate the one-row trial summary from an accumulator."""
+    return summary_row(accumulator_summary_entries(accumulator, individuals_df, teams_df))
+
+
+def summarize_trial_stream(file_path, fieldnames, individuals_df, teams_df):
+    """Summary-only extraction of one metadata file: the rows only feed the accumulator.
+    Returns the summary entries."""
+    accumulator = new_summary_accumulator(fieldnames)
+    write_time_series_rows(file_path, None, fieldnames, accumulator)
+    return accumulator_summary_entries(accumulator, individuals_df, teams_df)
+
+
+def write_trial_summary_stream(file_path, fieldnames, individuals_df, teams_df, processed_trial_summary_dir_path):
+    """Write the _TrialSummary_Long file of one metadata file in summary-only mode."""
+    trial_id = os.path.basename(file_path).replace('.metadata', '')
+    return write_trial_summary_long(summarize_trial_stream(file_path, fieldnames, individuals_df, teams_df),
+                                    trial_id, processed_trial_summary_dir_path)
+
+
+def run_trial_summaries(metadata_unique_dir_path,
+                        individual_player_profiles_trial_measures_combined_file_path,
+                        team_player_profiles_trial_measures_combined_file_path,
+                        processed_trial_summary_dir_path,
+                        max_workers=None):
+    """Summary-only fast mode: write the trial summaries straight from the metadata files without
+    writing any time series."""
+    print("Summarizing trials from the metadata files...")
+    os.makedirs(processed_trial_summary_dir_path, exist_ok=True)
+    fieldnames = cleaned_fieldnames(pre_scan_for_fieldnames(metadata_unique_dir_path))
+    individuals_df, teams_df = load_profile_tables(individual_player_profiles_trial_measures_combined_file_path,
+                                                   team_player_profiles_trial_measures_combined_file_path)
+    files = [os.path.join(metadata_unique_dir_path, f) for f in sorted(os.listdir(metadata_unique_dir_path))
+             if f.endswith('.metadata')]
+    worker = partial(write_trial_summary_stream,
+                     fieldnames=fieldnames,
+                     individuals_df=individuals_df,
+                     teams_df=teams_df,
+                     processed_trial_summary_dir_path=processed_trial_summary_dir_path)
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        return list(tqdm(executor.map(worker, files), total=len(files)))
+
 
-    # Loop through the list of csv files
-    for csv_file in csv_files:
-        # Read the current CSV file and append it to the list
-        df = pd.read_csv(csv_file)
-        df_list.append(df)
+################################
+# functions to collate summaries
+################################
 
-    # Concatenate all dataframes in the list into one
-    combined_df = pd.concat(df_list, ignore_index=True)
+def typed_summary_column(values, trial_codes, trials):
+    """One wide summary column from the text values of its entries and their trial codes, typed the
+    way pd.read_csv types the column with the trials lacking an entry left blank."""
+    rows = pd.Series(values, index=trial_codes, dtype=object)
+    rows = rows[~rows.index.duplicated(keep='last')]
+    typed = csv_typed_values(list(dict.fromkeys(rows)), len(rows) < trials)
+    column = pd.Series(typed.loc[rows.to_numpy()].to_numpy(), index=rows.index)
+    return column.reindex(pd.RangeIndex(trials)) if len(rows) < trials else column.sort_index()
+
+
+def pivot_summary_store(summary_store_file_path, output_file_path=None, columns=None):
+    """Pivot the long-format summary store into one row per trial and one column per summary entry,
+    both in order of first appearance. 'columns' selects the wide columns to keep from all of them.
+    Each column is typed from its own entries, giving the DataFrame pd.read_csv reads from the
+    written table."""
+    long_df = pd.read_csv(summary_store_file_path, dtype=str, keep_default_na=False)
+    trial_codes, trial_ids = pd.factorize(long_df['trial_id'])
+    names = pd.Series([summary_column(metric, key) for metric, key in zip(long_df['metric'], long_df['key'])],
+                      dtype=object)
+    if columns is not None:
+        kept = names.isin(set(columns(list(pd.unique(names))))).to_numpy()
+        long_df, names, trial_codes = long_df[kept], names[kept], trial_codes[kept]
+
+    values = long_df['value'].to_numpy()
+    wide = {name: typed_summary_column(values[rows], trial_codes[rows], len(trial_ids))
+            for name, rows in names.groupby(names, sort=False).indices.items()}
+    wide_df = pd.DataFrame(wide, index=pd.RangeIndex(len(trial_ids)))
+    if output_file_path is not None:
+        workspace.to_csv(wide_df, output_file_path)
+    return wide_df
 
-    # Save the combined dataframe to a new CSV file
-    combined_df.to_csv(output_file_path, index=False)
 
-    # print(f'Combined CSV saved to: {output_file_path}')
+def collate_summaries(processed_trial_summary_dir_path,
+                      output_file_path,
+                      summary_store_file_path=None):
+    """Collate the long-format trial summaries into the summary store, then pivot the columns that
+    post-processing reads into the wide trial summary table. The store defaults to '<output>_long.csv'."""
+    print("Writing profiles trial summaries...")
+    if summary_store_file_path is None:
+        summary_store_file_path = f'{os.path.splitext(output_file_path)[0]}_long.csv'
+    collate.collate_directory(processed_trial_summary_dir_path, '_TrialSummary_Long.csv', summary_store_file_path)
+    pivot_summary_store(summary_store_file_path, output_file_path, columns=post_processed_summary_columns)
 
 #############################################
 # functions for trial summary post processing
@@ -1141,154 +1664,11 @@ def calculate_score_extremes(dataframe, suffix='_highest_score'):
     dataframe['player_score_min'] = dataframe[score_columns].min(axis=1)
 
 
-def process_csv(input_filepath, output_filepath):
-    """
-    Processes the CSV file according to the specified tasks.
-
-    :param input_filepath: The path to the input CSV file.
-    :param output_filepath: The path where the output CSV file will be saved.
-    """
-    # Load the CSV file into a DataFrame
-    df = pd.read_csv(input_filepath)
-
+def post_processing_removed_columns(columns):
+    """Collated summary columns that arrange_post_processed_columns removes."""
     # Define columns to remove based on suffixes and prefixes
-    columns_with_suffix = [col for col in df.columns if col.endswith('_highest_score')]
-    columns_with_prefix = [col for col in df.columns if col.startswith('chat_sender_count_')]
-
-    sum_tool_usage(df, 'Wirecutters_Used', [
-        'toolused_count_WIRECUTTERS_GREEN',
-        'toolused_count_WIRECUTTERS_RED',
-        'toolused_count_WIRECUTTERS_BLUE'
-    ])
-    sum_tool_usage(df, 'toolused_on_beacon_bomb', [
-        'toolused_on_block_beacon_bomb',
-        'toolused_on_asistmod:block_beacon_bomb'
-    ])
-    sum_tool_usage(df, 'toolused_on_beacon_hazard', [
-        'toolused_on_block_beacon_hazard',
-        'toolused_on_asistmod:block_beacon_hazard'
-    ])
-    sum_tool_usage(df, 'toolused_on_bomb_chained', [
-        'toolused_on_asistmod:block_bomb_chained',
-        'toolused_on_block_bomb_chained'
-    ])
-    sum_tool_usage(df, 'toolused_on_bomb_standard', [
-        'toolused_on_asistmod:block_bomb_standard',
-        'toolused_on_block_bomb_standard'
-    ])
-
-    sum_tool_usage(df, 'toolused_on_bomb_fire', [
-        'toolused_on_asistmod:block_bomb_fire',
-        'toolused_on_block_bomb_fire'
-    ])
-
-    rename_column(df, 'toolused_on_asistmod:block_fire_custom', 'toolused_on_fire')
-
-    rename_column(df, 'toolused_on_asistmod:block_bomb_disposer', 'toolused_on_bomb_disposer')
-
-    rename_column(df, 'trial_ID', 'trial_id')
-
-    rename_column(df, 'interventionchat_b_count', 'interventionchat_count')
-
-    ui_click_columns = [
-        'uiclick_element_id_2_1_+', 'uiclick_element_id_1_1_+', 'uiclick_element_id_0_0_+',
-        'uiclick_element_id_1_0_+', 'uiclick_element_id_0_2_+', 'uiclick_element_id_3_0_+',
-        'uiclick_element_id_2_2_+', 'uiclick_element_id_4_0_+', 'uiclick_element_id_6_1_+',
-        'uiclick_element_id_LeaveStoreButton', 'uiclick_element_id_7_0_+',
-        'uiclick_element_id_MissionBriefCloseButton', 'uiclick_element_id_0_2_-',
-        'uiclick_element_id_6_0_+', 'uiclick_element_id_7_2_+', 'uiclick_element_id_1_2_-',
-        'uiclick_element_id_1_2_+', 'uiclick_element_id_4_2_+', 'uiclick_element_id_3_2_+',
-        'uiclick_element_id_3_1_+', 'uiclick_element_id_2_0_+', 'uiclick_element_id_0_1_+',
-        'uiclick_element_id_4_2_-', 'uiclick_element_id_3_2_-', 'uiclick_element_id_5_2_+',
-        'uiclick_element_id_2_2_-', 'uiclick_element_id_4_1_+', 'uiclick_element_id_5_1_+',
-        'uiclick_element_id_6_2_+', 'uiclick_element_id_7_1_+', 'uiclick_element_id_flag_Delta_0',
-        'uiclick_element_id_2_0_-', 'uiclick_element_id_1_1_-', 'uiclick_element_id_2_1_-',
-        'uiclick_meta_action_count_PLANNING_FLAG_UPDATE', 'uiclick_element_id_7_0_-',
-        'uiclick_meta_action_count_PLANNING_FLAG_PLACED', 'uiclick_element_id_delete-button',
-        'uiclick_element_id_flag_Bravo_3', 'uiclick_element_id_flag_Bravo_2',
-        'uiclick_element_id_flag_Bravo_1', 'uiclick_element_id_flag_Bravo_0',
-        'uiclick_meta_action_count_UNDO_PLANNING_FLAG_PLACED', 'uiclick_element_id_8_1_+',
-        'uiclick_element_id_5_0_-', 'uiclick_element_id_5_0_+', 'uiclick_element_id_8_2_+',
-        'uiclick_element_id_8_0_+', 'uiclick_element_id_3_1_-', 'uiclick_element_id_0_0_-',
-        'uiclick_element_id_4_0_-', 'uiclick_element_id_6_0_-', 'uiclick_element_id_5_1_-',
-        'uiclick_element_id_4_1_-', 'uiclick_element_id_0_1_-', 'uiclick_element_id_6_1_-',
-        'uiclick_element_id_7_2_-', 'uiclick_element_id_3_0_-', 'uiclick_element_id_6_2_-',
-        'uiclick_element_id_8_1_-', 'uiclick_element_id_5_2_-', 'uiclick_element_id_7_1_-',
-        'uiclick_element_id_8_2_-', 'uiclick_element_id_8_0_-'
-    ]
-
-    task_descriptions = [
-        {
-            'new_column': 'defused_bombs_count',
-            'columns_to_sum': [
-                'objectstatechange_outcome_count_block_bomb_chained_DEFUSED',
-                'objectstatechange_outcome_count_block_bomb_fire_DEFUSED',
-                'objectstatechange_outcome_count_block_bomb_standard_DEFUSED'
-            ]
-        },
-        {
-            'new_column': 'defused_disposer_bombs_count',
-            'columns_to_sum': [
-                'objectstatechange_outcome_count_block_bomb_chained_DEFUSED_DISPOSER',
-                'objectstatechange_outcome_count_block_bomb_standard_DEFUSED_DISPOSER',
-                'objectstatechange_outcome_count_block_bomb_fire_DEFUSED_DISPOSER'
-            ]
-        },
-
-        {
-            'new_column': 'exploded_bombs_count',
-            'columns_to_sum': [
-                'objectstatechange_outcome_count_block_bomb_chained_EXPLODE_TIME_LIMIT',
-                'objectstatechange_outcome_count_block_bomb_fire_EXPLODE_TIME_LIMIT',
-                'objectstatechange_outcome_count_block_bomb_standard_EXPLODE_TIME_LIMIT',
-                'objectstatechange_outcome_count_block_bomb_chained_EXPLODE_TOOL_MISMATCH',
-                'objectstatechange_outcome_count_block_bomb_fire_EXPLODE_TOOL_MISMATCH',
-                'objectstatechange_outcome_count_block_bomb_standard_EXPLODE_TOOL_MISMATCH',
-                'objectstatechange_outcome_count_block_bomb_chained_EXPLODE_CHAINED_ERROR',
-                'objectstatechange_outcome_count_block_bomb_standard_EXPLODE_FIRE',
-                'objectstatechange_outcome_count_block_bomb_fire_EXPLODE_FIRE',
-                'objectstatechange_outcome_count_block_bomb_chained_EXPLODE_FIRE'
-            ]
-        },
-
-        {
-            'new_column': 'triggered_bombs_count',
-            'columns_to_sum': [
-                'objectstatechange_outcome_count_block_bomb_standard_TRIGGERED',
-                'objectstatechange_outcome_count_block_bomb_fire_TRIGGERED',
-                'objectstatechange_outcome_count_block_bomb_chained_TRIGGERED'
-            ]
-        },
-
-        {
-            'new_column': 'triggered_advance_seq_bombs_count',
-            'columns_to_sum': [
-                'objectstatechange_outcome_count_block_bomb_fire_TRIGGERED_ADVANCE_SEQ',
-                'objectstatechange_outcome_count_block_bomb_standard_TRIGGERED_ADVANCE_SEQ',
-                'objectstatechange_outcome_count_block_bomb_chained_TRIGGERED_ADVANCE_SEQ'
-            ]
-        }
-    ]
-
-    create_columns_based_on_criteria(df, task_descriptions)
-
-    flags_columns = [
-        # Delta flags
-        *[f'uiclick_element_id_flag_Delta_{i}' for i in range(16)],
-        # Bravo flags
-        *[f'uiclick_element_id_flag_Bravo_{i}' for i in range(23)],
-        # Alpha flags
-        *[f'uiclick_element_id_flag_Alpha_{i}' for i in range(13)],
-        # Planning actions
-        'uiclick_meta_action_count_PLANNING_FLAG_UPDATE',
-        'uiclick_meta_action_count_PLANNING_FLAG_PLACED',
-        'uiclick_meta_action_count_UNDO_PLANNING_FLAG_PLACED'
-    ]
-
-    calculate_score_extremes(df)
-
-    sum_tool_usage(df, 'uiclick_interact_count', ui_click_columns)
-    sum_tool_usage(df, 'ui_flags_interaction_count', flags_columns)
+    columns_with_suffix = [col for col in columns if col.endswith('_highest_score')]
+    columns_with_prefix = [col for col in columns if col.startswith('chat_sender_count_')]
 
     columns_to_remove = [
         'toolused_count_WIRECUTTERS_GREEN', 'toolused_count_WIRECUTTERS_RED', 'toolused_count_WIRECUTTERS_BLUE',
@@ -1304,18 +1684,62 @@ def process_csv(input_filepath, output_filepath):
     ] + columns_with_suffix + columns_with_prefix
 
     # Including dynamically generated column names for uiclick and ITEMSTACK based on patterns
-    columns_to_remove += [col for col in df.columns if 'uiclick_element_id_' in col or 'uiclick_meta_action_count_' in col]
-    columns_to_remove += [col for col in df.columns if 'ITEMSTACK' in col]
+    columns_to_remove += [col for col in columns if 'uiclick_element_id_' in col or 'uiclick_meta_action_count_' in col]
+    columns_to_remove += [col for col in columns if 'ITEMSTACK' in col]
+    return columns_to_remove
+
+
+def post_processed_summary_columns(columns):
+    """Collated summary columns that post-processing keeps or derives a registered feature from."""
+    removed = set(post_processing_removed_columns(columns))
+    feature_inputs = {column for feature in features.FEATURES.values()
+                      for column in features.feature_inputs(feature, columns)}
+    return [column for column in columns if column not in removed or column in feature_inputs]
+
+
+def arrange_post_processed_columns(dataframe):
+    """Rename and remove the collated summary columns once the derived features have been added."""
+    rename_column(dataframe, 'toolused_on_asistmod:block_fire_custom', 'toolused_on_fire')
+
+    rename_column(dataframe, 'toolused_on_asistmod:block_bomb_disposer', 'toolused_on_bomb_disposer')
+
+    rename_column(dataframe, 'trial_ID', 'trial_id')
+
+    rename_column(dataframe, 'interventionchat_b_count', 'interventionchat_count')
+
+    remove_specified_columns(dataframe, post_processing_removed_columns(dataframe.columns))
+
+
+def process_csv(input_filepath, output_filepath, feature_store_file_path=None):
+    """
+    Processes the CSV file according to the specified tasks.
+
+    :param input_filepath: The path to the input CSV file.
+    :param output_filepath: The path where the output CSV file will be saved.
+    :param feature_store_file_path: If given, the derived features come from this feature store,
+        recomputing only its missing or stale cells, instead of being computed for every trial.
+    """
+    # Load the CSV file into a DataFrame
+    df = workspace.read_csv(input_filepath)
 
-    remove_specified_columns(df, columns_to_remove)
+    # Add the registered derived features (tool usage and task sums, score extremes, ui interactions)
+    if feature_store_file_path is None:
+        feature_df = features.compute_features(df)
+    else:
+        feature_df = features.assemble_features(df, features.update_feature_store(df, feature_store_file_path))
+    existing_columns = [column for column in feature_df.columns if column in df.columns]
+    df[existing_columns] = feature_df[existing_columns]
+    df = pd.concat([df, feature_df.drop(columns=existing_columns)], axis=1)
+
+    arrange_post_processed_columns(df)
 
     # Save the modified DataFrame to a new CSV file
-    df.to_csv(output_filepath, index=False)
+    workspace.to_csv(df, output_filepath)
 
 
 def clean_and_save_csv(input_filepath, output_filepath):
     # Load the post-processed CSV file into a DataFrame
-    df = pd.read_csv(input_filepath)
+    df = workspace.read_csv(input_filepath)
 
     # Filter out rows based on 'Mission_State_Change_Outcome'
     removal_conditions = [
@@ -1332,66 +1756,64 @@ def clean_and_save_csv(input_filepath, output_filepath):
     df = df[df['team_budget_lowest'] >= -1]  # Condition b
 
     # Save the cleaned DataFrame to a new CSV file
-    df.to_csv(output_filepath, index=False)
+    workspace.to_csv(df, output_filepath)
 
 
 def post_process_trial_summaries(trial_summary_profiles_file_path,
                                  output_trial_summary_profiles_post_processed_file_path,
                                  output_trial_summary_profiles_cleaned_file_path,
                                  trial_level_team_profiles_file_path,
-                                 output_trial_summary_profiles_surveys_file_path
+                                 output_trial_summary_profiles_surveys_file_path,
+                                 feature_store_file_path=None
                                  ):
     print("Post-processing trial summaries...")
     # input_filepath = 'C:\\Post-doc Work\\ASIST Study 4\\Study_4_TrialSummary_Profiled.csv'
     # output_filepath = 'C:\\Post-doc Work\\ASIST Study 4\\Study_4_TrialSummary_Profiled_PostProcessed.csv'
-    process_csv(trial_summary_profiles_file_path, output_trial_summary_profiles_post_processed_file_path)
+    process_csv(trial_summary_profiles_file_path, output_trial_summary_profiles_post_processed_file_path,
+                feature_store_file_path)
 
     # cleaning_input_filepath = 'C:\\Post-doc Work\\ASIST Study 4\\Study_4_TrialSummary_Profiled_PostProcessed.csv'
     # cleaning_output_filepath = 'C:\\Post-doc Work\\ASIST Study 4\\Study_4_Teams_TrialSummary_Profiles_cleaned.csv'
     clean_and_save_csv(output_trial_summary_profiles_post_processed_file_path, output_trial_summary_profiles_cleaned_file_path)
 
     # cleaned_df = pd.read_csv('C:\\Post-doc Work\\ASIST Study 4\\Study_4_Teams_TrialSummary_Profiles_cleaned.csv')
-    cleaned_df = pd.read_csv(output_trial_summary_profiles_cleaned_file_path)
+    cleaned_df = workspace.read_csv(output_trial_summary_profiles_cleaned_file_path)
     # team_profiles_surveys_df = pd.read_csv('C:\\Post-doc Work\\ASIST Study 4\\Study_4_trialLevel_TeamProfiles.csv')
-    team_profiles_surveys_df = pd.read_csv(trial_level_team_profiles_file_path)
+    team_profiles_surveys_df = workspace.read_csv(trial_level_team_profiles_file_path)
     merged_df = pd.merge(cleaned_df, team_profiles_surveys_df, on='trial_id', how='inner')
     # merging_output_filepath = 'C:\\Post-doc Work\\ASIST Study 4\\Study_4_Teams_TrialSummary_Profiles_Surveys.csv'
 
     # Save the merged DataFrame to a new CSV file
-    merged_df.to_csv(output_trial_summary_profiles_surveys_file_path, index=False)
+    workspace.to_csv(merged_df, output_trial_summary_profiles_surveys_file_path)
 
 
 #####################################
 # functions for splitting time series
 #####################################
 
-def split_time_series(processed_time_series_cleaned_profiled_dir_path,
-                      output_player_state_items_objects_dir_path,
-                      output_player_state_flocking_dir_path,
-                      output_flocking_dir_path,
-                      output_team_behaviors_asi_flocking_dir_path,
-                      output_team_behaviors_flocking_dir_path,
-                      output_team_behaviors_asi_dir_path):
-    print("Splitting time series...")
-    # Define the input folder
-    # input_folder = 'C:\\Post-doc Work\\ASIST Study 4\\Processed_TimeSeries_CSVs_Cleaned_Profiled'
-
-    # Secondary columns that must be retained if primary columns have data
-    secondary_columns = [
-        "elapsed_milliseconds_stage", "timestamp", "experiment_id", "elapsed_milliseconds_global",
-        "trial_id", "timestamp_numeric", "participant_id", "estimated_elapsed_ms" , "player_teamwork_potential_score",
-        "player_taskwork_potential_score",	"player_teamwork_potential_category",
-        "player_taskwork_potential_category_liberal",	"player_taskwork_potential_category_conservative",
-        "team_teamwork_potential_score",	"team_teamwork_potential_category",	"team_taskwork_potential_score_liberal",
-        "team_taskwork_potential_category_liberal",	"team_taskwork_potential_score_conservative",
-        "team_taskwork_potential_category_conservative", 'geometric_alignment_allAttributes',
-        'physical_alignment_allAttributes', 'algebraic_alignment_allAttributes',
-        'centroid_physical_alignment_allAttributes', 'geometric_alignment_teamworkAttributes',
-        'physical_alignment_teamworkAttributes', 'algebraic_alignment_teamworkAttributes',
-        'centroid_physical_alignment_teamworkAttributes', 'geometric_alignment_taskworkAttributes',
-        'physical_alignment_taskworkAttributes', 'algebraic_alignment_taskworkAttributes',
-        'centroid_physical_alignment_taskworkAttributes']
-
+# Secondary columns that must be retained if primary columns have data
+SPLIT_SECONDARY_COLUMNS = [
+    "elapsed_milliseconds_stage", "timestamp", "experiment_id", "elapsed_milliseconds_global",
+    "trial_id", "timestamp_numeric", "participant_id", "estimated_elapsed_ms" , "player_teamwork_potential_score",
+    "player_taskwork_potential_score",	"player_teamwork_potential_category",
+    "player_taskwork_potential_category_liberal",	"player_taskwork_potential_category_conservative",
+    "team_teamwork_potential_score",	"team_teamwork_potential_category",	"team_taskwork_potential_score_liberal",
+    "team_taskwork_potential_category_liberal",	"team_taskwork_potential_score_conservative",
+    "team_taskwork_potential_category_conservative", 'geometric_alignment_allAttributes',
+    'physical_alignment_allAttributes', 'algebraic_alignment_allAttributes',
+    'centroid_physical_alignment_allAttributes', 'geometric_alignment_teamworkAttributes',
+    'physical_alignment_teamworkAttributes', 'algebraic_alignment_teamworkAttributes',
+    'centroid_physical_alignment_teamworkAttributes', 'geometric_alignment_taskworkAttributes',
+    'physical_alignment_taskworkAttributes', 'algebraic_alignment_taskworkAttributes',
+    'centroid_physical_alignment_taskworkAttributes']
+
+
+def split_configurations(output_player_state_items_objects_dir_path,
+                         output_player_state_flocking_dir_path,
+                         output_flocking_dir_path,
+                         output_team_behaviors_asi_flocking_dir_path,
+                         output_team_behaviors_flocking_dir_path,
+                         output_team_behaviors_asi_dir_path):
     # Define configurations for each set of primary columns and their output directories and suffixes
     configurations = [
         {
@@ -1511,34 +1933,113 @@ def split_time_series(processed_time_series_cleaned_profiled_dir_path,
         }
 
     ]
+    return configurations
+
+
+def split_selections(df, configurations):
+    """Rows and columns of each split of a profiled time series DataFrame, by suffix. The non-null
+    bitmap of all primary columns is computed once and every split keeps the rows where any of its
+    primary columns has data."""
+    mask_columns = list(dict.fromkeys(column for config in configurations for column in config['primary_columns']))
+    notna = df[mask_columns].notna().to_numpy()
+    positions = {column: position for position, column in enumerate(mask_columns)}
+
+    selections = {}
+    for config in configurations:
+        primary_columns = config['primary_columns']
+        rows = np.flatnonzero(notna[:, [positions[column] for column in primary_columns]].any(axis=1))
+        # Include secondary columns explicitly
+        final_columns = primary_columns + [col for col in SPLIT_SECONDARY_COLUMNS if col in df.columns]
+        selections[config['suffix']] = (rows, final_columns)
+    return selections
+
+
+def split_time_series_frame(df, file, configurations, written=None, max_workers=None):
+    """Write the split selections of one profiled time series DataFrame, returning them by suffix.
+    The splits are written concurrently; paths written are appended to 'written' when it is given."""
+    selections = split_selections(df, configurations)
+    split_frames, output_file_paths = {}, []
+    for config in configurations:
+        rows, final_columns = selections[config['suffix']]
+        split_frames[config['suffix']] = df.iloc[rows][final_columns]
+
+        # Make sure the output folder exists
+        os.makedirs(config['output_folder'], exist_ok=True)
+        output_file_paths.append(os.path.join(config['output_folder'], file.replace('.csv', config['suffix'])))
+
+    def write(suffix, output_file_path):
+        split_frames[suffix].to_csv(output_file_path, index=False)
+
+    with ThreadPoolExecutor(max_workers=max_workers or len(configurations)) as executor:
+        list(executor.map(write, split_frames, output_file_paths))
+    if written is not None:
+        written.extend(output_file_paths)
+    return split_frames
+
+
+def write_split_index(df, file, selections, split_index_dir_path):
+    """Store the split selections of one profiled time series DataFrame as row-index lists over a
+    single columnar file: the frame is written once as parquet and the rows and columns of each
+    split go to a _SplitIndex.npz file. Returns both paths."""
+    os.makedirs(split_index_dir_path, exist_ok=True)
+    columnar_file_path = os.path.join(split_index_dir_path, file.replace('.csv', '.parquet'))
+    split_index_file_path = os.path.join(split_index_dir_path, file.replace('.csv', '_SplitIndex.npz'))
+    df.to_parquet(columnar_file_path, index=False)
+    arrays = {}
+    for suffix, (rows, final_columns) in selections.items():
+        arrays[f'{suffix}:rows'] = rows
+        arrays[f'{suffix}:columns'] = np.array(final_columns, dtype=str)
+    np.savez_compressed(split_index_file_path, **arrays)
+    return columnar_file_path, split_index_file_path
+
+
+def read_split(split_index_file_path, suffix):
+    """Read one split, named by its suffix, from the columnar file of a _SplitIndex.npz file,
+    loading only the columns of the split."""
+    with np.load(split_index_file_path) as split_index:
+        rows = split_index[f'{suffix}:rows']
+        final_columns = split_index[f'{suffix}:columns'].tolist()
+    columnar_file_path = split_index_file_path.replace('_SplitIndex.npz', '.parquet')
+    df = pd.read_parquet(columnar_file_path, columns=list(dict.fromkeys(final_columns)))
+    return df.iloc[rows][final_columns]
 
-    # Iterate over all CSV files in the input folder
-    for file in tqdm(os.listdir(processed_time_series_cleaned_profiled_dir_path)):
-        if file.endswith(".csv"):
-            file_path = os.path.join(processed_time_series_cleaned_profiled_dir_path, file)
-            # Read the CSV file
-            df = pd.read_csv(file_path, low_memory=False)
-
-            for config in configurations:
-                output_folder, primary_columns, suffix = config['output_folder'], config['primary_columns'], config[
-                    'suffix']
 
-                # Make sure the output folder exists
-                os.makedirs(output_folder, exist_ok=True)
-
-                # Filter rows where any of the primary columns have data
-                filtered_df = df.dropna(subset=primary_columns, how='all')
-
-                # Include secondary columns explicitly
-                final_columns = primary_columns + [col for col in secondary_columns if col in filtered_df.columns]
-                final_df = filtered_df[final_columns]
+def split_time_series(processed_time_series_cleaned_profiled_dir_path,
+                      output_player_state_items_objects_dir_path,
+                      output_player_state_flocking_dir_path,
+                      output_flocking_dir_path,
+                      output_team_behaviors_asi_flocking_dir_path,
+                      output_team_behaviors_flocking_dir_path,
+                      output_team_behaviors_asi_dir_path,
+                      split_index_dir_path=None,
+                      profile_store_dir_path=None):
+    """Split each profiled time series into the six configured selections, writing the flocking
+    selection a second time partitioned by flocking_period (see read_flocking_period). With
+    'split_index_dir_path' the splits are stored there as row-index lists over one columnar file
+    per trial (see read_split) instead of as six csv copies. With 'profile_store_dir_path' the input
+    directory holds the cleaned time series and the profiles are attached on reading."""
+    print("Splitting time series...")
+    # Define the input folder
+    # input_folder = 'C:\\Post-doc Work\\ASIST Study 4\\Processed_TimeSeries_CSVs_Cleaned_Profiled'
 
-                # Generate output file name and path
-                output_file_name = file.replace('.csv', suffix)
-                output_file_path = os.path.join(output_folder, output_file_name)
+    configurations = split_configurations(output_player_state_items_objects_dir_path,
+                                          output_player_state_flocking_dir_path,
+                                          output_flocking_dir_path,
+                                          output_team_behaviors_asi_flocking_dir_path,
+                                          output_team_behaviors_flocking_dir_path,
+                                          output_team_behaviors_asi_dir_path)
+    flocking_periods_dir_path = os.path.join(output_team_behaviors_flocking_dir_path, FLOCKING_PERIODS_DIR_NAME)
 
-                # Save the filtered dataframe to a new CSV
-                final_df.to_csv(output_file_path, index=False)
+    # Iterate over all CSV files in the input folder
+    for file, df in read_time_series_files(processed_time_series_cleaned_profiled_dir_path, profile_store_dir_path):
+        if split_index_dir_path is None:
+            flocking_df = split_time_series_frame(df, file, configurations)[FLOCKING_SUFFIX]
+        else:
+            selections = split_selections(df, configurations)
+            write_split_index(df, file, selections, split_index_dir_path)
+            rows, final_columns = selections[FLOCKING_SUFFIX]
+            flocking_df = df.iloc[rows][final_columns]
+        write_flocking_periods(flocking_df, file.replace('.csv', FLOCKING_SUFFIX), flocking_periods_dir_path)
 
     # print("All files processed successfully.")
 
@@ -1553,9 +2054,70 @@ def create_subfolders(base_path):
         folder_path = os.path.join(base_path, f'Period_{period}')
         os.makedirs(folder_path, exist_ok=True)
 
+def split_flocking_frame(df, base_path, filename, written=None):
+    """Write the per-period copies of one TeamBehaviors_Flocking DataFrame, returning them by period."""
+    periods = ['10', '30', '60', '180']
+    period_frames = {}
+    for period in periods:
+        # Retain all rows not related to flocking or related to the specific period
+        period_df = df[(df['flocking_period'].isna()) | (df['flocking_period'] == int(period))]
+        output_folder = os.path.join(base_path, f'Period_{period}')
+        output_file = os.path.join(output_folder, f'{os.path.splitext(filename)[0]}_Period_{period}.csv')
+        period_df.to_csv(output_file, index=False)
+        period_frames[period] = period_df
+        if written is not None:
+            written.append(output_file)
+    return period_frames
+
+
+# folder below TeamBehaviors_Flocking holding the flocking split partitioned by flocking_period
+FLOCKING_PERIODS_DIR_NAME = 'FlockingPeriods'
+FLOCKING_SUFFIX = '_TeamBehaviors_Flocking.csv'
+
+
+def flocking_partition_file_path(flocking_periods_dir_path, period, filename):
+    """Parquet file of one trial in one flocking_period partition; rows not related to
+    flocking are in the 'none' partition."""
+    partition = 'none' if pd.isna(period) else str(int(float(period)))
+    return os.path.join(flocking_periods_dir_path, f'flocking_period={partition}',
+                        f'{os.path.splitext(filename)[0]}.parquet')
+
+
+def write_flocking_periods(df, filename, flocking_periods_dir_path, written=None):
+    """Write one TeamBehaviors_Flocking DataFrame once, partitioned by flocking_period. The
+    'time_series_row' column keeps the row order and 'store_stage' flags the rows during store time,
+    so read_flocking_period can rebuild any period view with or without store time. A column
+    listed both as primary and secondary is stored once."""
+    df = df.loc[:, ~df.columns.duplicated()].reset_index(drop=True)
+    if 'mission_stage' in df.columns:
+        store_stage = (df['mission_stage'].ffill() == 'STORE_STAGE').to_numpy()
+    else:
+        store_stage = np.zeros(len(df), dtype=bool)
+    df = df.assign(time_series_row=np.arange(len(df)), store_stage=store_stage)
+    for period, partition_df in df.groupby('flocking_period', dropna=False, sort=False):
+        output_file = flocking_partition_file_path(flocking_periods_dir_path, period, filename)
+        os.makedirs(os.path.dirname(output_file), exist_ok=True)
+        partition_df.to_parquet(output_file, index=False)
+        if written is not None:
+            written.append(output_file)
+
+
+def read_flocking_period(flocking_periods_dir_path, filename, period, store_time_removed=False):
+    """Materialize the Period view of one trial's TeamBehaviors_Flocking split: the rows of that
+    flocking period and the rows not related to flocking, in time series order, optionally with
+    the store time removed."""
+    partition_files = [flocking_partition_file_path(flocking_periods_dir_path, partition, filename)
+                       for partition in (np.nan, period)]
+    period_df = pd.concat([pd.read_parquet(file) for file in partition_files if os.path.exists(file)],
+                          ignore_index=True)
+    period_df = period_df.sort_values('time_series_row', kind='stable')
+    if store_time_removed:
+        period_df = period_df[~period_df['store_stage']]
+    return period_df.drop(columns=['time_series_row', 'store_stage']).reset_index(drop=True)
+
+
 def split_csv_files(base_path):
     files = glob.glob(os.path.join(base_path, '*.csv'))
-    periods = ['10', '30', '60', '180']
 
     # total_files = len(files)
     # processed_files = 0
@@ -1563,12 +2125,7 @@ def split_csv_files(base_path):
     for file in tqdm(files, desc='  Splitting CSV files'):
         df = pd.read_csv(file, low_memory=False)
         filename = os.path.basename(file)
-        for period in periods:
-            # Retain all rows not related to flocking or related to the specific period
-            period_df = df[(df['flocking_period'].isna()) | (df['flocking_period'] == int(period))]
-            output_folder = os.path.join(base_path, f'Period_{period}')
-            output_file = os.path.join(output_folder, f'{os.path.splitext(filename)[0]}_Period_{period}.csv')
-            period_df.to_csv(output_file, index=False)
+        split_flocking_frame(df, base_path, filename)
 
         # processed_files += 1
         # print(f'Status: {processed_files}/{total_files} files processed ({(processed_files / total_files) * 100:.2f}%)')
@@ -1608,6 +2165,18 @@ def generate_short_filename(long_filename):
     return short_filename
 
 
+def write_store_time_removed_frame(df, output_dir_path, filename):
+    """Write one Period_10 DataFrame with its store time removed, returning the output path."""
+    # Remove store time rows
+    df_filtered = remove_store_time(df)
+
+    # Generate a short output filename
+    short_filename = generate_short_filename(filename)
+    output_filepath = os.path.join(output_dir_path, short_filename)
+    df_filtered.to_csv(output_filepath, index=False)
+    return output_filepath
+
+
 def write_store_time_removed(team_behaviors_flocking_dir_path):
     print("Writing removed store time...")
     # print('jere', type(team_behaviors_flocking_dir_path))
@@ -1630,16 +2199,90 @@ def write_store_time_removed(team_behaviors_flocking_dir_path):
                 print(f"Error reading {filename}: {e}")
                 continue
 
-            # Remove store time rows
-            df_filtered = remove_store_time(df)
-
-            # Generate a short output filename
-            short_filename = generate_short_filename(filename)
-            output_filepath = os.path.join(output_dir_path, short_filename)
-
             try:
-                df_filtered.to_csv(output_filepath, index=False)
+                write_store_time_removed_frame(df, output_dir_path, filename)
             except Exception as e:
                 print(f"Error saving {filename}: {e}")
 
     # print("Processing complete. Filtered files are saved in 'StoreTimeRemoved' folder.")
+
+
+#####################################################
+# functions for the fused per-trial time series stage
+#####################################################
+
+def process_trial_fused(file_path, fieldnames, individuals_df, teams_df,
+                        processed_trial_summary_dir_path, configurations):
+    """Extract, profile, summarize and split one metadata file while keeping the frame in memory.
+    Only the final artifacts are written; returns their paths."""
+    time_series_file = os.path.basename(file_path).replace('.metadata', '_TimeSeriesData.csv')
+    profiled_file = time_series_file.replace('.csv', '_Profiled.csv')
+    written = []
+
+    accumulator = new_summary_accumulator(fieldnames)
+    df = extract_time_series_frame(file_path, fieldnames, accumulator)
+    df = add_profiles_to_frame(df, individuals_df, teams_df)
+    # The staged pipeline reads the profiled file back from CSV, which turns the
+    # stringified missing ids into NaN again
+    df[['participant_id', 'trial_id']] = df[['participant_id', 'trial_id']].replace('nan', np.nan)
+
+    trial_id = os.path.basename(file_path).replace('.metadata', '')
+    written.append(write_trial_summary_long(accumulator_summary_entries(accumulator, individuals_df, teams_df),
+                                            trial_id, processed_trial_summary_dir_path))
+
+    split_frames = split_time_series_frame(df, profiled_file, configurations, written)
+
+    flocking_dir_path = next(config['output_folder'] for config in configurations if config['suffix'] == FLOCKING_SUFFIX)
+    write_flocking_periods(split_frames[FLOCKING_SUFFIX], profiled_file.replace('.csv', FLOCKING_SUFFIX),
+                           os.path.join(flocking_dir_path, FLOCKING_PERIODS_DIR_NAME), written)
+    return written
+
+
+def run_fused_time_series(metadata_unique_dir_path,
+                          individual_player_profiles_trial_measures_combined_file_path,
+                          team_player_profiles_trial_measures_combined_file_path,
+                          processed_trial_summary_dir_path,
+                          output_player_state_items_objects_dir_path,
+                          output_player_state_flocking_dir_path,
+                          output_flocking_dir_path,
+                          output_team_behaviors_asi_flocking_dir_path,
+                          output_team_behaviors_flocking_dir_path,
+                          output_team_behaviors_asi_dir_path,
+                          max_workers=None):
+    """Fused replacement for extract_and_write_time_series, add_profiles_to_time_series,
+    summarize_events and split_time_series.
+    Each trial is handled by one worker of a process pool and no intermediate time series is written."""
+    print("Processing time series in fused per-trial mode...")
+    start_time = time.perf_counter()
+    os.makedirs(processed_trial_summary_dir_path, exist_ok=True)
+
+    fieldnames = cleaned_fieldnames(pre_scan_for_fieldnames(metadata_unique_dir_path))
+    individuals_df, teams_df = load_profile_tables(individual_player_profiles_trial_measures_combined_file_path,
+                                                   team_player_profiles_trial_measures_combined_file_path)
+    configurations = split_configurations(output_player_state_items_objects_dir_path,
+                                          output_player_state_flocking_dir_path,
+                                          output_flocking_dir_path,
+                                          output_team_behaviors_asi_flocking_dir_path,
+                                          output_team_behaviors_flocking_dir_path,
+                                          output_team_behaviors_asi_dir_path)
+    for config in configurations:
+        os.makedirs(config['output_folder'], exist_ok=True)
+
+    files = [os.path.join(metadata_unique_dir_path, f) for f in sorted(os.listdir(metadata_unique_dir_path))
+             if f.endswith('.metadata')]
+    worker = partial(process_trial_fused,
+                     fieldnames=fieldnames,
+                     individuals_df=individuals_df,
+                     teams_df=teams_df,
+                     processed_trial_summary_dir_path=processed_trial_summary_dir_path,
+                     configurations=configurations)
+    written = []
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        for paths in tqdm(executor.map(worker, files), total=len(files)):
+            written.extend(paths)
+
+    elapsed = time.perf_counter() - start_time
+    bytes_written = sum(os.path.getsize(path) for path in written)
+    print(f"  Fused time series: {len(files)} trials in {elapsed:.1f}s, "
+          f"{len(written)} files and {bytes_written / 1e6:.1f} MB written")
+    return {'seconds': elapsed, 'files_written': len(written), 'bytes_written': bytes_written}
@@ -0,0 +1,88 @@
+''' in-memory workspace handing tables between processing stages '''
+
+import os
+import pandas as pd
+
+# workspace the stages read from and write to while process runs, None to go straight to disk
+ACTIVE_WORKSPACE = None
+
+
+class Workspace:
+    """Tables handed between processing stages in memory, keyed by the csv file path a stage
+    writes. Each table is persisted to its csv once, at a configured checkpoint, when a stage that
+    reads the file from disk needs it, or when the workspace finishes."""
+
+    def __init__(self, checkpoints=()):
+        self.tables = {}
+        self.unsaved = set()
+        self.checkpoints = set(checkpoints)
+
+    def read_csv(self, file_path, **kwargs):
+        """Table last written to file_path, or the csv on disk; kwargs only apply to disk reads."""
+        key = os.path.abspath(file_path)
+        if key in self.tables:
+            return self.tables[key].copy()
+        return pd.read_csv(file_path, **kwargs)
+
+    def to_csv(self, df, file_path):
+        """Keep a table in memory as the latest contents of file_path."""
+        key = os.path.abspath(file_path)
+        self.tables[key] = df.reset_index(drop=True)
+        self.unsaved.add(key)
+
+    def persist(self, file_paths=None):
+        """Write the unsaved tables, or only those of the given file paths, to their csv files."""
+        keys = self.unsaved if file_paths is None else {os.path.abspath(file_path) for file_path in file_paths}
+        for key in sorted(keys & self.unsaved):
+            os.makedirs(os.path.dirname(key), exist_ok=True)
+            self.tables[key].to_csv(key, index=False)
+            self.unsaved.discard(key)
+
+    def checkpoint(self, name):
+        """Persist every unsaved table if name is one of the configured checkpoints."""
+        if name in self.checkpoints and self.unsaved:
+            print(f"Persisting workspace at checkpoint {name}...")
+            self.persist()
+
+
+def start_workspace(checkpoints=()):
+    """Open a workspace the stages hand their tables through until finish_workspace."""
+    global ACTIVE_WORKSPACE
+    ACTIVE_WORKSPACE = Workspace(checkpoints)
+    return ACTIVE_WORKSPACE
+
+
+def finish_workspace():
+    """Persist every unsaved table of the active workspace and close it."""
+    global ACTIVE_WORKSPACE
+    if ACTIVE_WORKSPACE is not None:
+        print("Persisting workspace...")
+        ACTIVE_WORKSPACE.persist()
+    ACTIVE_WORKSPACE = None
+
+
+def read_csv(file_path, **kwargs):
+    """Read a stage input through the active workspace, or from disk without one."""
+    if ACTIVE_WORKSPACE is not None:
+        return ACTIVE_WORKSPACE.read_csv(file_path, **kwargs)
+    return pd.read_csv(file_path, **kwargs)
+
+
+def to_csv(df, file_path):
+    """Write a stage output through the active workspace, or to disk without one."""
+    if ACTIVE_WORKSPACE is not None:
+        ACTIVE_WORKSPACE.to_csv(df, file_path)
+    else:
+        df.to_csv(file_path, index=False)
+
+
+def persist(file_paths=None):
+    """Persist tables of the active workspace that a stage is about to read from disk."""
+    if ACTIVE_WORKSPACE is not None:
+        ACTIVE_WORKSPACE.persist(file_paths)
+
+
+def checkpoint(name):
+    """Reach a named checkpoint of the active workspace."""
+    if ACTIVE_WORKSPACE is not None:
+        ACTIVE_WORKSPACE.checkpoint(name)